@@ -0,0 +1,280 @@
+"""
+Geração de documentação em lote pela linha de comando.
+
+Lê uma descrição por linha (JSONL, de um arquivo ou da entrada padrão), executa as gerações
+em paralelo e escreve um JSON por linha na saída assim que cada uma termina:
+
+    python batch.py descricoes.jsonl --concurrency 8 --output resultados.jsonl --pdf-dir pdfs
+    cat descricoes.jsonl | python batch.py - > resultados.jsonl
+
+Cada linha de entrada é um objeto {"id": ..., "descricao": ...} (o id é opcional) ou apenas
+uma string com a descrição. Com `--resume`, os itens já concluídos em `--output` são pulados
+e os interrompidos continuam da primeira etapa que não foi salva no checkpoint.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, IO, Optional, Set
+
+from langchain_core.runnables import Runnable
+
+from checkpoints import CheckpointStore
+from coalescing import SingleFlight
+from jobs import JOB_DONE, JOB_FAILED, Job, arun_documentation
+from pdf_generator import render_pdf
+from pipeline import create_chains_from_env, export_json
+
+
+def item_id(record: Dict[str, Any]) -> str:
+    """Id do item: o informado na entrada ou, se ausente, derivado da descrição."""
+    if record.get("id") is not None:
+        return str(record["id"])
+    return hashlib.sha256(record["descricao"].encode("utf-8")).hexdigest()[:16]
+
+
+def checkpoint_run_id(item: str, description: str, settings: Dict[str, Any]) -> str:
+    """Id da execução no checkpoint: o mesmo item com as mesmas configurações é retomado, não refeito."""
+    payload = json.dumps([item, description, settings], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def pdf_filename(item: str) -> str:
+    """
+    Nome do arquivo PDF de um item, seguro para qualquer id recebido na entrada.
+
+    Mantém só letras, números, `.`, `_` e `-` (sem caminhos nem nomes ocultos); se o id precisou
+    ser alterado, um trecho do hash do id original evita que ids diferentes gerem o mesmo nome.
+    """
+    ascii_id = unicodedata.normalize("NFKD", item).encode("ascii", "ignore").decode("ascii")
+    safe = re.sub(r"[^A-Za-z0-9._-]+", "_", ascii_id).strip("._-")[:100]
+    if safe != item:
+        digest = hashlib.sha256(item.encode("utf-8")).hexdigest()[:8]
+        safe = f"{safe}-{digest}" if safe else digest
+    return f"{safe}.pdf"
+
+
+def parse_line(line: str) -> Dict[str, Any]:
+    record = json.loads(line)
+    if isinstance(record, str):
+        record = {"descricao": record}
+    if not isinstance(record, dict) or not isinstance(record.get("descricao"), str) or not record["descricao"].strip():
+        raise ValueError("A linha deve ser uma string ou um objeto com 'descricao'")
+    return record
+
+
+def completed_items(path: str) -> Set[str]:
+    """Ids dos itens já concluídos em um arquivo de saída anterior."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Última linha cortada por uma interrupção
+                continue
+            if record.get("status") == JOB_DONE:
+                done.add(record["id"])
+    return done
+
+
+def write_pdf(results: Dict[str, Any], path: str) -> str:
+    """Gera e grava o PDF (executada no pool de processos)."""
+    with open(path, "wb") as file:
+        file.write(render_pdf(results))
+    return path
+
+
+class BatchRunner:
+    """
+    Executa os itens do lote com no máximo `concurrency` gerações simultâneas.
+
+    Cada item é salvo no checkpoint etapa por etapa; o PDF é gerado em um pool de processos
+    para não disputar o event loop com o streaming das respostas.
+    """
+
+    def __init__(
+        self,
+        chains: Dict[str, Runnable],
+        store: CheckpointStore,
+        output: IO[str],
+        concurrency: int = 8,
+        settings: Optional[Dict[str, Any]] = None,
+        pdf_dir: Optional[str] = None,
+        pdf_pool: Optional[ProcessPoolExecutor] = None,
+        skip: Optional[Set[str]] = None,
+        resume: bool = False,
+    ):
+        self.chains = chains
+        self.store = store
+        self.output = output
+        self.concurrency = concurrency
+        self.settings = settings or {}
+        self.pdf_dir = pdf_dir
+        self.pdf_pool = pdf_pool
+        self.skip = skip or set()
+        self.resume = resume
+        self.counts = {"concluidos": 0, "falhas": 0, "pulados": 0}
+        # Nomes de PDF já usados no lote (sem diferenciar maiúsculas, como em alguns sistemas de arquivos)
+        self._pdf_names: Set[str] = set()
+
+    def _pdf_path(self, item: str) -> str:
+        name = pdf_filename(item)
+        if name.casefold() in self._pdf_names:
+            digest = hashlib.sha256(item.encode("utf-8")).hexdigest()[:8]
+            name = f"{name[:-len('.pdf')]}-{digest}.pdf"
+        self._pdf_names.add(name.casefold())
+        return os.path.join(self.pdf_dir, name)
+
+    def _emit(self, record: Dict[str, Any]) -> None:
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.output.flush()
+
+    async def _start_run(self, item: str, description: str) -> str:
+        if not self.resume:
+            return await asyncio.to_thread(self.store.create_run, description, self.settings)
+        run_id = checkpoint_run_id(item, description, self.settings)
+        if await asyncio.to_thread(self.store.load, run_id) is None:
+            await asyncio.to_thread(self.store.create_run, description, self.settings, run_id)
+        return run_id
+
+    async def run_item(self, item: str, description: str) -> None:
+        started = time.monotonic()
+        run_id = await self._start_run(item, description)
+        job = Job(item, description, run_id)
+        record = {"id": item, "descricao": description, "run_id": run_id}
+        try:
+            results = await arun_documentation(
+                job, self.chains, self.store, self.settings.get("apis_paralelas", False), self.settings.get("rascunho", False)
+            )
+            record.update(status=JOB_DONE, resultado=export_json(results), erro=None)
+            if self.pdf_dir:
+                path = self._pdf_path(item)
+                loop = asyncio.get_running_loop()
+                record["pdf"] = await loop.run_in_executor(self.pdf_pool, write_pdf, results, path)
+            self.counts["concluidos"] += 1
+        except Exception as error:
+            record.update(status=JOB_FAILED, resultado=None, erro=str(error) or type(error).__name__)
+            self.counts["falhas"] += 1
+        record.update(uso=job.stats.to_dict(), duracao=round(time.monotonic() - started, 3))
+        self._emit(record)
+
+    async def run(self, source: IO[str]) -> Dict[str, int]:
+        """Lê as linhas de `source` sob demanda e executa os itens à medida que há vagas."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+        seen: Set[str] = set()
+        line_number = 0
+
+        async def guarded(item: str, description: str) -> None:
+            try:
+                await self.run_item(item, description)
+            finally:
+                semaphore.release()
+
+        while True:
+            # A leitura roda em uma thread: a entrada padrão pode demorar a produzir a próxima linha
+            line = await asyncio.to_thread(source.readline)
+            if not line:
+                break
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = parse_line(line)
+            except ValueError as error:
+                self._emit({"id": f"linha-{line_number}", "status": JOB_FAILED, "resultado": None, "erro": str(error)})
+                self.counts["falhas"] += 1
+                continue
+            item = item_id(record)
+            if item in self.skip:
+                self.counts["pulados"] += 1
+                continue
+            if item in seen:
+                # O id identifica o item na saída, no --resume e no nome do PDF
+                self._emit({"id": item, "status": JOB_FAILED, "resultado": None, "erro": f"Id repetido na linha {line_number}"})
+                self.counts["falhas"] += 1
+                continue
+            seen.add(item)
+            await semaphore.acquire()
+            task = asyncio.ensure_future(guarded(item, record["descricao"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        return self.counts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Gera a documentação técnica de várias descrições (JSONL)")
+    parser.add_argument("input", nargs="?", default="-", help="Arquivo JSONL de entrada ('-' para a entrada padrão)")
+    parser.add_argument("-o", "--output", help="Arquivo JSONL de saída (padrão: saída padrão)")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Gerações simultâneas")
+    parser.add_argument("--pdf-dir", help="Diretório onde gravar um PDF por item")
+    parser.add_argument("--pdf-workers", type=int, default=2, help="Processos que geram os PDFs")
+    parser.add_argument("--resume", action="store_true", help="Pula os itens já concluídos em --output e retoma os interrompidos")
+    parser.add_argument("--draft", action="store_true", help="Modo rascunho (uma única chamada por item)")
+    parser.add_argument("--fan-out-apis", action="store_true", help="Gera as APIs por componente, em paralelo")
+    parser.add_argument("--checkpoint", default=os.environ.get("DOC_CHECKPOINT_PATH", ".cache/execucoes.sqlite"))
+    args = parser.parse_args()
+
+    if args.resume and not args.output:
+        parser.error("--resume requer --output")
+    if args.pdf_dir:
+        os.makedirs(args.pdf_dir, exist_ok=True)
+
+    settings = {"rascunho": args.draft, "apis_paralelas": args.fan_out_apis}
+    skip = completed_items(args.output) if args.resume else set()
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    # Na retomada a saída é acrescentada ao arquivo existente
+    output = open(args.output, "a" if args.resume else "w", encoding="utf-8") if args.output else sys.stdout
+    pdf_pool = None
+    if args.pdf_dir:
+        pdf_pool = ProcessPoolExecutor(max_workers=args.pdf_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    runner = BatchRunner(
+        create_chains_from_env(SingleFlight()),
+        CheckpointStore(args.checkpoint),
+        output,
+        concurrency=args.concurrency,
+        settings=settings,
+        pdf_dir=args.pdf_dir,
+        pdf_pool=pdf_pool,
+        skip=skip,
+        resume=args.resume,
+    )
+    started = time.monotonic()
+    try:
+        counts = asyncio.run(runner.run(source))
+    except KeyboardInterrupt:
+        # As etapas concluídas ficam no checkpoint; --resume continua de onde parou
+        print("Interrompido; execute novamente com --resume para continuar", file=sys.stderr)
+        return 130
+    finally:
+        if pdf_pool is not None:
+            pdf_pool.shutdown()
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    print(
+        f"{counts['concluidos']} concluídos, {counts['falhas']} falhas, {counts['pulados']} pulados "
+        f"em {time.monotonic() - started:.1f}s",
+        file=sys.stderr,
+    )
+    return 1 if counts["falhas"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+"""
+Benchmark de ponta a ponta do pipeline de documentação.
+
+Executa as três etapas contra o modelo simulado de `fake_llm.py` (respostas da cassete, ou as
+fixas, com latência de streaming realista) e mede, para cada nível de concorrência:
+
+- tempo até o primeiro token e duração das chamadas ao modelo, por etapa;
+- percentis da latência de ponta a ponta de cada geração;
+- vazão (gerações por segundo);
+- tempo de CPU do processo por geração. Como o modelo apenas espera, é praticamente todo
+  gasto fora do LLM: prompts, callbacks, parser incremental, validação e checkpoint.
+
+Também mede isoladamente o CPU do parser incremental, do json.dumps do download e do PDF. O
+resultado é um JSON, para comparar execuções entre commits:
+
+    python benchmark.py --profile gpt-4o-mini --concurrency 1,8,32 --runs 32 -o atual.json
+    python benchmark.py --cassette .cache/cassete.json --compare anterior.json --tolerance 0.15
+
+Por padrão as gerações rodam como no app Streamlit (`run_documentation` no JobManager, uma
+thread por geração); com `--mode async` rodam como no serviço HTTP e no lote (`arun_documentation`).
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import Runnable
+
+from batch import parse_line
+from checkpoints import CheckpointStore
+from fake_llm import ReplayChatModel, detect_stage, split_tokens
+from jobs import JOB_DONE, Job, JobManager, arun_documentation, run_documentation
+from json_stream import IncrementalJSONParser
+from pdf_generator import render_pdf
+from pipeline import STAGES, create_chains, export_json
+
+# Perfis de latência do modelo simulado (segundos), próximos dos observados na API
+LATENCY_PROFILES: Dict[str, Dict[str, float]] = {
+    "instantaneo": {"latency": 0.0, "latency_jitter": 0.0, "token_delay": 0.0, "token_jitter": 0.0},
+    "gpt-4o-mini": {"latency": 0.45, "latency_jitter": 0.25, "token_delay": 0.012, "token_jitter": 0.006},
+    "gpt-4o": {"latency": 0.7, "latency_jitter": 0.4, "token_delay": 0.02, "token_jitter": 0.01},
+    "lento": {"latency": 2.0, "latency_jitter": 1.5, "token_delay": 0.04, "token_jitter": 0.02},
+}
+
+# Versão do formato do JSON de resultados
+RESULT_VERSION = 1
+
+# Métricas comparadas com `--compare`: caminho no resultado e se valores maiores são piores
+COMPARED_METRICS = [
+    (("latencia", "p50"), True),
+    (("latencia", "p95"), True),
+    (("vazao",), False),
+    (("cpu", "por_execucao"), True),
+]
+
+
+def summarize(values: Sequence[float]) -> Optional[Dict[str, float]]:
+    """Percentis, média e máximo (em segundos, arredondados) de uma amostra."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def percentile(fraction: float) -> float:
+        # Interpolação linear entre os vizinhos mais próximos
+        position = fraction * (len(ordered) - 1)
+        low = int(position)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+    return {
+        "p50": round(percentile(0.50), 4),
+        "p90": round(percentile(0.90), 4),
+        "p95": round(percentile(0.95), 4),
+        "p99": round(percentile(0.99), 4),
+        "media": round(statistics.fmean(ordered), 4),
+        "max": round(ordered[-1], 4),
+        "n": len(ordered),
+    }
+
+
+class CallTimer(BaseCallbackHandler):
+    """Registra o tempo até o primeiro token e a duração de cada chamada ao modelo, por etapa."""
+
+    # Executado na própria thread (ou event loop) da chamada, sem atrasar os instantes medidos
+    run_inline = True
+
+    def __init__(self):
+        self._calls: Dict[uuid.UUID, List[Any]] = {}
+        self._lock = threading.Lock()
+        self.ttft: Dict[str, List[float]] = defaultdict(list)
+        self.duration: Dict[str, List[float]] = defaultdict(list)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._calls.clear()
+            self.ttft.clear()
+            self.duration.clear()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: uuid.UUID, **kwargs: Any) -> None:
+        prompt = "\n".join(str(message.content) for message in messages[0])
+        with self._lock:
+            # [etapa, início, primeiro token já registrado]
+            self._calls[run_id] = [detect_stage(prompt), time.perf_counter(), False]
+
+    def on_llm_new_token(self, token: str, *, run_id: uuid.UUID, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            call = self._calls.get(run_id)
+            if call is not None and not call[2]:
+                call[2] = True
+                self.ttft[call[0]].append(now - call[1])
+
+    def on_llm_end(self, response: Any, *, run_id: uuid.UUID, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            call = self._calls.pop(run_id, None)
+            if call is not None:
+                self.duration[call[0]].append(now - call[1])
+
+    def on_llm_error(self, error: BaseException, *, run_id: uuid.UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._calls.pop(run_id, None)
+
+
+def descriptions(path: Optional[str], count: int) -> List[str]:
+    """Descrições das gerações: as do arquivo JSONL (repetidas até `count`) ou sintéticas, todas distintas."""
+    if path:
+        with open(path, encoding="utf-8") as file:
+            base = [parse_line(line)["descricao"] for line in file if line.strip()]
+        if not base:
+            raise ValueError(f"Nenhuma descrição em {path}")
+        return [base[index % len(base)] for index in range(count)]
+    return [
+        f"Sistema de gestão número {index}: usuários cadastram, consultam e acompanham pedidos, "
+        f"com autenticação, notificações por e-mail e relatórios mensais."
+        for index in range(count)
+    ]
+
+
+def run_threads(chains: Dict[str, Runnable], store: CheckpointStore, items: List[str], concurrency: int, draft: bool, fan_out: bool) -> List[Job]:
+    """Executa as gerações como o app Streamlit: `run_documentation` em um JobManager."""
+    manager = JobManager(max_workers=concurrency)
+    try:
+        jobs = [
+            manager.submit(
+                description,
+                lambda job: run_documentation(job, chains, store, fan_out, draft),
+                store.create_run(description, {"benchmark": True}),
+            )
+            for description in items
+        ]
+        while not all(job.finished for job in jobs):
+            time.sleep(0.02)
+    finally:
+        manager.shutdown()
+    return jobs
+
+
+async def run_async(chains: Dict[str, Runnable], store: CheckpointStore, items: List[str], concurrency: int, draft: bool, fan_out: bool) -> List[Job]:
+    """Executa as gerações como o serviço HTTP e o lote: `arun_documentation` em um único event loop."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, description: str) -> Job:
+        async with semaphore:
+            run_id = await asyncio.to_thread(store.create_run, description, {"benchmark": True})
+            job = Job(str(index), description, run_id)
+            job.begin()
+            try:
+                await arun_documentation(job, chains, store, fan_out, draft)
+            except Exception as error:
+                job.finish(str(error) or type(error).__name__)
+            else:
+                job.finish()
+            return job
+
+    return list(await asyncio.gather(*(run(index, description) for index, description in enumerate(items))))
+
+
+def measure_level(
+    chains: Dict[str, Runnable],
+    store: CheckpointStore,
+    timer: CallTimer,
+    items: List[str],
+    concurrency: int,
+    mode: str,
+    draft: bool,
+    fan_out: bool,
+) -> Dict[str, Any]:
+    """Executa `items` com `concurrency` gerações simultâneas e resume as medidas."""
+    timer.reset()
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    if mode == "async":
+        jobs = asyncio.run(run_async(chains, store, items, concurrency, draft, fan_out))
+    else:
+        jobs = run_threads(chains, store, items, concurrency, draft, fan_out)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    completed = [job for job in jobs if job.status == JOB_DONE]
+    retries = defaultdict(int)
+    for job in jobs:
+        for key, value in job.stats.to_dict().items():
+            retries[key] += value
+    return {
+        "concorrencia": concurrency,
+        "execucoes": len(jobs),
+        "falhas": len(jobs) - len(completed),
+        "erros": sorted({job.error for job in jobs if job.error})[:5],
+        "duracao": round(elapsed, 3),
+        "vazao": round(len(completed) / elapsed, 4) if elapsed else None,
+        "latencia": summarize([job.finished_at - job.started_at for job in completed]),
+        "ttft": {stage: summarize(values) for stage, values in sorted(timer.ttft.items())},
+        "chamadas": {stage: summarize(values) for stage, values in sorted(timer.duration.items())},
+        "cpu": {"total": round(cpu, 4), "por_execucao": round(cpu / len(jobs), 4) if jobs else None},
+        "uso": dict(retries),
+    }
+
+
+def measure_components(results: Dict[str, Any], repeats: int) -> Dict[str, Any]:
+    """CPU (ms por geração) do parser incremental, do json.dumps do download e do PDF de um resultado."""
+
+    def cpu_ms(function, count: int) -> float:
+        started = time.process_time()
+        for _ in range(count):
+            function()
+        return round((time.process_time() - started) * 1000 / count, 3)
+
+    # Textos das etapas em trechos de um token, como chegam do streaming
+    streams = [split_tokens(json.dumps(results[stage], ensure_ascii=False)) for stage in STAGES if stage in results]
+
+    def parse() -> None:
+        for pieces in streams:
+            parser = IncrementalJSONParser()
+            for piece in pieces:
+                parser.feed(piece)
+            parser.close()
+
+    return {
+        "parse_json_ms": cpu_ms(parse, repeats),
+        "json_dumps_ms": cpu_ms(lambda: json.dumps(export_json(results), indent=2, ensure_ascii=False), repeats),
+        "pdf_ms": cpu_ms(lambda: render_pdf(results), max(1, repeats // 4)),
+        "tamanho_json": len(json.dumps(export_json(results), ensure_ascii=False)),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=5, check=True,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compara dois resultados por nível de concorrência.
+
+    Returns:
+        list: Descrições das métricas que pioraram mais que `tolerance` (fração)
+    """
+    if previous.get("configuracao") != current.get("configuracao"):
+        print("Aviso: os resultados comparados usam configurações diferentes", file=sys.stderr)
+    regressions = []
+    levels = {level["concorrencia"]: level for level in previous.get("resultados", [])}
+    for level in current["resultados"]:
+        before = levels.get(level["concorrencia"])
+        if before is None:
+            continue
+        for path, higher_is_worse in COMPARED_METRICS:
+            old, new = before, level
+            for key in path:
+                old = (old or {}).get(key)
+                new = (new or {}).get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            name = ".".join(path)
+            print(f"c={level['concorrencia']:<4} {name:<18} {old:>10.4f} -> {new:>10.4f} ({change:+.1%})", file=sys.stderr)
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append(f"c={level['concorrencia']} {name}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do pipeline com o modelo simulado")
+    parser.add_argument("--profile", choices=sorted(LATENCY_PROFILES), default="gpt-4o-mini", help="Perfil de latência do modelo")
+    parser.add_argument("--cassette", help="Cassete com respostas gravadas (padrão: respostas fixas)")
+    parser.add_argument("--input", help="Descrições (JSONL, como no batch.py); padrão: descrições sintéticas")
+    parser.add_argument("-c", "--concurrency", default="1,8", help="Níveis de concorrência, separados por vírgula")
+    parser.add_argument("--runs", type=int, default=8, help="Gerações por nível (no mínimo a concorrência)")
+    parser.add_argument("--mode", choices=["threads", "async"], default="threads")
+    parser.add_argument("--draft", action="store_true", help="Modo rascunho (uma única chamada por geração)")
+    parser.add_argument("--fan-out-apis", action="store_true", help="Gera as APIs por componente, em paralelo")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fração de chamadas com erro de conexão")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fração de respostas com JSON truncado")
+    parser.add_argument("--component-repeats", type=int, default=20, help="Repetições das medidas de CPU por componente")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Arquivo do resultado JSON (padrão: saída padrão)")
+    parser.add_argument("--compare", help="Resultado anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Piora máxima aceita em --compare (fração)")
+    args = parser.parse_args()
+
+    try:
+        levels = [int(value) for value in args.concurrency.split(",")]
+    except ValueError:
+        parser.error("--concurrency deve ser uma lista de inteiros, como 1,8,32")
+
+    timer = CallTimer()
+    llm = ReplayChatModel(
+        cassette_path=args.cassette,
+        failure_rate=args.failure_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+        callbacks=[timer],
+        **LATENCY_PROFILES[args.profile],
+    )
+    # Sem caches: cada geração passa pelas três chamadas ao modelo
+    chains = create_chains(llm, llm.model_name, 0.7)
+    results = []
+    # Checkpoint descartável, removido ao final das medidas
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as directory:
+        store = CheckpointStore(os.path.join(directory, "execucoes.sqlite"))
+        try:
+            for concurrency in levels:
+                items = descriptions(args.input, max(args.runs, concurrency))
+                level = measure_level(chains, store, timer, items, concurrency, args.mode, args.draft, args.fan_out_apis)
+                results.append(level)
+                latency = level["latencia"] or {}
+                print(
+                    f"c={concurrency}: {level['execucoes'] - level['falhas']}/{level['execucoes']} em {level['duracao']}s, "
+                    f"{level['vazao']} ger/s, p50 {latency.get('p50')}s, p95 {latency.get('p95')}s, "
+                    f"CPU {level['cpu']['por_execucao']}s/ger",
+                    file=sys.stderr,
+                )
+        finally:
+            store.engine.dispose()
+
+    # Uma geração de amostra fornece o resultado usado nas medidas por componente
+    sample = run_documentation(Job("amostra", descriptions(args.input, 1)[0]), chains, None, args.fan_out_apis, args.draft)
+    output = {
+        "versao": RESULT_VERSION,
+        "commit": git_commit(),
+        "data": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "configuracao": {
+            "perfil": args.profile,
+            "latencias": LATENCY_PROFILES[args.profile],
+            "cassete": args.cassette,
+            "modo": args.mode,
+            "rascunho": args.draft,
+            "apis_paralelas": args.fan_out_apis,
+            "taxa_falhas": args.failure_rate,
+            "taxa_json_truncado": args.malformed_rate,
+            "semente": args.seed,
+        },
+        "resultados": results,
+        "componentes": measure_components(sample, args.component_repeats),
+    }
+
+    text = json.dumps(output, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(json.load(file), output, args.tolerance)
+        if regressions:
+            print("Regressões acima da tolerância:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
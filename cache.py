@@ -0,0 +1,394 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+import zstandard
+from langchain_core.runnables import Runnable, RunnableConfig
+from sqlalchemy import Column, Float, Integer, LargeBinary, MetaData, String, Table, create_engine, event, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+
+
+def make_cache_key(template: str, model: str, temperature: float, inputs: Dict[str, Any]) -> str:
+    """
+    Gera a chave de cache de uma chamada de chain.
+
+    Args:
+        template (str): Template do prompt usado na etapa
+        model (str): Nome do modelo
+        temperature (float): Temperatura do modelo
+        inputs (dict): Variáveis passadas ao prompt
+
+    Returns:
+        str: Hash SHA-256 que identifica a chamada
+    """
+    payload = json.dumps(
+        {
+            "template": template,
+            "model": model,
+            "temperature": round(float(temperature), 4),
+            "inputs": inputs,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Cache LRU em memória, limitado por número de entradas e por tamanho em bytes."""
+
+    def __init__(self, max_entries: int = 256, max_bytes: Optional[int] = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeof(value: str) -> int:
+        return len(value.encode("utf-8"))
+
+    def get(self, key: str) -> Optional[str]:
+        """Retorna o valor armazenado (marcando-o como recente) ou None."""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        """Armazena um valor, removendo as entradas menos usadas se necessário."""
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= self._sizeof(old)
+            self._data[key] = value
+            self._bytes += size
+
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= self._sizeof(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Retorna contadores de acertos, falhas, remoções e ocupação."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_metadata = MetaData()
+
+_response_cache_table = Table(
+    "response_cache",
+    _metadata,
+    Column("key", String(64), primary_key=True),
+    Column("value", LargeBinary, nullable=False),
+    Column("size", Integer, nullable=False),
+    Column("created_at", Float, nullable=False),
+    Column("accessed_at", Float, nullable=False, index=True),
+    Column("expires_at", Float, nullable=True, index=True),
+)
+
+
+class DiskCache:
+    """
+    Cache persistente em SQLite, compartilhado entre processos.
+
+    Os valores são comprimidos com zstd. O banco usa WAL e busy_timeout para permitir
+    leituras e escritas concorrentes de vários workers do Streamlit.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: Optional[float] = 7 * 24 * 3600,
+        max_bytes: Optional[int] = 512 * 1024 * 1024,
+        compression_level: int = 6,
+        evict_every: int = 32,
+    ):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30, "check_same_thread": False})
+        event.listen(self.engine, "connect", self._configure_connection)
+        try:
+            _metadata.create_all(self.engine)
+        except OperationalError as error:
+            # Outro processo criou o schema entre a verificação e o CREATE TABLE
+            if "already exists" not in str(error):
+                raise
+
+    @staticmethod
+    def _configure_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
+
+    def _compress(self, value: str) -> bytes:
+        # Instâncias de ZstdCompressor não são thread-safe; criamos uma por chamada
+        return zstandard.ZstdCompressor(level=self.compression_level).compress(value.encode("utf-8"))
+
+    @staticmethod
+    def _decompress(blob: bytes) -> str:
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+
+    def get(self, key: str) -> Optional[str]:
+        """Retorna o valor armazenado, se existir e não estiver expirado."""
+        now = time.time()
+        table = _response_cache_table
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                select(table.c.value, table.c.expires_at).where(table.c.key == key)
+            ).first()
+            if row is None or (row.expires_at is not None and row.expires_at <= now):
+                with self._lock:
+                    self.misses += 1
+                return None
+            conn.execute(table.update().where(table.c.key == key).values(accessed_at=now))
+
+        with self._lock:
+            self.hits += 1
+        return self._decompress(row.value)
+
+    def set(self, key: str, value: str) -> None:
+        """Armazena um valor comprimido, aplicando TTL e limite de tamanho."""
+        now = time.time()
+        blob = self._compress(value)
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+        stmt = sqlite_insert(_response_cache_table).values(
+            key=key, value=blob, size=len(blob), created_at=now, accessed_at=now, expires_at=expires_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={
+                "value": stmt.excluded.value,
+                "size": stmt.excluded.size,
+                "created_at": stmt.excluded.created_at,
+                "accessed_at": stmt.excluded.accessed_at,
+                "expires_at": stmt.excluded.expires_at,
+            },
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Remove entradas expiradas e, se necessário, as menos acessadas até caber em max_bytes."""
+        table = _response_cache_table
+        removed = 0
+        with self.engine.begin() as conn:
+            result = conn.execute(table.delete().where(table.c.expires_at.is_not(None), table.c.expires_at <= time.time()))
+            removed += result.rowcount or 0
+
+            if self.max_bytes is None:
+                return removed
+
+            total = conn.execute(select(func.coalesce(func.sum(table.c.size), 0))).scalar_one()
+            if total <= self.max_bytes:
+                return removed
+
+            excess = total - self.max_bytes
+            victims = []
+            for row in conn.execute(select(table.c.key, table.c.size).order_by(table.c.accessed_at)):
+                victims.append(row.key)
+                excess -= row.size
+                if excess <= 0:
+                    break
+            if victims:
+                conn.execute(table.delete().where(table.c.key.in_(victims)))
+                removed += len(victims)
+        return removed
+
+    def clear(self) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(_response_cache_table.delete())
+
+    def stats(self) -> Dict[str, int]:
+        table = _response_cache_table
+        with self.engine.connect() as conn:
+            entries, size = conn.execute(
+                select(func.count(), func.coalesce(func.sum(table.c.size), 0))
+            ).one()
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+class TieredCache:
+    """Combina um cache em memória (L1) com um cache em disco compartilhado (L2)."""
+
+    def __init__(self, memory: LRUCache, disk: DiskCache):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self.disk.get(key)
+        if value is not None:
+            # Promove para a memória para as próximas leituras deste processo
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.disk.clear()
+
+    def stats(self) -> Dict[str, int]:
+        memory = self.memory.stats()
+        disk = self.disk.stats()
+        return {
+            "hits": memory["hits"] + disk["hits"],
+            "misses": disk["misses"],
+            "entries": memory["entries"],
+            "bytes": memory["bytes"],
+            "disk_entries": disk["entries"],
+            "disk_bytes": disk["bytes"],
+        }
+
+
+def response_cache_from_env():
+    """
+    Cache de respostas configurado pelas variáveis de ambiente.
+
+    Usa memória como primeiro nível e um SQLite em disco (DOC_CACHE_PATH) compartilhado
+    entre os workers. Defina DOC_CACHE_PATH como vazio para usar apenas a memória.
+    """
+    memory = LRUCache(max_entries=512)
+    path = os.environ.get("DOC_CACHE_PATH", ".cache/respostas.sqlite")
+    if not path:
+        return memory
+    ttl_hours = float(os.environ.get("DOC_CACHE_TTL_HOURS", "168"))
+    max_mb = int(os.environ.get("DOC_CACHE_MAX_MB", "512"))
+    return TieredCache(memory, DiskCache(path, ttl_seconds=ttl_hours * 3600, max_bytes=max_mb * 1024 * 1024))
+
+
+class CachedChain(Runnable[Dict[str, Any], str]):
+    """
+    Envolve uma chain `prompt | llm | StrOutputParser()` com um cache de respostas.
+
+    Em caso de acerto a resposta é devolvida sem chamar o modelo; em caso de falha
+    a chain é executada normalmente (inclusive em streaming) e o texto final é armazenado.
+    """
+
+    def __init__(
+        self,
+        chain: Runnable,
+        cache: Any,
+        template: str,
+        model: str,
+        temperature: float,
+        validate: Optional[Callable[[str], bool]] = None,
+    ):
+        self.chain = chain
+        self.cache = cache
+        self.template = template
+        self.model = model
+        self.temperature = temperature
+        # Respostas rejeitadas por `validate` não são armazenadas
+        self.validate = validate
+
+    def _store(self, key: str, result: str) -> None:
+        if self.validate is None or self.validate(result):
+            self.cache.set(key, result)
+
+    def cache_key(self, inputs: Dict[str, Any]) -> str:
+        return make_cache_key(self.template, self.model, self.temperature, inputs)
+
+    def invoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        key = self.cache_key(input)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = self.chain.invoke(input, config, **kwargs)
+        self._store(key, result)
+        return result
+
+    async def ainvoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        key = self.cache_key(input)
+        # O cache em disco (SQLite e zstd) roda em uma thread, fora do event loop
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached
+        result = await self.chain.ainvoke(input, config, **kwargs)
+        await asyncio.to_thread(self._store, key, result)
+        return result
+
+    def stream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        key = self.cache_key(input)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        for chunk in self.chain.stream(input, config, **kwargs):
+            parts.append(chunk)
+            yield chunk
+        self._store(key, "".join(parts))
+
+    async def astream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        key = self.cache_key(input)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        async for chunk in self.chain.astream(input, config, **kwargs):
+            parts.append(chunk)
+            yield chunk
+        await asyncio.to_thread(self._store, key, "".join(parts))
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, Float, MetaData, String, Table, Text, create_engine, event, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+# Situação de uma execução
+RUNNING = "em_andamento"
+COMPLETED = "concluida"
+FAILED = "falhou"
+
+# Concessão (segundos) de uma execução em andamento: o worker que a executa a renova a cada
+# terço desse tempo; sem renovação, a execução é considerada interrompida e pode ser retomada
+RUN_LEASE = 60.0
+
+# Validade (segundos) de uma chave de idempotência; depois disso a chave pode ser reutilizada
+IDEMPOTENCY_TTL = 24 * 3600.0
+
+_metadata = MetaData()
+
+_runs_table = Table(
+    "runs",
+    _metadata,
+    Column("run_id", String(32), primary_key=True),
+    Column("description", Text, nullable=False),
+    Column("settings", Text, nullable=False),
+    Column("status", String(16), nullable=False),
+    Column("error", Text),
+    Column("created_at", Float, nullable=False),
+    Column("updated_at", Float, nullable=False, index=True),
+)
+
+_run_stages_table = Table(
+    "run_stages",
+    _metadata,
+    Column("run_id", String(32), primary_key=True),
+    Column("stage", String(32), primary_key=True),
+    Column("result", Text, nullable=False),
+    Column("created_at", Float, nullable=False),
+)
+
+_idempotency_table = Table(
+    "idempotency_keys",
+    _metadata,
+    Column("key", String(255), primary_key=True),
+    Column("run_id", String(32), nullable=False),
+    Column("fingerprint", String(64), nullable=False),
+    Column("created_at", Float, nullable=False, index=True),
+)
+
+
+class IdempotencyConflict(ValueError):
+    """A chave de idempotência já foi usada com outra descrição ou outras configurações."""
+
+
+def request_fingerprint(description: str, settings: Optional[Dict[str, Any]]) -> str:
+    payload = json.dumps({"descricao": description, "configuracao": settings or {}}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CheckpointStore:
+    """
+    Resultados de cada etapa salvos em SQLite assim que ficam prontos, por execução (run_id).
+
+    Se uma etapa falhar, as anteriores continuam disponíveis: a execução pode ser retomada
+    a partir da primeira etapa ausente, e os resultados parciais podem ser exportados.
+    """
+
+    def __init__(self, path: str, idempotency_ttl: float = IDEMPOTENCY_TTL):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.idempotency_ttl = idempotency_ttl
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30, "check_same_thread": False})
+        event.listen(self.engine, "connect", self._configure_connection)
+        try:
+            _metadata.create_all(self.engine)
+        except OperationalError as error:
+            # Outro processo criou o schema entre a verificação e o CREATE TABLE
+            if "already exists" not in str(error):
+                raise
+
+    @staticmethod
+    def _configure_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
+
+    def create_run(self, description: str, settings: Optional[Dict[str, Any]] = None, run_id: Optional[str] = None) -> str:
+        """
+        Registra uma nova execução.
+
+        Args:
+            description (str): Descrição do sistema
+            settings (dict): Configurações usadas (modelo, temperatura...), registradas com a execução
+            run_id (str): Identificador a usar; gerado automaticamente se omitido
+
+        Returns:
+            str: Identificador da execução
+        """
+        run_id = run_id or uuid.uuid4().hex
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(_runs_table.insert().values(
+                run_id=run_id,
+                description=description,
+                settings=json.dumps(settings or {}, ensure_ascii=False),
+                status=RUNNING,
+                error=None,
+                created_at=now,
+                updated_at=now,
+            ))
+        return run_id
+
+    def create_run_once(
+        self, description: str, settings: Optional[Dict[str, Any]], idempotency_key: str
+    ) -> Tuple[str, bool]:
+        """
+        Registra uma execução uma única vez por chave de idempotência.
+
+        Repetições da mesma requisição (por exemplo, novas tentativas do cliente após uma
+        falha de rede) recebem a execução já criada, mesmo que cheguem a outro worker.
+        Chaves mais antigas que `idempotency_ttl` expiram e são removidas.
+
+        Args:
+            description (str): Descrição do sistema
+            settings (dict): Configurações usadas, registradas com a execução
+            idempotency_key (str): Chave enviada pelo cliente
+
+        Returns:
+            tuple: (run_id, True se a execução foi criada agora)
+
+        Raises:
+            IdempotencyConflict: Se a chave já foi usada com outra descrição ou configuração
+        """
+        fingerprint = request_fingerprint(description, settings)
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(_idempotency_table.delete().where(_idempotency_table.c.created_at < now - self.idempotency_ttl))
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(_idempotency_table.insert().values(
+                    key=idempotency_key, run_id=run_id, fingerprint=fingerprint, created_at=now
+                ))
+                conn.execute(_runs_table.insert().values(
+                    run_id=run_id,
+                    description=description,
+                    settings=json.dumps(settings or {}, ensure_ascii=False),
+                    status=RUNNING,
+                    error=None,
+                    created_at=now,
+                    updated_at=now,
+                ))
+            return run_id, True
+        except IntegrityError:
+            pass
+
+        table = _idempotency_table
+        with self.engine.connect() as conn:
+            row = conn.execute(select(table.c.run_id, table.c.fingerprint).where(table.c.key == idempotency_key)).one()
+        if row.fingerprint != fingerprint:
+            raise IdempotencyConflict("A chave de idempotência já foi usada com outra requisição")
+        return row.run_id, False
+
+    def save_stage(self, run_id: str, stage: str, result: Dict[str, Any]) -> None:
+        """Salva (ou substitui) o resultado de uma etapa."""
+        now = time.time()
+        stmt = sqlite_insert(_run_stages_table).values(
+            run_id=run_id, stage=stage, result=json.dumps(result, ensure_ascii=False), created_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["run_id", "stage"],
+            set_={"result": stmt.excluded.result, "created_at": stmt.excluded.created_at},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+            conn.execute(_runs_table.update().where(_runs_table.c.run_id == run_id).values(updated_at=now))
+
+    def set_status(self, run_id: str, status: str, error: Optional[str] = None) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                _runs_table.update().where(_runs_table.c.run_id == run_id).values(
+                    status=status, error=error, updated_at=time.time()
+                )
+            )
+
+    def touch(self, run_id: str) -> None:
+        """Renova a concessão de uma execução em andamento (sinal de que o worker continua vivo)."""
+        with self.engine.begin() as conn:
+            conn.execute(
+                _runs_table.update()
+                .where(_runs_table.c.run_id == run_id, _runs_table.c.status == RUNNING)
+                .values(updated_at=time.time())
+            )
+
+    def claim_run(self, run_id: str, lease: float) -> bool:
+        """
+        Assume uma execução para retomá-la.
+
+        Só é possível se ela falhou ou foi interrompida: em andamento, mas sem atualização
+        (etapa salva ou `touch`) há mais de `lease` segundos, como quando o worker morre.
+
+        Args:
+            run_id (str): Identificador da execução
+            lease (float): Tempo (segundos) sem atualização após o qual a execução é considerada interrompida
+
+        Returns:
+            bool: True se a execução foi assumida (e marcada como em andamento)
+        """
+        table = _runs_table
+        now = time.time()
+        with self.engine.begin() as conn:
+            claimed = conn.execute(
+                table.update()
+                .where(
+                    table.c.run_id == run_id,
+                    (table.c.status == FAILED) | ((table.c.status == RUNNING) & (table.c.updated_at < now - lease)),
+                )
+                .values(status=RUNNING, error=None, updated_at=now)
+            )
+        return claimed.rowcount == 1
+
+    def results(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        """Resultados já salvos da execução, indexados pela etapa."""
+        table = _run_stages_table
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.stage, table.c.result).where(table.c.run_id == run_id).order_by(table.c.created_at)
+            ).all()
+        return {row.stage: json.loads(row.result) for row in rows}
+
+    def load(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Carrega uma execução.
+
+        Returns:
+            dict: run_id, descricao, configuracao, status, erro e resultados (por etapa),
+            ou None se a execução não existir
+        """
+        table = _runs_table
+        with self.engine.connect() as conn:
+            row = conn.execute(select(table).where(table.c.run_id == run_id)).first()
+        if row is None:
+            return None
+        return {
+            "run_id": row.run_id,
+            "descricao": row.description,
+            "configuracao": json.loads(row.settings),
+            "status": row.status,
+            "erro": row.error,
+            "resultados": self.results(run_id),
+        }
+
+    def recent_runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Execuções mais recentes, sem os resultados."""
+        table = _runs_table
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.run_id, table.c.status, table.c.updated_at).order_by(table.c.updated_at.desc()).limit(limit)
+            ).all()
+        return [{"run_id": row.run_id, "status": row.status, "atualizado_em": row.updated_at} for row in rows]
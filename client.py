@@ -0,0 +1,89 @@
+"""
+Cliente do serviço HTTP (`server.py`) que acompanha a geração por Server-Sent Events.
+
+Exemplo:
+    for event, data in stream_documentation("http://localhost:8080", "Um sistema de e-commerce..."):
+        if event == "item":
+            print(data["etapa"], data["chave"], data["valor"])
+"""
+import json
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import httpx
+from httpx_sse import aconnect_sse, connect_sse
+
+# Sem limite de leitura: entre os eventos o servidor envia apenas keep-alives
+STREAM_TIMEOUT = httpx.Timeout(30.0, read=None)
+
+
+def _payload(description: str, draft: bool, fan_out_apis: bool) -> Dict[str, Any]:
+    return {"descricao": description, "rascunho": draft, "apis_paralelas": fan_out_apis}
+
+
+def stream_documentation(
+    base_url: str,
+    description: str,
+    draft: bool = False,
+    fan_out_apis: bool = False,
+    client: Optional[httpx.Client] = None,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Envia uma descrição e emite os eventos da geração à medida que chegam.
+
+    Args:
+        base_url (str): Endereço do serviço, como http://localhost:8080
+        description (str): Descrição do sistema
+        draft (bool): Gera as três etapas em uma única chamada
+        fan_out_apis (bool): Gera as APIs por componente, em paralelo
+        client (httpx.Client): Cliente a reutilizar, opcional
+
+    Yields:
+        tuple: (evento, dados), como ("item", {"etapa": ..., "chave": ..., "valor": ...}) ou
+        ("etapa_concluida", {"etapa": ..., "resultado": ...}); o último é "concluido" ou "falhou".
+        Um evento ("reinicio", {"etapa": ...}) indica que o streaming da etapa recomeçou após
+        uma falha de conexão: os itens já recebidos dessa etapa devem ser descartados
+    """
+    owned = client is None
+    client = client or httpx.Client(base_url=base_url, timeout=STREAM_TIMEOUT)
+    try:
+        with connect_sse(client, "POST", f"{base_url}/documentacao", json=_payload(description, draft, fan_out_apis)) as source:
+            source.response.raise_for_status()
+            for sse in source.iter_sse():
+                yield sse.event, json.loads(sse.data)
+    finally:
+        if owned:
+            client.close()
+
+
+async def astream_documentation(
+    base_url: str,
+    description: str,
+    draft: bool = False,
+    fan_out_apis: bool = False,
+    client: Optional[httpx.AsyncClient] = None,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Versão assíncrona de `stream_documentation`."""
+    owned = client is None
+    client = client or httpx.AsyncClient(base_url=base_url, timeout=STREAM_TIMEOUT)
+    try:
+        async with aconnect_sse(client, "POST", f"{base_url}/documentacao", json=_payload(description, draft, fan_out_apis)) as source:
+            source.response.raise_for_status()
+            async for sse in source.aiter_sse():
+                yield sse.event, json.loads(sse.data)
+    finally:
+        if owned:
+            await client.aclose()
+
+
+def follow_documentation(base_url: str, run_id: str, client: Optional[httpx.Client] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Acompanha os eventos de uma geração já enviada, pelo id retornado no POST."""
+    owned = client is None
+    client = client or httpx.Client(base_url=base_url, timeout=STREAM_TIMEOUT)
+    try:
+        with connect_sse(client, "GET", f"{base_url}/documentacao/{run_id}/eventos") as source:
+            source.response.raise_for_status()
+            for sse in source.iter_sse():
+                yield sse.event, json.loads(sse.data)
+    finally:
+        if owned:
+            client.close()
@@ -0,0 +1,276 @@
+import asyncio
+import atexit
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from cache import make_cache_key
+
+# Threads que executam as chamadas compartilhadas iniciadas por `stream` síncrono,
+# criadas no primeiro uso e encerradas ao sair do processo
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="single-flight")
+            atexit.register(_shutdown_executor)
+        return _executor
+
+
+def _shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _reader_error(error: BaseException) -> BaseException:
+    """
+    Exceção própria para cada leitor de uma chamada que falhou.
+
+    Relançar o mesmo objeto em vários leitores mistura os tracebacks (e o contexto) de cada
+    um. A cópia mantém o tipo e os atributos (a política de novas tentativas continua
+    valendo) e tem a exceção original como causa.
+    """
+    try:
+        copy = type(error).__new__(type(error), *error.args)
+        copy.__dict__.update(getattr(error, "__dict__", {}))
+    except Exception:
+        copy = RuntimeError(f"A chamada compartilhada falhou: {error}")
+    copy.__cause__ = error
+    return copy
+
+
+def normalize_inputs(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Normaliza espaços das variáveis de texto, para que descrições equivalentes compartilhem a chamada."""
+    return {key: " ".join(value.split()) if isinstance(value, str) else value for key, value in inputs.items()}
+
+
+class _Flight:
+    """Chamada em andamento: trechos já recebidos e leitores (síncronos ou assíncronos) aguardando os próximos."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.consumers = 1
+        self.cancelled = threading.Event()
+        self.task: Optional[asyncio.Future] = None
+        self._condition = threading.Condition()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def _wake(self) -> None:
+        # Chamado com a condição adquirida
+        self._condition.notify_all()
+        for loop, waiter in self._waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(waiter.set)
+        self._waiters.clear()
+
+    def push(self, chunk: str) -> None:
+        with self._condition:
+            self.chunks.append(chunk)
+            self._wake()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._wake()
+
+    def read(self) -> Iterator[str]:
+        index = 0
+        while True:
+            with self._condition:
+                while index == len(self.chunks) and not self.done:
+                    self._condition.wait()
+                pending = self.chunks[index:]
+                done, error = self.done, self.error
+            yield from pending
+            index += len(pending)
+            if done and index == len(self.chunks):
+                if error is not None:
+                    raise _reader_error(error)
+                return
+
+    async def aread(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            waiter = asyncio.Event()
+            with self._condition:
+                pending = self.chunks[index:]
+                done, error = self.done, self.error
+                if not pending and not done:
+                    self._waiters.append((asyncio.get_running_loop(), waiter))
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if pending:
+                continue
+            if done:
+                if error is not None:
+                    raise _reader_error(error)
+                return
+            await waiter.wait()
+
+
+class SingleFlight:
+    """
+    Registro das chamadas em andamento, compartilhado entre as chains do processo.
+
+    Chamadas simultâneas com a mesma chave são atendidas por uma única requisição ao
+    modelo: a primeira inicia a chamada e as demais recebem os mesmos trechos, inclusive
+    os que já tinham chegado. A chamada é cancelada apenas quando todos os leitores desistem.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def join(self, key: str) -> Tuple[_Flight, bool]:
+        """Retorna a chamada da chave e se quem chamou deve iniciá-la."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.consumers += 1
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.calls += 1
+            return flight, True
+
+    def leave(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            flight.consumers -= 1
+            if flight.consumers > 0 or flight.done:
+                return
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        # Ninguém mais lê a resposta: interrompe a requisição
+        flight.cancelled.set()
+        if flight.task is not None:
+            flight.task.get_loop().call_soon_threadsafe(flight.task.cancel)
+
+    def complete(self, key: str, flight: _Flight, error: Optional[BaseException] = None) -> None:
+        # Remove antes de sinalizar: as próximas chamadas já encontram a resposta no cache
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"chamadas": self.calls, "compartilhadas": self.coalesced, "em_andamento": len(self._flights)}
+
+
+class CoalescedChain(Runnable[Dict[str, Any], str]):
+    """
+    Compartilha a chamada ao modelo entre requisições simultâneas idênticas.
+
+    A chave combina o template da etapa, o modelo, a temperatura e as variáveis do prompt
+    normalizadas. A requisição usa o `config` (callbacks, uso de tokens) de quem a iniciou.
+    `invoke` e `stream` chegam à chain com o mesmo método (a duplicação de requisições, por
+    exemplo, se comporta de forma diferente em cada um); quem entra numa chamada já em
+    andamento recebe o texto dela, seja qual for o método.
+    """
+
+    def __init__(self, chain: Runnable, flights: SingleFlight, template: str, model: str, temperature: float):
+        self.chain = chain
+        self.flights = flights
+        self.template = template
+        self.model = model
+        self.temperature = temperature
+
+    def flight_key(self, inputs: Dict[str, Any]) -> str:
+        return make_cache_key(self.template, self.model, self.temperature, normalize_inputs(inputs))
+
+    def _produce(self, key: str, flight: _Flight, input: Dict[str, Any], config: Optional[RunnableConfig]) -> None:
+        stream = self.chain.stream(input, config)
+        try:
+            for chunk in stream:
+                if flight.cancelled.is_set():
+                    break
+                flight.push(chunk)
+        except BaseException as error:
+            self.flights.complete(key, flight, error)
+        else:
+            self.flights.complete(key, flight)
+        finally:
+            # Fechar o gerador encerra a resposta HTTP em andamento
+            stream.close()
+
+    async def _aproduce(
+        self, key: str, flight: _Flight, input: Dict[str, Any], config: Optional[RunnableConfig], invoke: bool = False
+    ) -> None:
+        try:
+            if invoke:
+                flight.push(await self.chain.ainvoke(input, config))
+            else:
+                async for chunk in self.chain.astream(input, config):
+                    flight.push(chunk)
+        except BaseException as error:
+            self.flights.complete(key, flight, error)
+            if isinstance(error, asyncio.CancelledError):
+                raise
+        else:
+            self.flights.complete(key, flight)
+
+    def stream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        key = self.flight_key(input)
+        flight, leader = self.flights.join(key)
+        if leader:
+            # A chamada roda em outra thread (continua se quem a iniciou desistir) com o contexto de quem a iniciou
+            _get_executor().submit(contextvars.copy_context().run, self._produce, key, flight, input, config)
+        try:
+            yield from flight.read()
+        finally:
+            self.flights.leave(key, flight)
+
+    async def astream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        key = self.flight_key(input)
+        flight, leader = self.flights.join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(self._aproduce(key, flight, input, config))
+        try:
+            async for chunk in flight.aread():
+                yield chunk
+        finally:
+            self.flights.leave(key, flight)
+
+    def invoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        key = self.flight_key(input)
+        flight, leader = self.flights.join(key)
+        try:
+            if not leader:
+                return "".join(flight.read())
+            # Uma chamada síncrona não pode ser interrompida: quem a inicia a executa na própria thread
+            try:
+                output = self.chain.invoke(input, config)
+            except BaseException as error:
+                self.flights.complete(key, flight, error)
+                raise
+            flight.push(output)
+            self.flights.complete(key, flight)
+            return output
+        finally:
+            self.flights.leave(key, flight)
+
+    async def ainvoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        key = self.flight_key(input)
+        flight, leader = self.flights.join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(self._aproduce(key, flight, input, config, invoke=True))
+        try:
+            return "".join([chunk async for chunk in flight.aread()])
+        finally:
+            self.flights.leave(key, flight)
@@ -0,0 +1,523 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import httpx
+import openai
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from json_stream import IncrementalJSONParser
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Modos de DOC_LLM que dispensam a API da OpenAI
+OFFLINE_MODES = ("fake", "replay", "record")
+
+# Respostas fixas de cada etapa, no formato dos prompts do pipeline
+FAKE_RESPONSES: Dict[str, Dict[str, Any]] = {
+    "requisitos": {
+        "requisitos_funcionais": [
+            {"id": "RF01", "descricao": "Cadastrar itens", "prioridade": "Alta"},
+            {"id": "RF02", "descricao": "Consultar itens cadastrados", "prioridade": "Média"},
+        ],
+        "requisitos_nao_funcionais": [
+            {"id": "RNF01", "descricao": "Responder em menos de 1 segundo", "tipo": "Desempenho"},
+        ],
+    },
+    "fluxo": {
+        "componentes": [
+            {
+                "nome": "API",
+                "descricao": "Recebe as requisições dos clientes",
+                "responsabilidades": ["Validar entradas", "Encaminhar operações"],
+                "dependencias": ["Banco de dados"],
+            },
+            {
+                "nome": "Banco de dados",
+                "descricao": "Armazena os itens",
+                "responsabilidades": ["Persistir itens"],
+                "dependencias": [],
+            },
+        ],
+        "fluxos": [
+            {"nome": "Cadastro", "passos": ["Cliente envia o item", "API valida", "Banco de dados grava"]},
+        ],
+    },
+    "apis": {
+        "apis": [
+            {
+                "rota": "/itens",
+                "metodo": "POST",
+                "descricao": "Cadastra um item",
+                "parametros": {"nome": "Nome do item"},
+                "respostas": {"201": "Item criado", "400": "Dados inválidos"},
+            },
+            {
+                "rota": "/itens/{id}",
+                "metodo": "GET",
+                "descricao": "Consulta um item",
+                "parametros": {"id": "Identificador do item"},
+                "respostas": {"200": "Item encontrado", "404": "Item não encontrado"},
+            },
+        ],
+    },
+}
+FAKE_RESPONSES["rascunho"] = {
+    **FAKE_RESPONSES["requisitos"],
+    **FAKE_RESPONSES["fluxo"],
+    **FAKE_RESPONSES["apis"],
+}
+
+
+def structured_response(stage: str) -> Dict[str, Any]:
+    """Resposta fixa da etapa no formato dos esquemas de saída estruturada (listas de parâmetros e respostas)."""
+    response = dict(FAKE_RESPONSES[stage])
+    if "apis" in response:
+        response["apis"] = [
+            {
+                **api,
+                "parametros": [{"nome": name, "descricao": text} for name, text in api["parametros"].items()],
+                "respostas": [{"codigo": code, "descricao": text} for code, text in api["respostas"].items()],
+            }
+            for api in response["apis"]
+        ]
+    return response
+
+
+def detect_stage(prompt: str) -> str:
+    """Identifica a etapa (ou o reparo de JSON) pelo texto do prompt."""
+    if "O JSON abaixo está inválido" in prompt:
+        return "reparo"
+    if "em uma única resposta" in prompt:
+        return "rascunho"
+    if "Fluxo de componentes:" in prompt:
+        return "apis"
+    if "Requisitos:" in prompt:
+        return "fluxo"
+    return "requisitos"
+
+
+class FakeDocumentationLLM(BaseChatModel):
+    """
+    Modelo de chat local que responde cada etapa com um JSON fixo, sem chamar a OpenAI.
+
+    Usado para testar o servidor e as filas sem custo: `latency` simula o tempo até o
+    primeiro token e `chunk_size` o tamanho dos trechos emitidos em streaming.
+    """
+
+    latency: float = 0.0
+    chunk_size: int = 32
+    model_name: str = "fake"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-documentation"
+
+    def _response(self, messages: List[BaseMessage]) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        stage = detect_stage(prompt)
+        if stage == "reparo":
+            # Devolve o trecho recebido a partir do primeiro "{"
+            return prompt[prompt.find("{", prompt.find("JSON:")):].strip()
+        return json.dumps(FAKE_RESPONSES[stage], ensure_ascii=False)
+
+    def respond(self, messages: List[BaseMessage]) -> str:
+        """Texto completo da resposta, sem latência nem falhas simuladas."""
+        return self._response(messages)
+
+    def _chunks(self, text: str) -> List[str]:
+        return [text[start:start + self.chunk_size] for start in range(0, len(text), self.chunk_size)]
+
+    @staticmethod
+    def _usage(messages: List[BaseMessage], text: str) -> Dict[str, int]:
+        # Estimativa de ~4 caracteres por token, para que o uso apareça nas estatísticas
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        output_tokens = len(text) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _first_token_delay(self) -> float:
+        return self.latency
+
+    def _token_delay(self) -> float:
+        return 0.0
+
+    def _start(self, messages: List[BaseMessage]) -> str:
+        """Resposta da chamada; subclasses podem levantar erros simulados aqui."""
+        return self._response(messages)
+
+    async def _astart(self, messages: List[BaseMessage]) -> str:
+        """Versão assíncrona de `_start`, usada por `_agenerate` e `_astream`."""
+        return self._start(messages)
+
+    @staticmethod
+    def _connection_error(message: str) -> openai.APIConnectionError:
+        # Mesmo erro do cliente da OpenAI, tratado pela política de novas tentativas
+        return openai.APIConnectionError(message=message, request=httpx.Request("POST", "http://replay.local/chat/completions"))
+
+    def _drop_point(self, total: int) -> Optional[int]:
+        """Índice do trecho em que o streaming é interrompido, ou None; subclasses simulam quedas aqui."""
+        return None
+
+    def _result(self, messages: List[BaseMessage], text: str) -> ChatResult:
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunk(self, messages: List[BaseMessage], text: str, last: bool, full_text: str) -> ChatGenerationChunk:
+        # O uso de tokens vai no último trecho, como no streaming da OpenAI com stream_usage
+        usage = self._usage(messages, full_text) if last else None
+        return ChatGenerationChunk(message=AIMessageChunk(content=text, usage_metadata=usage))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self._first_token_delay())
+        text = self._start(messages)
+        time.sleep(sum(self._token_delay() for _ in self._chunks(text)))
+        return self._result(messages, text)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self._first_token_delay())
+        text = await self._astart(messages)
+        await asyncio.sleep(sum(self._token_delay() for _ in self._chunks(text)))
+        return self._result(messages, text)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._first_token_delay())
+        text = self._start(messages)
+        pieces = self._chunks(text)
+        drop_at = self._drop_point(len(pieces))
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(self._token_delay())
+            if index == drop_at:
+                raise self._connection_error("Conexão interrompida durante o streaming (simulada)")
+            chunk = self._chunk(messages, piece, index == len(pieces) - 1, text)
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._first_token_delay())
+        text = await self._astart(messages)
+        pieces = self._chunks(text)
+        drop_at = self._drop_point(len(pieces))
+        for index, piece in enumerate(pieces):
+            if index:
+                await asyncio.sleep(self._token_delay())
+            if index == drop_at:
+                raise self._connection_error("Conexão interrompida durante o streaming (simulada)")
+            chunk = self._chunk(messages, piece, index == len(pieces) - 1, text)
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+def repair_key(text: str) -> str:
+    """Trecho de uma resposta truncada como aparece no prompt de reparo (o objeto lido pelo parser)."""
+    parser = IncrementalJSONParser()
+    parser.feed(text)
+    return parser.fragment().strip()
+
+
+@contextlib.contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Trava exclusiva entre processos (arquivo `path`), para gravações concorrentes da cassete."""
+    with open(path, "a+b") as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def split_tokens(text: str, tokens_per_chunk: int = 1) -> List[str]:
+    """Divide o texto em trechos de `tokens_per_chunk` "tokens" (cada palavra com o espaço que a precede)."""
+    tokens = re.findall(r"\s*\S+", text) or [text]
+    return ["".join(tokens[start:start + tokens_per_chunk]) for start in range(0, len(tokens), tokens_per_chunk)]
+
+
+def prompt_hash(messages: List[BaseMessage]) -> str:
+    """Chave de uma chamada na cassete: hash do tipo e do conteúdo das mensagens."""
+    payload = json.dumps([[message.type, message.content] for message in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CassetteMiss(KeyError):
+    """O prompt não está na cassete e não há resposta alternativa."""
+
+
+class Cassette:
+    """
+    Respostas gravadas do modelo, indexadas pelo hash do prompt.
+
+    O arquivo é um JSON {"respostas": {hash: {"resposta": ..., "prompt": início do prompt}}},
+    legível e fácil de revisar em um diff. Gravações são salvas imediatamente, sob uma trava
+    de arquivo: vários processos (workers do servidor) podem gravar na mesma cassete.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._entries: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self._entries = json.load(file).get("respostas", {})
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        return entry["resposta"] if entry else None
+
+    def record(self, key: str, messages: List[BaseMessage], response: str) -> None:
+        prompt = "\n".join(str(message.content) for message in messages)
+        with self._lock:
+            self._entries[key] = {"resposta": response, "prompt": " ".join(prompt.split())[:200]}
+            if self.path:
+                self._save()
+
+    def _save(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with _file_lock(f"{self.path}.lock"):
+            # Mescla com o que outros processos gravaram desde a leitura
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as file:
+                    self._entries = {**json.load(file).get("respostas", {}), **self._entries}
+            descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path), suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                    json.dump({"respostas": self._entries}, file, ensure_ascii=False, indent=2)
+                # Troca atômica: uma interrupção não deixa a cassete corrompida
+                os.replace(temporary, self.path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(temporary)
+                raise
+
+
+class ReplayChatModel(FakeDocumentationLLM):
+    """
+    Modelo de chat que reproduz respostas gravadas, com latência e falhas configuráveis.
+
+    As respostas vêm da cassete (`cassette_path`); prompts ausentes usam as respostas fixas
+    de `FakeDocumentationLLM` (ou levantam CassetteMiss com `fallback=False`). Com `recorder`,
+    prompts ausentes são enviados ao modelo real e a resposta é gravada.
+
+    O streaming é emitido token a token: `latency` (± `latency_jitter`) até o primeiro
+    token e `token_delay` (± `token_jitter`) entre os seguintes. Falhas simuladas:
+    `failure_rate` (erro de conexão antes do primeiro token), `stream_failure_rate`
+    (conexão interrompida no meio do streaming) e `malformed_rate` (JSON truncado, que
+    passa pelo prompt de reparo). Com `seed`, a sequência de latências e falhas é reproduzível.
+    """
+
+    cassette_path: Optional[str] = None
+    recorder: Optional[BaseChatModel] = None
+    fallback: bool = True
+    latency_jitter: float = 0.0
+    token_delay: float = 0.0
+    token_jitter: float = 0.0
+    tokens_per_chunk: int = 1
+    failure_rate: float = 0.0
+    stream_failure_rate: float = 0.0
+    malformed_rate: float = 0.0
+    seed: Optional[int] = None
+    model_name: str = "replay"
+
+    _cassette: Cassette = PrivateAttr()
+    _random: random.Random = PrivateAttr()
+    _random_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    # Respostas originais das últimas truncagens, pelo trecho enviado no prompt de reparo
+    _truncated: "OrderedDict[str, str]" = PrivateAttr(default_factory=OrderedDict)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._cassette = Cassette(self.cassette_path)
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    @property
+    def cassette(self) -> Cassette:
+        return self._cassette
+
+    def _uniform(self, low: float, high: float) -> float:
+        with self._random_lock:
+            return self._random.uniform(low, high)
+
+    def _chance(self, rate: float) -> bool:
+        return rate > 0 and self._uniform(0.0, 1.0) < rate
+
+    def _first_token_delay(self) -> float:
+        return max(0.0, self.latency + self._uniform(-self.latency_jitter, self.latency_jitter))
+
+    def _token_delay(self) -> float:
+        return max(0.0, self.token_delay + self._uniform(-self.token_jitter, self.token_jitter))
+
+    def _chunks(self, text: str) -> List[str]:
+        return split_tokens(text, self.tokens_per_chunk)
+
+    def _replay(self, messages: List[BaseMessage], key: str) -> str:
+        """Resposta para um prompt ausente da cassete (e sem `recorder`)."""
+        prompt = "\n".join(str(message.content) for message in messages)
+        if detect_stage(prompt) == "reparo":
+            # Reparo de uma resposta truncada por `malformed_rate`: devolve a original
+            fragment = prompt[prompt.find("JSON:") + len("JSON:"):].strip()
+            with self._random_lock:
+                original = self._truncated.get(fragment)
+            if original is not None:
+                return original
+        if not self.fallback:
+            raise CassetteMiss(key)
+        return super()._response(messages)
+
+    def _response(self, messages: List[BaseMessage]) -> str:
+        key = prompt_hash(messages)
+        response = self._cassette.get(key)
+        if response is not None:
+            return response
+        if self.recorder is not None:
+            response = self.recorder.invoke(messages).content
+            self._cassette.record(key, messages, response)
+            return response
+        return self._replay(messages, key)
+
+    async def _aresponse(self, messages: List[BaseMessage]) -> str:
+        key = prompt_hash(messages)
+        response = self._cassette.get(key)
+        if response is not None:
+            return response
+        if self.recorder is not None:
+            response = (await self.recorder.ainvoke(messages)).content
+            # A gravação (arquivo e trava) não bloqueia o event loop
+            await asyncio.to_thread(self._cassette.record, key, messages, response)
+            return response
+        return self._replay(messages, key)
+
+    def _maybe_truncate(self, messages: List[BaseMessage], text: str) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        # O reparo nunca é truncado, para que a etapa se recupere na primeira tentativa
+        if detect_stage(prompt) != "reparo" and self._chance(self.malformed_rate):
+            text = self.truncate(text)
+        return text
+
+    def _start(self, messages: List[BaseMessage]) -> str:
+        if self._chance(self.failure_rate):
+            raise self._connection_error("Falha de conexão simulada")
+        return self._maybe_truncate(messages, self._response(messages))
+
+    async def _astart(self, messages: List[BaseMessage]) -> str:
+        if self._chance(self.failure_rate):
+            raise self._connection_error("Falha de conexão simulada")
+        return self._maybe_truncate(messages, await self._aresponse(messages))
+
+    def truncate(self, text: str) -> str:
+        """
+        Corta a resposta em um ponto aleatório; o prompt de reparo do trecho devolve o texto original.
+
+        Trechos iguais de respostas diferentes (como `{"` em duas etapas) tornariam o reparo
+        ambíguo: nesse caso o corte avança até o trecho ser único.
+        """
+        if len(text) <= 2:
+            return text
+        with self._random_lock:
+            cut = int(self._random.uniform(1, len(text) - 1))
+            key = repair_key(text[:cut])
+            while self._truncated.get(key, text) != text and cut < len(text) - 1:
+                cut += 1
+                key = repair_key(text[:cut])
+            self._truncated[key] = text
+            self._truncated.move_to_end(key)
+            while len(self._truncated) > 256:
+                self._truncated.popitem(last=False)
+        return text[:cut]
+
+    def _drop_point(self, total: int) -> Optional[int]:
+        # Sorteado uma vez por streaming, antes do primeiro trecho
+        if total > 1 and self._chance(self.stream_failure_rate):
+            return int(self._uniform(1, total))
+        return None
+
+
+def offline_llm_from_env(model: str, recorder: Optional[BaseChatModel] = None) -> Optional[BaseChatModel]:
+    """
+    Modelo local escolhido por DOC_LLM, ou None para usar a OpenAI.
+
+    DOC_LLM=fake usa respostas fixas; DOC_LLM=replay reproduz a cassete DOC_CASSETTE;
+    DOC_LLM=record grava em DOC_CASSETTE as respostas de `recorder` (o modelo real) para os
+    prompts ainda ausentes. Latência e falhas: DOC_REPLAY_LATENCY, DOC_REPLAY_LATENCY_JITTER,
+    DOC_REPLAY_TOKEN_DELAY, DOC_REPLAY_TOKEN_JITTER, DOC_REPLAY_FAILURE_RATE,
+    DOC_REPLAY_STREAM_FAILURE_RATE, DOC_REPLAY_MALFORMED_RATE e DOC_REPLAY_SEED.
+    """
+    mode = os.environ.get("DOC_LLM", "openai")
+    if mode not in OFFLINE_MODES:
+        return None
+    if mode == "fake":
+        return FakeDocumentationLLM(latency=float(os.environ.get("DOC_FAKE_LATENCY", "0")), model_name=model)
+
+    def setting(name: str, default: str = "0") -> float:
+        return float(os.environ.get(f"DOC_REPLAY_{name}", default))
+
+    seed = os.environ.get("DOC_REPLAY_SEED")
+    return ReplayChatModel(
+        model_name=model,
+        cassette_path=os.environ.get("DOC_CASSETTE", ".cache/cassete.json"),
+        recorder=recorder if mode == "record" else None,
+        latency=setting("LATENCY"),
+        latency_jitter=setting("LATENCY_JITTER"),
+        token_delay=setting("TOKEN_DELAY"),
+        token_jitter=setting("TOKEN_JITTER"),
+        failure_rate=setting("FAILURE_RATE"),
+        stream_failure_rate=setting("STREAM_FAILURE_RATE"),
+        malformed_rate=setting("MALFORMED_RATE"),
+        seed=int(seed) if seed else None,
+    )
@@ -0,0 +1,289 @@
+import asyncio
+import math
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+# Event loop em segundo plano que executa as chamadas síncronas (veja `HedgedChain`)
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+# Marca o fim dos trechos de uma requisição
+_END = object()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="hedge-loop", daemon=True).start()
+        return _loop
+
+
+class HedgeStats:
+    """
+    Histórico de latência até o primeiro token e orçamento de requisições duplicadas.
+
+    Compartilhado entre as chains do processo: cada etapa tem sua própria janela de
+    latências recentes, e o orçamento limita a fração de requisições que podem ser duplicadas.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, key: str, ttft: Optional[float]) -> None:
+        """Registra a latência até o primeiro token de uma requisição."""
+        if ttft is None:
+            return
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(ttft)
+
+    def percentile(self, key: str, percentile: float) -> Optional[float]:
+        """Retorna o percentil das latências recentes, ou None se ainda houver poucas amostras."""
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(percentile * len(samples)) - 1))
+        return samples[index]
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self, budget: float) -> bool:
+        """Reserva uma requisição duplicada se ela couber no orçamento (fração das requisições)."""
+        with self._lock:
+            if self.hedges + 1 > budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def record_win(self, hedged: bool) -> None:
+        if hedged:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requisicoes": self.requests, "duplicadas": self.hedges, "vitorias_duplicadas": self.hedge_wins}
+
+
+class _Attempt:
+    """Requisição em andamento: os trechos recebidos ficam em uma fila até a corrida ter um vencedor."""
+
+    def __init__(self, key: str, hedged: bool, chain: Runnable, input: Dict[str, Any], config: Optional[RunnableConfig]):
+        self.key = key
+        self.hedged = hedged
+        self.started = time.monotonic()
+        self.ttft: Optional[float] = None
+        self.parts: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        # Sinalizado no primeiro trecho ou no fim da requisição (com ou sem erro)
+        self.ready = asyncio.Event()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._run(chain, input, config))
+
+    async def _run(self, chain: Runnable, input: Dict[str, Any], config: Optional[RunnableConfig]) -> None:
+        try:
+            async for chunk in chain.astream(input, config):
+                if self.ttft is None:
+                    self.ttft = time.monotonic() - self.started
+                self.parts.append(chunk)
+                self._queue.put_nowait(chunk)
+                self.ready.set()
+        except Exception as error:
+            self.error = error
+        finally:
+            self.done = True
+            self.ready.set()
+            self._queue.put_nowait(_END)
+
+    @property
+    def started_output(self) -> bool:
+        """Já produziu o primeiro trecho, ou terminou sem erro."""
+        return self.ttft is not None or (self.done and self.error is None)
+
+    async def chunks(self) -> AsyncIterator[str]:
+        while True:
+            chunk = await self._queue.get()
+            if chunk is _END:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield chunk
+
+    def cancel(self) -> None:
+        # Cancelar a tarefa encerra a resposta HTTP em andamento
+        if not self.task.done():
+            self.task.cancel()
+
+
+class HedgedChain(Runnable[Dict[str, Any], str]):
+    """
+    Duplica uma requisição lenta para reduzir a latência de cauda.
+
+    Se a chain principal não produzir o primeiro token dentro do percentil configurado das
+    latências recentes, uma segunda requisição é enviada (para a mesma chain ou para a
+    alternativa). O número de duplicações é limitado por `budget`, uma fração do total de
+    requisições. Em `invoke` vence a primeira resposta completa válida; em `stream` vence a
+    primeira a emitir um trecho, cujos trechos são repassados. A perdedora é cancelada.
+
+    As chamadas síncronas rodam no event loop em segundo plano do módulo: uma requisição
+    perdedora parada na leitura da resposta é cancelada de fato, sem prender uma thread
+    nem a conexão até o timeout.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        primary: Runnable,
+        stats: HedgeStats,
+        alternate: Optional[Runnable] = None,
+        percentile: float = 0.95,
+        budget: float = 0.1,
+        min_delay: float = 0.5,
+        validate: Optional[Callable[[str], bool]] = None,
+        alternate_name: Optional[str] = None,
+    ):
+        self.name = name
+        self.primary = primary
+        self.alternate = alternate
+        # As latências da alternativa têm histórico próprio, para não distorcer o atraso da principal
+        self.alternate_name = alternate_name or (f"{name}/alternativa" if alternate is not None else name)
+        self.stats = stats
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.validate = validate
+
+    def hedge_delay(self) -> Optional[float]:
+        """Tempo de espera pelo primeiro token antes de duplicar; None desativa a duplicação."""
+        delay = self.stats.percentile(self.name, self.percentile)
+        return None if delay is None else max(delay, self.min_delay)
+
+    def _is_valid(self, result: str) -> bool:
+        return self.validate is None or self.validate(result)
+
+    async def _start(self, input: Dict[str, Any], config: Optional[RunnableConfig]) -> List[_Attempt]:
+        """Inicia a principal e, se ela demorar a começar e houver orçamento, a duplicada."""
+        self.stats.count_request()
+        delay = self.hedge_delay()
+        attempts = [_Attempt(self.name, False, self.primary, input, config)]
+        if delay is None:
+            return attempts
+        try:
+            await asyncio.wait_for(attempts[0].ready.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            attempts[0].cancel()
+            raise
+        if not attempts[0].ready.is_set() and self.stats.try_hedge(self.budget):
+            attempts.append(_Attempt(self.alternate_name, True, self.alternate or self.primary, input, config))
+        return attempts
+
+    def _finish(self, attempts: List[_Attempt], winner: Optional[_Attempt]) -> None:
+        for attempt in attempts:
+            attempt.cancel()
+            self.stats.record(attempt.key, attempt.ttft)
+        if winner is not None:
+            self.stats.record_win(winner.hedged)
+
+    @staticmethod
+    async def _wait_ready(attempts: List[_Attempt]) -> None:
+        """Aguarda até alguma das requisições emitir o primeiro trecho ou terminar."""
+        waiters = [asyncio.ensure_future(attempt.ready.wait()) for attempt in attempts]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def ainvoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        attempts = await self._start(input, config)
+        pending = list(attempts)
+        winner: Optional[_Attempt] = None
+        fallback: Optional[_Attempt] = None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait([attempt.task for attempt in pending], return_when=asyncio.FIRST_COMPLETED)
+                for attempt in [attempt for attempt in pending if attempt.task in done]:
+                    pending.remove(attempt)
+                    if attempt.error is not None:
+                        error = attempt.error
+                        continue
+                    if self._is_valid("".join(attempt.parts)):
+                        winner = attempt
+                        return "".join(attempt.parts)
+                    fallback = fallback or attempt
+            # Nenhuma resposta válida: devolve a inválida (para o reparo de JSON) ou o último erro
+            if fallback is not None:
+                winner = fallback
+                return "".join(fallback.parts)
+            raise error
+        finally:
+            # Cancela a requisição perdedora (ou ambas, se quem chamou foi cancelado)
+            self._finish(attempts, winner)
+
+    async def astream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        attempts = await self._start(input, config)
+        pending = list(attempts)
+        winner: Optional[_Attempt] = None
+        try:
+            while winner is None:
+                await self._wait_ready(pending)
+                winner = next((attempt for attempt in pending if attempt.started_output), None)
+                for attempt in [attempt for attempt in pending if attempt.done and attempt.error is not None]:
+                    # Falhou antes do primeiro trecho: continua com a outra, se houver
+                    pending.remove(attempt)
+                    if winner is None and not pending:
+                        raise attempt.error
+            for other in attempts:
+                if other is not winner:
+                    other.cancel()
+            async for chunk in winner.chunks():
+                yield chunk
+        finally:
+            self._finish(attempts, winner)
+
+    def invoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        return asyncio.run_coroutine_threadsafe(self.ainvoke(input, config), _background_loop()).result()
+
+    def stream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        chunks: "queue.Queue[Tuple[Any, Optional[BaseException]]]" = queue.Queue()
+
+        async def produce() -> None:
+            try:
+                async for chunk in self.astream(input, config):
+                    chunks.put((chunk, None))
+            except BaseException as error:
+                chunks.put((_END, error))
+                raise
+            chunks.put((_END, None))
+
+        future = asyncio.run_coroutine_threadsafe(produce(), _background_loop())
+        try:
+            while True:
+                chunk, error = chunks.get()
+                if chunk is _END:
+                    if error is not None:
+                        raise error
+                    return
+                yield chunk
+        finally:
+            # Quem leu desistiu (ou terminou): cancela as requisições que ainda estiverem abertas
+            future.cancel()
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Optional
+
+import httpx
+
+from rate_limit import async_event_hooks, event_hooks
+
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# Pool compartilhado por todos os modelos do processo. As conexões ociosas ficam abertas
+# por `keepalive_expiry` segundos para que as próximas etapas não repitam o handshake TLS.
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=32, keepalive_expiry=120.0)
+DEFAULT_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+# Controle de taxa por modelo aplicado a todas as chamadas (desative com DOC_RATE_LIMIT=0)
+RATE_LIMIT_ENABLED = os.environ.get("DOC_RATE_LIMIT", "1") != "0"
+
+_lock = threading.Lock()
+_sync_client: Optional[httpx.Client] = None
+_async_client: Optional["LoopBoundAsyncClient"] = None
+
+
+class LoopBoundAsyncClient(httpx.AsyncClient):
+    """
+    AsyncClient que envia cada requisição por um cliente próprio do event loop em execução.
+
+    O pool de conexões de um AsyncClient fica associado ao loop em que foi usado; os modelos
+    guardam um único cliente, mas podem ser chamados de loops diferentes (o servidor, o loop
+    das requisições duplicadas de `hedging.py`, um `asyncio.run` por medida do benchmark).
+    Cada loop recebe seu próprio pool, descartado junto com o loop.
+    """
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._kwargs = kwargs
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self._clients_lock = threading.Lock()
+
+    def _loop_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            client = self._clients.get(loop)
+            if client is None or client.is_closed:
+                client = self._clients[loop] = httpx.AsyncClient(**self._kwargs)
+            return client
+
+    async def send(self, request: httpx.Request, **kwargs: Any) -> httpx.Response:
+        return await self._loop_client().send(request, **kwargs)
+
+    async def aclose(self) -> None:
+        """Fecha o pool do loop atual (os dos outros loops só podem ser fechados neles)."""
+        with self._clients_lock:
+            client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+        if not self._clients:
+            await super().aclose()
+
+
+def get_http_client() -> httpx.Client:
+    """Retorna o cliente HTTP síncrono compartilhado do processo."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(
+                limits=DEFAULT_LIMITS,
+                timeout=DEFAULT_TIMEOUT,
+                event_hooks=event_hooks() if RATE_LIMIT_ENABLED else None
+            )
+        return _sync_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Retorna o cliente HTTP assíncrono compartilhado do processo.
+
+    Pode ser usado de qualquer event loop: cada loop tem seu próprio pool de conexões
+    (veja `LoopBoundAsyncClient`).
+    """
+    global _async_client
+    with _lock:
+        if _async_client is None or _async_client.is_closed:
+            _async_client = LoopBoundAsyncClient(
+                limits=DEFAULT_LIMITS,
+                timeout=DEFAULT_TIMEOUT,
+                event_hooks=async_event_hooks() if RATE_LIMIT_ENABLED else None
+            )
+        return _async_client
+
+
+def prewarm(api_key: Optional[str] = None, base_url: Optional[str] = None) -> threading.Thread:
+    """
+    Abre uma conexão com a API em segundo plano, antes da primeira geração.
+
+    Faz um GET leve em /models usando o cliente compartilhado; a conexão TLS resultante fica
+    no pool e é reaproveitada pela primeira etapa. Erros são ignorados.
+
+    Args:
+        api_key (str): API key usada no cabeçalho Authorization, opcional
+        base_url (str): URL base da API (padrão: OPENAI_BASE_URL)
+
+    Returns:
+        threading.Thread: Thread (daemon) que executa o aquecimento
+    """
+    url = (base_url or OPENAI_BASE_URL).rstrip("/") + "/models"
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def _warm():
+        try:
+            get_http_client().get(url, headers=headers, timeout=10.0)
+        except httpx.HTTPError:
+            pass
+
+    thread = threading.Thread(target=_warm, name="openai-prewarm", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,457 @@
+import asyncio
+import copy
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable
+
+from checkpoints import COMPLETED, FAILED, RUNNING, CheckpointStore
+from pipeline import (
+    StageMemo,
+    arun_stage,
+    astream_stage,
+    missing_stages,
+    run_stage,
+    split_draft,
+    stage_fingerprint,
+    stream_stage,
+)
+from retry import RetryStats
+
+# Origem do resultado de cada etapa
+GENERATED = "gerada"
+RESTORED = "checkpoint"
+REUSED = "reaproveitada"
+
+# Situação de um job
+QUEUED = "na_fila"
+JOB_RUNNING = "executando"
+JOB_DONE = "concluido"
+JOB_FAILED = "falhou"
+
+# Eventos de progresso de um job (além das situações acima, emitidas ao iniciar e ao terminar)
+STAGE_STARTED = "etapa_iniciada"
+ITEM = "item"
+STAGE_RESTARTED = "reinicio"
+STAGE_COMPLETED = "etapa_concluida"
+MESSAGE = "mensagem"
+
+
+class Job:
+    """
+    Geração de documentação executada em segundo plano.
+
+    O progresso (etapa atual, elementos já recebidos e resultados concluídos) é atualizado
+    pela thread do worker e lido pela interface com `snapshot()`. Cada atualização também é
+    registrada em `events`, que pode ser acompanhado de forma assíncrona com `follow()`.
+    """
+
+    def __init__(self, job_id: str, description: str, run_id: Optional[str] = None):
+        self.id = job_id
+        self.description = description
+        self.run_id = run_id
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.results: Dict[str, Any] = {}
+        self.partial: Dict[str, Dict[str, List[Any]]] = {}
+        # Texto recebido do modelo na etapa em andamento (sem eventos: são muitos trechos)
+        self.text: Dict[str, str] = {}
+        self.origins: Dict[str, str] = {}
+        self.messages: List[str] = []
+        self.error: Optional[str] = None
+        self.stats = RetryStats()
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.pdf: Optional[bytes] = None
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def _emit(self, event: str, data: Dict[str, Any]) -> None:
+        # Chamado com o lock adquirido; acorda os leitores de `follow()` em seus event loops
+        self.events.append((event, data))
+        for loop, waiter in self._waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(waiter.set)
+        self._waiters.clear()
+
+    def add_event(self, event: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._emit(event, data)
+
+    def begin(self) -> None:
+        with self._lock:
+            self.status = JOB_RUNNING
+            self.started_at = time.time()
+            self._emit(JOB_RUNNING, {})
+
+    def finish(self, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.status = JOB_FAILED if error is not None else JOB_DONE
+            self.error = error
+            self.finished_at = time.time()
+            self._emit(self.status, {"erro": error} if error is not None else {})
+
+    def start_stage(self, stage: str) -> None:
+        with self._lock:
+            self.stage = stage
+            self.partial[stage] = {}
+            self.text[stage] = ""
+            self._emit(STAGE_STARTED, {"etapa": stage})
+
+    def add_item(self, stage: str, key: str, value: Any) -> None:
+        with self._lock:
+            self.partial.setdefault(stage, {}).setdefault(key, []).append(value)
+            self._emit(ITEM, {"etapa": stage, "chave": key, "valor": value})
+
+    def add_text(self, stage: str, chunk: str) -> None:
+        with self._lock:
+            self.text[stage] = self.text.get(stage, "") + chunk
+
+    def reset_stage(self, stage: str, message: str) -> None:
+        with self._lock:
+            self.partial[stage] = {}
+            self.text[stage] = ""
+            self.messages.append(message)
+            self._emit(STAGE_RESTARTED, {"etapa": stage, "mensagem": message})
+
+    def add_message(self, message: str) -> None:
+        with self._lock:
+            self.messages.append(message)
+            self._emit(MESSAGE, {"mensagem": message})
+
+    def finish_stage(self, stage: str, output: Dict[str, Any], origin: str = GENERATED) -> None:
+        with self._lock:
+            self.results[stage] = output
+            self.partial.pop(stage, None)
+            self.text.pop(stage, None)
+            self.origins[stage] = origin
+            self._emit(STAGE_COMPLETED, {"etapa": stage, "origem": origin, "resultado": output})
+
+    async def follow(self, start: int = 0, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[Tuple[int, str, Dict[str, Any]]]]:
+        """
+        Emite (índice, evento, dados) para cada evento a partir de `start`, aguardando os
+        próximos até o job terminar.
+
+        Args:
+            start (int): Índice do primeiro evento (para retomar uma conexão interrompida)
+            heartbeat (float): Segundos sem eventos após os quais é emitido None, opcional
+        """
+        index = start
+        while True:
+            waiter = asyncio.Event()
+            with self._lock:
+                pending = self.events[index:]
+                finished = self.finished
+                if not pending and not finished:
+                    self._waiters.append((asyncio.get_running_loop(), waiter))
+            for event, data in pending:
+                yield index, event, data
+                index += 1
+            if pending:
+                continue
+            if finished:
+                return
+            try:
+                await asyncio.wait_for(waiter.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cópia consistente do estado do job, para exibição."""
+        with self._lock:
+            return {
+                "id": self.id,
+                "run_id": self.run_id,
+                "status": self.status,
+                "etapa": self.stage,
+                "resultados": copy.deepcopy(self.results),
+                "parcial": copy.deepcopy(self.partial),
+                "texto": dict(self.text),
+                "origens": dict(self.origins),
+                "recalculadas": [stage for stage, origin in self.origins.items() if origin == GENERATED],
+                "mensagens": list(self.messages),
+                "erro": self.error,
+                "uso": self.stats.to_dict(),
+                "duracao": (self.finished_at or time.time()) - (self.started_at or self.created_at),
+            }
+
+
+def _prune_jobs(jobs: Dict[str, Job], ttl_seconds: float) -> None:
+    cutoff = time.time() - ttl_seconds
+    expired = [job_id for job_id, job in jobs.items() if job.finished and job.finished_at < cutoff]
+    for job_id in expired:
+        del jobs[job_id]
+
+
+class JobManager:
+    """
+    Fila de jobs executados por um pool de threads, compartilhada entre sessões.
+
+    Os jobs continuam rodando independentemente das reexecuções do script e das
+    reconexões do navegador; a sessão guarda apenas o id do job. Jobs concluídos são
+    descartados após `ttl_seconds`.
+    """
+
+    def __init__(self, max_workers: int = 4, ttl_seconds: float = 3600.0):
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="doc-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, description: str, target: Callable[[Job], Any], run_id: Optional[str] = None) -> Job:
+        """
+        Enfileira um job.
+
+        Args:
+            description (str): Descrição do sistema
+            target: Função executada no worker, recebendo o Job para reportar o progresso
+            run_id (str): Execução (checkpoint) associada, opcional
+
+        Returns:
+            Job: Job criado, já na fila
+        """
+        job = Job(uuid.uuid4().hex, description, run_id)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, target)
+        return job
+
+    def _run(self, job: Job, target: Callable[[Job], Any]) -> None:
+        job.begin()
+        try:
+            target(job)
+        except Exception as error:
+            job.finish(str(error))
+        else:
+            job.finish()
+
+    def _prune(self) -> None:
+        _prune_jobs(self._jobs, self.ttl_seconds)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Encerra o pool de threads; com `wait`, aguarda os jobs em andamento e os da fila."""
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "na_fila": sum(job.status == QUEUED for job in jobs),
+            "executando": sum(job.status == JOB_RUNNING for job in jobs),
+            "concluidos": sum(job.finished for job in jobs),
+        }
+
+
+class AsyncJobManager:
+    """
+    Versão de `JobManager` para servidores assíncronos: cada job é uma task no event loop.
+
+    No máximo `max_concurrency` jobs executam ao mesmo tempo; os demais aguardam no
+    semáforo sem ocupar threads.
+    """
+
+    def __init__(self, max_concurrency: int = 32, ttl_seconds: float = 3600.0):
+        self.max_concurrency = max_concurrency
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Criado sob demanda para ficar associado ao event loop em execução
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def submit(
+        self,
+        description: str,
+        target: Callable[[Job], Awaitable[Any]],
+        run_id: Optional[str] = None,
+        job_id: Optional[str] = None,
+    ) -> Job:
+        """Cria o job e agenda `target(job)` no event loop atual."""
+        _prune_jobs(self._jobs, self.ttl_seconds)
+        job = Job(job_id or uuid.uuid4().hex, description, run_id)
+        self._jobs[job.id] = job
+        task = asyncio.ensure_future(self._run(job, target))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return job
+
+    async def _run(self, job: Job, target: Callable[[Job], Awaitable[Any]]) -> None:
+        async with self.semaphore:
+            job.begin()
+            try:
+                await target(job)
+            except asyncio.CancelledError:
+                job.finish("Geração cancelada")
+                raise
+            except Exception as error:
+                job.finish(str(error))
+            else:
+                job.finish()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def close(self) -> None:
+        """Cancela os jobs em andamento (usado no encerramento do servidor)."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        jobs = list(self._jobs.values())
+        return {
+            "na_fila": sum(job.status == QUEUED for job in jobs),
+            "executando": sum(job.status == JOB_RUNNING for job in jobs),
+            "concluidos": sum(job.finished for job in jobs),
+        }
+
+
+def run_documentation(
+    job: Job,
+    chains: Dict[str, Runnable],
+    store: Optional[CheckpointStore] = None,
+    fan_out_apis: bool = False,
+    draft: bool = False,
+    memo: Optional[StageMemo] = None,
+    namespace: str = "",
+) -> Dict[str, Any]:
+    """
+    Executa as etapas de um job, reportando cada elemento do JSON à medida que chega.
+
+    Etapas já salvas no checkpoint (`job.run_id`) são recuperadas; as demais são
+    reaproveitadas de `memo` quando as entradas não mudaram, ou executadas e salvas.
+
+    Returns:
+        dict: Resultados indexados pela etapa
+    """
+    checkpoint = store is not None and job.run_id is not None
+    results: Dict[str, Any] = store.results(job.run_id) if checkpoint else {}
+    for stage in list(results):
+        job.finish_stage(stage, results[stage], RESTORED)
+    if checkpoint:
+        store.set_status(job.run_id, RUNNING)
+
+    def stream(stage: str) -> Dict[str, Any]:
+        job.start_stage(stage)
+        for event, payload in stream_stage(chains, stage, job.description, results, stats=job.stats, raw=True):
+            if event == "trecho":
+                job.add_text(stage, payload)
+            elif event == "item":
+                job.add_item(stage, *payload)
+            elif event == "reinicio":
+                job.reset_stage(stage, f"Falha de conexão em '{stage}', tentando novamente: {payload}")
+            elif event == "reparo":
+                job.add_message(f"JSON inválido em '{stage}', solicitando correção")
+            elif event == "resultado":
+                return payload
+
+    try:
+        if draft and not results:
+            for stage, output in split_draft(stream("rascunho")).items():
+                results[stage] = output
+                job.finish_stage(stage, output)
+                if checkpoint:
+                    store.save_stage(job.run_id, stage, output)
+        for stage in missing_stages(results):
+            fingerprint = stage_fingerprint(stage, job.description, results, namespace)
+            output = memo.get(stage, fingerprint) if memo is not None else None
+            reused = output is not None
+            if not reused:
+                if stage == "apis" and fan_out_apis:
+                    job.start_stage(stage)
+                    output = run_stage(chains, stage, job.description, results, fan_out_apis=True, stats=job.stats)
+                else:
+                    output = stream(stage)
+                if memo is not None:
+                    memo.set(stage, fingerprint, output)
+            results[stage] = output
+            job.finish_stage(stage, output, REUSED if reused else GENERATED)
+            if checkpoint:
+                store.save_stage(job.run_id, stage, output)
+    except Exception as error:
+        if checkpoint:
+            store.set_status(job.run_id, FAILED, str(error))
+        raise
+
+    if checkpoint:
+        store.set_status(job.run_id, COMPLETED)
+    return results
+
+
+async def arun_documentation(
+    job: Job,
+    chains: Dict[str, Runnable],
+    store: Optional[CheckpointStore] = None,
+    fan_out_apis: bool = False,
+    draft: bool = False,
+) -> Dict[str, Any]:
+    """
+    Versão assíncrona de `run_documentation`, baseada em `astream_stage`.
+
+    As gravações no checkpoint rodam em threads para não bloquear o event loop.
+    """
+    checkpoint = store is not None and job.run_id is not None
+    results: Dict[str, Any] = await asyncio.to_thread(store.results, job.run_id) if checkpoint else {}
+    for stage in list(results):
+        job.finish_stage(stage, results[stage], RESTORED)
+    if checkpoint:
+        await asyncio.to_thread(store.set_status, job.run_id, RUNNING)
+
+    async def stream(stage: str) -> Dict[str, Any]:
+        job.start_stage(stage)
+        async for event, payload in astream_stage(chains, stage, job.description, results, stats=job.stats):
+            if event == "item":
+                job.add_item(stage, *payload)
+            elif event == "reinicio":
+                job.reset_stage(stage, f"Falha de conexão em '{stage}', tentando novamente: {payload}")
+            elif event == "reparo":
+                job.add_message(f"JSON inválido em '{stage}', solicitando correção")
+            elif event == "resultado":
+                return payload
+
+    try:
+        if draft and not results:
+            for stage, output in split_draft(await stream("rascunho")).items():
+                results[stage] = output
+                job.finish_stage(stage, output)
+                if checkpoint:
+                    await asyncio.to_thread(store.save_stage, job.run_id, stage, output)
+        for stage in missing_stages(results):
+            if stage == "apis" and fan_out_apis:
+                job.start_stage(stage)
+                output = await arun_stage(chains, stage, job.description, results, fan_out_apis=True, stats=job.stats)
+            else:
+                output = await stream(stage)
+            results[stage] = output
+            job.finish_stage(stage, output)
+            if checkpoint:
+                await asyncio.to_thread(store.save_stage, job.run_id, stage, output)
+    except BaseException as error:
+        # Inclui o cancelamento no encerramento do servidor: a execução pode ser retomada depois
+        if checkpoint:
+            await asyncio.to_thread(store.set_status, job.run_id, FAILED, str(error) or type(error).__name__)
+        raise
+
+    if checkpoint:
+        await asyncio.to_thread(store.set_status, job.run_id, COMPLETED)
+    return results
@@ -0,0 +1,167 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class IncrementalJSONParser:
+    """
+    Parser incremental para as respostas JSON das etapas.
+
+    Recebe o texto em pedaços (por exemplo, os tokens de `chain.stream()`) e devolve cada
+    elemento das listas de primeiro nível assim que ele é fechado. Para a resposta
+    `{"apis": [{...}, {...}]}`, cada API é emitida como ("apis", {...}) sem esperar o
+    restante da resposta.
+
+    Qualquer texto antes do primeiro "{" (como "```json" ou uma frase introdutória) e depois
+    do fechamento do objeto principal é ignorado.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._element_start: Optional[int] = None
+        self._element_key: Optional[str] = None
+        self.items: Dict[str, List[Any]] = {}
+
+    @property
+    def done(self) -> bool:
+        """Indica se o objeto JSON principal já foi fechado."""
+        return self._end is not None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Consome um pedaço de texto.
+
+        Args:
+            chunk (str): Próximo trecho da resposta
+
+        Returns:
+            list: Pares (chave, elemento) concluídos neste trecho
+        """
+        self.buffer += chunk
+        completed: List[Tuple[str, Any]] = []
+        buffer = self.buffer
+
+        while self._pos < len(buffer) and self._end is None:
+            pos = self._pos
+            char = buffer[pos]
+            self._pos += 1
+
+            if self._start is None:
+                if char == "{":
+                    self._start = pos
+                    self._stack.append("{")
+                    self._expect_key = True
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._string_closed(pos, completed)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+                self._maybe_start_element(pos)
+            elif char in "{[":
+                self._maybe_start_element(pos)
+                self._stack.append(char)
+            elif char in "}]":
+                if len(self._stack) == 2 and char == "]":
+                    self._close_scalar(pos, completed)
+                if self._stack:
+                    self._stack.pop()
+                if len(self._stack) == 2 and self._element_start is not None:
+                    self._emit(self._element_start, pos + 1, completed)
+                if not self._stack:
+                    self._end = pos + 1
+            elif char == ",":
+                if len(self._stack) == 1:
+                    self._expect_key = True
+                elif len(self._stack) == 2:
+                    self._close_scalar(pos, completed)
+            elif not char.isspace() and char != ":":
+                self._maybe_start_element(pos)
+
+        return completed
+
+    def _at_list_level(self) -> bool:
+        return self._stack == ["{", "["]
+
+    def _maybe_start_element(self, pos: int) -> None:
+        if self._at_list_level() and self._element_start is None:
+            self._element_start = pos
+            self._element_key = self._key
+
+    def _string_closed(self, pos: int, completed: List[Tuple[str, Any]]) -> None:
+        if len(self._stack) == 1 and self._expect_key:
+            try:
+                self._key = json.loads(self.buffer[self._string_start:pos + 1])
+            except json.JSONDecodeError:
+                self._key = self.buffer[self._string_start + 1:pos]
+            self._expect_key = False
+        elif self._at_list_level() and self._element_start == self._string_start:
+            self._emit(self._string_start, pos + 1, completed)
+
+    def _close_scalar(self, pos: int, completed: List[Tuple[str, Any]]) -> None:
+        # Números, booleanos e null terminam no próximo "," ou "]"
+        if self._element_start is not None:
+            self._emit(self._element_start, pos, completed)
+
+    def _emit(self, start: int, end: int, completed: List[Tuple[str, Any]]) -> None:
+        key = self._element_key
+        self._element_start = None
+        self._element_key = None
+        try:
+            value = json.loads(self.buffer[start:end])
+        except json.JSONDecodeError:
+            return
+        self.items.setdefault(key, []).append(value)
+        completed.append((key, value))
+
+    def fragment(self) -> str:
+        """Texto do objeto principal lido até agora: do primeiro "{" ao fechamento, sem o que vier depois."""
+        if self._start is None:
+            return self.buffer
+        return self.buffer[self._start:self._end]
+
+    def partial(self) -> Dict[str, Any]:
+        """Retorna um objeto com os elementos já concluídos, útil para exibição parcial."""
+        return {key: list(values) for key, values in self.items.items()}
+
+    def close(self) -> Dict[str, Any]:
+        """
+        Finaliza o parse e retorna o objeto completo.
+
+        Se o objeto principal não puder ser lido, tenta o texto inteiro e, por fim,
+        retorna um objeto de erro com a resposta original.
+        """
+        if self._start is not None and self._end is not None:
+            try:
+                return json.loads(self.buffer[self._start:self._end])
+            except json.JSONDecodeError:
+                pass
+
+        try:
+            parsed = json.loads(self.buffer)
+            if isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+
+        return {
+            "erro": "Não foi possível gerar um JSON válido",
+            "resposta_original": self.buffer
+        }
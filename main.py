@@ -1,11 +1,26 @@
-from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
 import streamlit as st
-from langchain_community.callbacks import StreamlitCallbackHandler
 import json
-from typing import Dict, Any, List
-from pdf_generator import gerar_pdf
+import os
+import threading
+import time
+from langchain_community.callbacks import StreamlitCallbackHandler
+from pdf_generator import render_pdf
+from cache import response_cache_from_env
+from semantic_cache import SemanticCache
+from hedging import HedgeStats
+from routing import ModelRouter
+from coalescing import SingleFlight
+from fake_llm import OFFLINE_MODES, offline_llm_from_env
+from http_client import OPENAI_BASE_URL, prewarm
+from checkpoints import COMPLETED, RUN_LEASE, CheckpointStore
+from jobs import JOB_DONE, JOB_RUNNING, RESTORED, REUSED, JobManager, run_documentation
+from pipeline import DRAFT_SECTIONS, STAGES, StageMemo, create_llm, create_chains, key_fingerprint, export_json
+
+# Modelos disponíveis na interface
+MODELS = ["gpt-3.5-turbo", "gpt-4", "gpt-4o-mini", "gpt-4o"]
+
+# Latência máxima padrão (segundos) de cada etapa no roteamento automático
+DEFAULT_LATENCY_TARGETS = {"requisitos": 15.0, "fluxo": 20.0, "apis": 40.0}
 
 # Configuração da página Streamlit
 st.set_page_config(page_title="Gerador de Documentação Técnica", layout="wide")
@@ -15,190 +30,346 @@ st.title("🚀 Gerador de Documentação Técnica")
 with st.sidebar:
     st.header("⚙️ Configurações")
     openai_api_key = st.text_input("OpenAI API Key", type="password")
+    base_url = st.text_input(
+        "URL base da API", value=OPENAI_BASE_URL,
+        help="Qualquer API compatível com a da OpenAI, como o servidor local de testes (openai_server.py)"
+    )
     temperature = st.slider("Temperatura", min_value=0.0, max_value=1.0, value=0.7, step=0.1)
-    model_name = st.selectbox("Modelo", ["gpt-3.5-turbo", "gpt-4"])
+    model_name = st.selectbox("Modelo", MODELS)
+    similarity_threshold = st.slider(
+        "Similaridade mínima (cache semântico)", min_value=0.85, max_value=1.0, value=0.95, step=0.01,
+        help="Descrições com similaridade acima deste valor reutilizam os requisitos já gerados"
+    )
+    fan_out_apis = st.checkbox(
+        "Gerar APIs por componente (paralelo)", value=False,
+        help="Faz uma chamada por componente em paralelo e junta as rotas; reduz o tempo da etapa de APIs"
+    )
+    draft_mode = st.checkbox(
+        "Modo rascunho (uma única chamada)", value=False,
+        help="Gera requisitos, fluxo e APIs em uma só requisição; mais rápido e barato, para prévias"
+    )
+    structured_output = st.checkbox(
+        "Saída estruturada (JSON schema)", value=True,
+        help="O formato do JSON é garantido pelo provedor, com prompts menores e sem reparos de JSON"
+    )
+    with st.expander("Requisições duplicadas (hedging)"):
+        hedge_enabled = st.checkbox(
+            "Duplicar chamadas lentas", value=False,
+            help="Envia uma segunda requisição quando a primeira demora mais que o percentil escolhido "
+                 "para começar a responder; a primeira resposta válida é usada"
+        )
+        hedge_percentile = st.slider("Percentil de disparo", min_value=0.50, max_value=0.99, value=0.95, step=0.01)
+        hedge_model = st.selectbox("Modelo da requisição duplicada", ["mesmo modelo", *MODELS])
+        hedge_budget = st.slider("Orçamento (% das requisições)", min_value=1, max_value=50, value=10, step=1)
+    with st.expander("Modelo por etapa"):
+        routing_mode = st.radio(
+            "Escolha do modelo", ["Mesmo modelo", "Por etapa", "Automático"],
+            help="Automático: usa o modelo mais barato que cumpre a latência máxima e gera JSON válido, "
+                 "com base no histórico das execuções"
+        )
+        stage_models = {}
+        router_models = []
+        latency_targets = {}
+        if routing_mode == "Por etapa":
+            for stage in STAGES:
+                stage_models[stage] = st.selectbox(f"Modelo ({stage})", MODELS, index=MODELS.index(model_name))
+        elif routing_mode == "Automático":
+            router_models = st.multiselect("Modelos candidatos", MODELS, default=MODELS)
+            for stage in STAGES:
+                latency_targets[stage] = st.number_input(
+                    f"Latência máxima ({stage}, segundos)", min_value=1.0, max_value=300.0,
+                    value=DEFAULT_LATENCY_TARGETS[stage], step=1.0
+                )
+
+@st.cache_resource
+def get_response_cache():
+    """Cache de respostas compartilhado entre sessões e reexecuções do script (memória + DOC_CACHE_PATH)."""
+    return response_cache_from_env()
+
+@st.cache_resource
+def get_checkpoint_store() -> CheckpointStore:
+    """Resultados salvos de cada etapa por execução (DOC_CHECKPOINT_PATH), para retomar após falhas."""
+    return CheckpointStore(os.environ.get("DOC_CHECKPOINT_PATH", ".cache/execucoes.sqlite"))
+
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    """Cache por similaridade das descrições, compartilhado entre sessões."""
+    return SemanticCache()
+
+@st.cache_resource
+def get_hedge_stats() -> HedgeStats:
+    """Histórico de latência e orçamento das requisições duplicadas, compartilhado entre sessões."""
+    return HedgeStats()
+
+@st.cache_resource
+def get_single_flight() -> SingleFlight:
+    """Chamadas ao modelo em andamento, compartilhadas entre sessões que geram a mesma descrição."""
+    return SingleFlight()
+
+@st.cache_resource
+def get_model_router() -> ModelRouter:
+    """Histórico de latência e validade por etapa e modelo, compartilhado entre sessões."""
+    return ModelRouter()
+
+@st.cache_resource(max_entries=32)
+def get_chains(
+    model: str, temp: float, fingerprint: str, threshold: float, _api_key: str,
+    hedge: tuple = None, stage_models: tuple = (), routing: tuple = None, structured: bool = True,
+    base_url: str = None
+):
+    """
+    Cria o LLM e as chains uma única vez por combinação de configurações.
+
+    Os objetos são reaproveitados entre cliques e sessões, mantendo os clientes HTTP
+    aquecidos. A chave entra no cache apenas pela impressão digital (`fingerprint`).
+    `hedge` é None (desativado) ou (percentil, modelo alternativo, orçamento);
+    `stage_models` são pares (etapa, modelo); `routing` é None (desativado) ou
+    (modelos candidatos, pares (etapa, latência máxima)).
+    """
+    def new_llm(name: str):
+        # DOC_LLM=fake/replay usa o modelo local (testes e demonstrações sem API key);
+        # DOC_LLM=record grava na cassete as respostas do modelo real
+        recorder = None
+        if os.environ.get("DOC_LLM") == "record":
+            recorder = create_llm(_api_key, temp, name, streaming=False, base_url=base_url)
+        return offline_llm_from_env(name, recorder) or create_llm(_api_key, temp, name, base_url=base_url)
+
+    llm = new_llm(model)
+    llms = {model: llm}
+
+    def get_llm(name: str):
+        if name not in llms:
+            llms[name] = new_llm(name)
+        return llms[name]
+
+    options = {}
+    if hedge is not None:
+        percentile, hedge_model, budget = hedge
+        options.update(
+            hedge_stats=get_hedge_stats(),
+            hedge_llm=get_llm(hedge_model) if hedge_model != model else None,
+            hedge_percentile=percentile,
+            hedge_budget=budget,
+        )
+    if stage_models:
+        options["stage_llms"] = {stage: (name, get_llm(name)) for stage, name in stage_models}
+    if routing is not None:
+        candidates, targets = routing
+        options.update(
+            router=get_model_router(),
+            router_llms={name: get_llm(name) for name in candidates},
+            latency_targets=dict(targets),
+        )
+    # Respostas de outra API (como o servidor local de testes) não entram nos caches compartilhados
+    shared_caches = (base_url or OPENAI_BASE_URL) == OPENAI_BASE_URL
+    return create_chains(
+        llm, model, temp,
+        cache=get_response_cache() if shared_caches else None,
+        semantic_cache=get_semantic_cache() if shared_caches else None,
+        similarity_threshold=threshold,
+        structured_output=structured,
+        single_flight=get_single_flight(),
+        **options
+    )
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """Fila de gerações em segundo plano, compartilhada entre sessões (DOC_JOB_WORKERS threads)."""
+    return JobManager(max_workers=int(os.environ.get("DOC_JOB_WORKERS", "4")))
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def build_pdf(results_json: str) -> bytes:
+    """Gera o PDF uma única vez por resultado, mesmo com o resultado exibido em várias reexecuções."""
+    return render_pdf(json.loads(results_json))
 
-# Templates de prompts corrigidos
-PROMPT_TEMPLATES = {
-    "requisitos": """
-    Analise a seguinte descrição do sistema e gere requisitos funcionais e não funcionais.
-    Retorne APENAS um objeto JSON com requisitos funcionais e não funcionais.
+def render_downloads(results: dict, partial: bool = False):
+    """Botões de download do PDF e do JSON; com `partial=True` as etapas ausentes ficam vazias."""
+    suffix = "_parcial" if partial else ""
     
-    O JSON deve seguir este formato:
-    {{
-        "requisitos_funcionais": [
-            {{"id": "RF01", "descricao": "descrição do requisito", "prioridade": "Alta/Média/Baixa"}}
-        ],
-        "requisitos_nao_funcionais": [
-            {{"id": "RNF01", "descricao": "descrição do requisito", "tipo": "Desempenho/Segurança/Usabilidade"}}
-        ]
-    }}
+    # Criar coluna para os botões de download
+    col1, col2 = st.columns(2)
     
-    Descrição do sistema:
-    {descricao_sistema}
-    """,
+    # Gerar e oferecer download do PDF
+    try:
+        pdf_buffer = build_pdf(json.dumps(results, sort_keys=True))
+        with col1:
+            st.download_button(
+                label="📥 Download PDF" + (" (parcial)" if partial else ""),
+                data=pdf_buffer,
+                file_name=f"documentacao_tecnica{suffix}.pdf",
+                mime="application/pdf",
+                help="Baixar documentação em formato PDF"
+            )
+    except Exception as pdf_error:
+        st.error(f"Erro ao gerar PDF: {str(pdf_error)}")
     
-    "fluxo": """
-    Com base nos requisitos fornecidos, descreva o fluxo de componentes e a arquitetura geral.
-    Retorne APENAS um objeto JSON com componentes e seus fluxos.
+    # Manter a opção de download do JSON
+    with col2:
+        st.download_button(
+            label="📥 Download JSON" + (" (parcial)" if partial else ""),
+            data=json.dumps(export_json(results), indent=2, ensure_ascii=False),
+            file_name=f"documentacao_tecnica{suffix}.json",
+            mime="application/json",
+            help="Baixar documentação em formato JSON"
+        )
+
+def generate_documentation(
+    description: str, api_key: str, temp: float, model: str, threshold: float = 0.95, fan_out: bool = False,
+    hedge: tuple = None, stage_models: tuple = (), routing: tuple = None, structured: bool = True,
+    draft: bool = False, run_id: str = None, base_url: str = None
+):
+    """Enfileira a geração como um job em segundo plano e guarda o id do job na sessão e na URL."""
+    offline = os.environ.get("DOC_LLM") in OFFLINE_MODES
+    if not api_key and (not offline or os.environ.get("DOC_LLM") == "record"):
+        st.error("Por favor, insira sua API key!")
+        return None
     
-    O JSON deve seguir este formato:
-    {{
-        "componentes": [
-            {{
-                "nome": "nome do componente",
-                "descricao": "descrição detalhada",
-                "responsabilidades": ["responsabilidade 1", "responsabilidade 2"],
-                "dependencias": ["dependencia 1", "dependencia 2"]
-            }}
-        ],
-        "fluxos": [
-            {{
-                "nome": "nome do fluxo",
-                "passos": ["passo 1", "passo 2", "passo 3"]
-            }}
-        ]
-    }}
+    # Clique duplo: a geração desta sessão para a mesma descrição ainda está em andamento
+    current = get_job_manager().get(st.session_state.get("job_id", ""))
+    if current is not None and not current.finished and current.description == description and run_id is None:
+        return current
     
-    Requisitos:
-    {requisitos}
-    """,
+    try:
+        # Modelo e chains reaproveitados entre execuções (com cache de respostas e cache semântico nos requisitos)
+        # Os modelos locais não implementam a saída estruturada do provedor
+        structured = structured and not offline
+        chains = get_chains(
+            model, temp, key_fingerprint(api_key), threshold, api_key, hedge, stage_models, routing, structured, base_url
+        )
+    except Exception as e:
+        st.error(f"Erro ao inicializar o modelo: {str(e)}")
+        return None
     
-    "apis": """
-    Com base no fluxo de componentes, gere um mapa de APIs detalhado.
-    Retorne APENAS um objeto JSON com as definições das APIs.
+    # Cada etapa é salva assim que termina; uma execução que falhou pode ser retomada
+    # com as mesmas configurações, guardadas junto com ela
+    store = get_checkpoint_store()
+    if run_id is None:
+        settings = {
+            "modelo": model, "temperatura": temp, "rascunho": draft, "limiar": threshold,
+            "apis_paralelas": fan_out, "duplicacao": hedge, "modelos_etapas": stage_models,
+            "roteamento": routing, "saida_estruturada": structured, "base_url": base_url,
+        }
+        run_id = store.create_run(description, settings)
+    elif not store.claim_run(run_id, RUN_LEASE):
+        # Clique duplo ou outra sessão já retomou a execução
+        st.error("A execução já está em andamento.")
+        return None
     
-    O JSON deve seguir este formato:
-    {{
-        "apis": [
-            {{
-                "rota": "/caminho/da/api",
-                "metodo": "GET/POST/PUT/DELETE",
-                "descricao": "descrição da funcionalidade",
-                "parametros": {{
-                    "param1": "descrição do parâmetro"
-                }},
-                "respostas": {{
-                    "200": "descrição da resposta de sucesso",
-                    "400": "descrição do erro"
-                }}
-            }}
-        ]
-    }}
+    # Etapas cujas entradas não mudaram desde a última geração são reaproveitadas
+    memo = st.session_state.setdefault("stage_memo", StageMemo())
+    namespace = repr((model, temp, threshold, structured, stage_models, routing, fan_out, draft, base_url))
     
-    Fluxo de componentes:
-    {fluxo_componentes}
-    """
+    job = get_job_manager().submit(
+        description,
+        lambda job: run_documentation(job, chains, store, fan_out, draft, memo, namespace),
+        run_id
+    )
+    # Renova a concessão desde a fila, para que outra sessão não retome a execução em paralelo
+    threading.Thread(target=keep_alive, args=(store, job), daemon=True).start()
+    st.session_state["job_id"] = job.id
+    st.session_state["run_id"] = run_id
+    st.query_params["job"] = job.id
+    st.query_params["run"] = run_id
+    return job
+
+def keep_alive(store: CheckpointStore, job) -> None:
+    """Renova a concessão da execução do job enquanto ele não termina."""
+    while not job.finished:
+        time.sleep(RUN_LEASE / 3)
+        if not job.finished:
+            store.touch(job.run_id)
+
+def stored_settings(settings: dict) -> dict:
+    """Configurações de uma execução salva, com as listas do JSON de volta a tuplas (chaves dos caches)."""
+    def as_tuple(value):
+        return tuple(as_tuple(item) for item in value) if isinstance(value, list) else value
+    return {name: as_tuple(value) for name, value in settings.items()}
+
+STAGE_TITLES = {
+    "requisitos": "📋 Requisitos do Sistema",
+    "fluxo": "🔄 Fluxo de Componentes",
+    "apis": "🔌 Mapa de APIs",
+}
+
+ORIGIN_CAPTIONS = {
+    RESTORED: "✅ Recuperado do checkpoint da execução {run_id}",
+    REUSED: "♻️ Reaproveitado: entradas iguais às da última geração",
 }
 
-def ensure_json_response(response: str) -> Dict[str, Any]:
+def render_llm_stream(text: str):
     """
-    Garante que a resposta seja um JSON válido.
-    Se não for, tenta extrair um JSON válido ou cria um objeto de erro.
+    Texto recebido do modelo na etapa em andamento, exibido pelo StreamlitCallbackHandler.
+
+    O job roda em uma thread do worker, que não pode escrever na página; a cada atualização
+    do fragmento o texto acumulado é repassado a um handler novo, como tokens do streaming.
     """
-    try:
-        # Tenta fazer o parse direto
-        return json.loads(response)
-    except json.JSONDecodeError:
-        try:
-            # Procura por um objeto JSON válido na string
-            start_idx = response.find('{')
-            end_idx = response.rfind('}') + 1
-            if start_idx != -1 and end_idx != 0:
-                json_str = response[start_idx:end_idx]
-                return json.loads(json_str)
-        except:
-            # Se tudo falhar, retorna um objeto de erro
-            return {
-                "erro": "Não foi possível gerar um JSON válido",
-                "resposta_original": response
-            }
-
-def generate_documentation(description: str, api_key: str, temp: float, model: str):
-    if not api_key:
-        st.error("Por favor, insira sua API key!")
+    handler = StreamlitCallbackHandler(st.container(), collapse_completed_thoughts=False)
+    handler.on_llm_start({}, [])
+    handler.on_llm_new_token(text)
+
+def render_job(snapshot: dict):
+    """Exibe as etapas do job: concluídas, em andamento (elementos parciais) e pendentes."""
+    draft = snapshot["parcial"].get("rascunho") or {}
+    for stage in STAGES:
+        st.subheader(STAGE_TITLES[stage])
+        # No modo rascunho cada etapa mostra só as suas chaves do JSON parcial
+        partial = snapshot["parcial"].get(stage) or {key: draft[key] for key in DRAFT_SECTIONS[stage] if key in draft}
+        if stage in snapshot["resultados"]:
+            origin = snapshot["origens"].get(stage)
+            if origin in ORIGIN_CAPTIONS:
+                st.caption(ORIGIN_CAPTIONS[origin].format(run_id=snapshot["run_id"]))
+            st.json(snapshot["resultados"][stage])
+        elif partial:
+            st.json(partial)
+        elif snapshot["etapa"] in (stage, "rascunho") and not snapshot["erro"]:
+            st.caption("⏳ Aguardando o modelo...")
+    text = snapshot["texto"].get(snapshot["etapa"])
+    if snapshot["status"] == JOB_RUNNING and text:
+        render_llm_stream(text)
+    for message in snapshot["mensagens"]:
+        st.caption(message)
+    uso = snapshot["uso"]
+    st.caption(
+        f"Chamadas: {uso['chamadas']} · novas tentativas: {uso['novas_tentativas']} · "
+        f"reparos de JSON: {uso['reparos']} · tokens: {uso['tokens_entrada']} entrada / {uso['tokens_saida']} saída · "
+        f"{snapshot['duracao']:.1f}s"
+    )
+
+@st.fragment(run_every=1.0)
+def job_progress(job_id: str):
+    """Acompanha o job a cada segundo, sem reexecutar o restante da página."""
+    job = get_job_manager().get(job_id)
+    if job is None or job.finished:
+        # Concluído: uma única reexecução completa exibe o resultado final fora do fragmento
+        st.rerun(scope="app")
+    snapshot = job.snapshot()
+    label = "Na fila..." if snapshot["etapa"] is None else f"Gerando: {snapshot['etapa']}..."
+    with st.status(label, state="running", expanded=True):
+        render_job(snapshot)
+
+def render_job_result(snapshot: dict):
+    """Resultado final de um job: documentação completa ou parcial, com a opção de retomar."""
+    if snapshot["status"] == JOB_DONE:
+        with st.status("Documentação gerada", state="complete", expanded=True):
+            render_job(snapshot)
+        st.info(f"Etapas recalculadas: {', '.join(snapshot['recalculadas']) or 'nenhuma'}")
+        render_downloads(snapshot["resultados"])
         return
     
-    try:
-        # Inicialização do modelo
-        llm = ChatOpenAI(
-            model=model,
-            temperature=temp,
-            openai_api_key=api_key,
-            streaming=True,
-            callbacks=[StreamlitCallbackHandler(st.container())]
-        )
-        
-        # Criação dos prompts
-        prompts = {
-            name: PromptTemplate.from_template(template)
-            for name, template in PROMPT_TEMPLATES.items()
-        }
-        
-        # Criação das chains
-        chains = {
-            name: (prompt | llm | StrOutputParser())
-            for name, prompt in prompts.items()
-        }
-        
-        # Execução das chains com tratamento de erro aprimorado
-        with st.spinner("Gerando documentação..."):
-            try:
-                # Requisitos
-                st.subheader("📋 Requisitos do Sistema")
-                requisitos_response = chains["requisitos"].invoke({"descricao_sistema": description})
-                requisitos_json = ensure_json_response(requisitos_response)
-                st.json(requisitos_json)
-                
-                # Fluxo de Componentes
-                st.subheader("🔄 Fluxo de Componentes")
-                fluxo_response = chains["fluxo"].invoke({"requisitos": json.dumps(requisitos_json)})
-                fluxo_json = ensure_json_response(fluxo_response)
-                st.json(fluxo_json)
-                
-                # Mapa de APIs
-                st.subheader("🔌 Mapa de APIs")
-                apis_response = chains["apis"].invoke({"fluxo_componentes": json.dumps(fluxo_json)})
-                apis_json = ensure_json_response(apis_response)
-                st.json(apis_json)
-                
-                # Criar coluna para os botões de download
-                col1, col2 = st.columns(2)
-                
-                # Gerar e oferecer download do PDF
-                try:
-                    pdf_buffer = gerar_pdf(requisitos_json, fluxo_json, apis_json)
-                    with col1:
-                        st.download_button(
-                            label="📥 Download PDF",
-                            data=pdf_buffer,
-                            file_name="documentacao_tecnica.pdf",
-                            mime="application/pdf",
-                            help="Baixar documentação em formato PDF"
-                        )
-                except Exception as pdf_error:
-                    st.error(f"Erro ao gerar PDF: {str(pdf_error)}")
-                
-                # Manter a opção de download do JSON
-                with col2:
-                    st.download_button(
-                        label="📥 Download JSON",
-                        data=json.dumps({
-                            "requisitos": requisitos_json,
-                            "fluxo_componentes": fluxo_json,
-                            "mapa_apis": apis_json
-                        }, indent=2, ensure_ascii=False),
-                        file_name="documentacao_tecnica.json",
-                        mime="application/json",
-                        help="Baixar documentação em formato JSON"
-                    )
-                
-            except Exception as e:
-                st.error(f"Erro ao processar etapa: {str(e)}")
-                st.info("Tente ajustar a temperatura ou usar um modelo diferente.")
-                
-    except Exception as e:
-        st.error(f"Erro ao inicializar o modelo: {str(e)}")
+    with st.status("Falha na geração", state="error", expanded=True):
+        render_job(snapshot)
+    st.error(f"Erro ao processar etapa: {snapshot['erro']}")
+    st.info(
+        "As etapas concluídas foram salvas. Use 'Retomar execução' para continuar da etapa que falhou "
+        "(se quiser, ajuste antes a temperatura ou o modelo)."
+    )
+    if snapshot["resultados"]:
+        render_downloads(snapshot["resultados"], partial=True)
+
+# Abre a conexão com a API assim que a chave é informada, antes do primeiro clique
+if openai_api_key and st.session_state.get("prewarmed_key") != (key_fingerprint(openai_api_key), base_url):
+    prewarm(openai_api_key, base_url)
+    st.session_state["prewarmed_key"] = (key_fingerprint(openai_api_key), base_url)
 
 # Interface principal
 st.header("📝 Descreva seu Sistema")
@@ -208,12 +379,88 @@ system_description = st.text_area(
     placeholder="Exemplo: Um sistema de e-commerce onde usuários podem visualizar produtos..."
 )
 
+def start_generation(description: str, run_id: str = None, settings: dict = None):
+    """Gera com as configurações da barra lateral ou, ao retomar, com as salvas na execução (`settings`)."""
+    hedge_settings = None
+    if hedge_enabled:
+        hedge_settings = (hedge_percentile, model_name if hedge_model == "mesmo modelo" else hedge_model, hedge_budget / 100)
+    routing_settings = None
+    if routing_mode == "Automático" and router_models:
+        routing_settings = (tuple(router_models), tuple(sorted(latency_targets.items())))
+    current = {
+        "modelo": model_name, "temperatura": temperature, "rascunho": draft_mode, "limiar": similarity_threshold,
+        "apis_paralelas": fan_out_apis, "duplicacao": hedge_settings, "modelos_etapas": tuple(sorted(stage_models.items())),
+        "roteamento": routing_settings, "saida_estruturada": structured_output, "base_url": base_url,
+    }
+    # Execuções antigas não guardam todas as configurações; as que faltam vêm da barra lateral
+    current.update(stored_settings(settings or {}))
+    return generate_documentation(
+        description, openai_api_key, current["temperatura"], current["modelo"],
+        current["limiar"], current["apis_paralelas"], current["duplicacao"], current["modelos_etapas"],
+        current["roteamento"], current["saida_estruturada"], current["rascunho"], run_id, current["base_url"]
+    )
+
 if st.button("🎯 Gerar Documentação"):
     if system_description:
-        generate_documentation(system_description, openai_api_key, temperature, model_name)
+        start_generation(system_description)
     else:
         st.warning("Por favor, insira uma descrição do sistema!")
 
+# Job desta sessão (ou indicado pelo link com ?job=...), que continua rodando entre reexecuções e reconexões
+job_id = st.session_state.get("job_id") or st.query_params.get("job")
+job = get_job_manager().get(job_id) if job_id else None
+if job is not None:
+    st.session_state["job_id"] = job.id
+    if job.finished:
+        render_job_result(job.snapshot())
+    else:
+        job_progress(job.id)
+
+# Execução interrompida sem job ativo (por exemplo, após reiniciar o servidor), indicada pela sessão ou por ?run=...
+pending_run = None
+pending_run_id = st.session_state.get("run_id") or st.query_params.get("run")
+if pending_run_id and (job is None or job.finished):
+    pending_run = get_checkpoint_store().load(pending_run_id)
+    if pending_run is not None and pending_run["status"] == COMPLETED:
+        pending_run = None
+
+if pending_run is not None:
+    if job is None:
+        st.warning(
+            f"A execução {pending_run['run_id']} não terminou "
+            f"({', '.join(pending_run['resultados']) or 'nenhuma etapa'} concluída(s))."
+        )
+        if pending_run["resultados"]:
+            render_downloads(pending_run["resultados"], partial=True)
+    if st.button("🔁 Retomar execução"):
+        if start_generation(pending_run["descricao"], pending_run["run_id"], pending_run["configuracao"]) is not None:
+            st.rerun()
+
+# Estatísticas do cache de respostas
+with st.sidebar:
+    cache_stats = get_response_cache().stats()
+    st.caption(f"Cache: {cache_stats['hits']} acertos, {cache_stats['misses']} falhas, {cache_stats['entries']} entradas")
+    job_stats = get_job_manager().stats()
+    if job_stats["executando"] or job_stats["na_fila"]:
+        st.caption(f"Gerações em andamento: {job_stats['executando']} executando, {job_stats['na_fila']} na fila")
+    semantic_stats = get_semantic_cache().stats()
+    st.caption(f"Cache semântico: {semantic_stats['hits']} acertos, {semantic_stats['entries']} descrições")
+    flight_stats = get_single_flight().stats()
+    if flight_stats["compartilhadas"]:
+        st.caption(f"Chamadas compartilhadas entre gerações simultâneas: {flight_stats['compartilhadas']}")
+    hedge_stats = get_hedge_stats().to_dict()
+    if hedge_stats["duplicadas"]:
+        st.caption(
+            f"Requisições duplicadas: {hedge_stats['duplicadas']} de {hedge_stats['requisicoes']}, "
+            f"{hedge_stats['vitorias_duplicadas']} mais rápidas que a original"
+        )
+    for route, summary in get_model_router().stats().items():
+        if summary["amostras"]:
+            st.caption(
+                f"{route}: {summary['amostras']} chamadas, p90 {summary['latencia']:.1f}s, "
+                f"{summary['validade']:.0%} válidas"
+            )
+
 # Informações adicionais
 st.markdown("---")
 st.markdown("""
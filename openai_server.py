@@ -0,0 +1,457 @@
+"""
+Servidor local compatível com a API de chat completions da OpenAI, para testes de carga e de falhas.
+
+Responde POST /v1/chat/completions (com e sem streaming, inclusive saída estruturada por JSON
+schema ou function calling) com as respostas fixas de `fake_llm.py` ou as de uma cassete
+gravada, simulando o comportamento de uma API real sob carga: latência até o primeiro token e
+entre tokens com distribuições configuráveis, limites por minuto com os cabeçalhos
+x-ratelimit-* e respostas 429, erros 5xx, conexões que caem no meio do streaming, requisições
+que travam e JSON truncado.
+
+    python openai_server.py --port 8787 --latency lognormal:0.8,0.5 --token-delay uniform:0.005,0.03 --rpm 60
+    OPENAI_BASE_URL=http://localhost:8787/v1 OPENAI_API_KEY=teste python server.py
+
+O perfil também pode vir de um roteiro JSON (`--script`) com fases que se sucedem no tempo,
+como uma indisponibilidade de 10 segundos a cada 40:
+
+    {"fases": [{"duracao": 30, "latencia": "lognormal:0.8,0.5"}, {"duracao": 10, "taxa_erro": 1.0}], "repetir": true}
+
+PUT /_perfil troca o perfil (ou o roteiro) durante o teste, completado pelas opções da linha de
+comando como o `--script`; GET /_perfil mostra o perfil
+atual e os contadores do servidor.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from langchain_core.messages import BaseMessage, convert_to_messages
+
+from fake_llm import ReplayChatModel, prompt_hash, split_tokens, structured_response
+from rate_limit import estimate_request_tokens, estimate_tokens
+from schemas import STAGE_SCHEMAS
+
+# Configurações de um perfil e seus valores padrão (tempos em segundos, taxas entre 0 e 1)
+DEFAULT_PROFILE: Dict[str, Any] = {
+    "latencia": "0",             # Distribuição do tempo até o primeiro token
+    "atraso_token": "0",         # Distribuição do intervalo entre trechos
+    "tokens_por_trecho": 1,      # Tokens por trecho do streaming
+    "rpm": 0,                    # Requisições por minuto (0 = sem limite)
+    "tpm": 0,                    # Tokens por minuto (0 = sem limite)
+    "taxa_429": 0.0,             # Respostas 429 espúrias, além das do limite
+    "taxa_erro": 0.0,            # Respostas 500/502/503
+    "taxa_queda": 0.0,           # Conexões encerradas no meio do streaming
+    "taxa_travamento": 0.0,      # Requisições que só respondem após `travamento` segundos
+    "travamento": 600.0,
+    "taxa_json_truncado": 0.0,   # Respostas cortadas em um ponto aleatório
+}
+
+# Etapa do pipeline correspondente ao nome de cada esquema de saída estruturada
+SCHEMA_STAGES = {schema.__name__: stage for stage, schema in STAGE_SCHEMAS.items()}
+
+# Duração da janela dos limites por minuto
+RATE_WINDOW = 60.0
+
+
+class Distribution:
+    """
+    Distribuição de tempos (em segundos) descrita por texto.
+
+    Formatos: "0.5" (fixo), "uniform:0.2,1.0", "normal:0.8,0.2" (média, desvio),
+    "lognormal:0.8,0.5" (mediana, sigma), "exponential:0.5" (média) e
+    "pareto:0.3,2.5" (mínimo, alfa), útil para caudas longas.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        name, _, params = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+        try:
+            self.params = [float(value) for value in params.split(",")]
+        except ValueError:
+            raise ValueError(f"Distribuição inválida: {spec!r}") from None
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1, "pareto": 2}
+        if expected.get(name) != len(self.params):
+            raise ValueError(f"Distribuição inválida: {spec!r}")
+        self.name = name
+
+    def sample(self, rng: random.Random) -> float:
+        a, b = (self.params + [0.0])[:2]
+        if self.name == "fixed":
+            value = a
+        elif self.name == "uniform":
+            value = rng.uniform(a, b)
+        elif self.name == "normal":
+            value = rng.gauss(a, b)
+        elif self.name == "lognormal":
+            value = rng.lognormvariate(math.log(a), b) if a > 0 else 0.0
+        elif self.name == "exponential":
+            value = rng.expovariate(1 / a) if a > 0 else 0.0
+        else:
+            value = a * rng.paretovariate(b)
+        return max(0.0, value)
+
+
+class Profile:
+    """Comportamento simulado do servidor (veja DEFAULT_PROFILE)."""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        settings = dict(settings or {})
+        settings.pop("duracao", None)
+        unknown = set(settings) - set(DEFAULT_PROFILE)
+        if unknown:
+            raise ValueError(f"Configurações desconhecidas: {', '.join(sorted(unknown))}")
+        self.settings = {**DEFAULT_PROFILE, **settings}
+        self.latency = Distribution(str(self.settings["latencia"]))
+        self.token_delay = Distribution(str(self.settings["atraso_token"]))
+
+    def __getitem__(self, key: str) -> Any:
+        return self.settings[key]
+
+
+class Script:
+    """Sequência de perfis que se sucedem conforme o tempo decorrido desde o início do roteiro."""
+
+    def __init__(self, phases: List[Tuple[float, Profile]], repeat: bool = False):
+        self.phases = phases
+        self.repeat = repeat
+        self.started = time.monotonic()
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> "Script":
+        """Cria o roteiro de {"fases": [...], "repetir": ...} ou de um único perfil; `base` completa cada fase."""
+        base = base or {}
+        if "fases" not in data:
+            return cls([(math.inf, Profile({**base, **data}))])
+        phases = [(float(phase.get("duracao", math.inf)), Profile({**base, **phase})) for phase in data["fases"]]
+        if not phases:
+            raise ValueError("O roteiro não tem fases")
+        return cls(phases, bool(data.get("repetir", False)))
+
+    def current(self) -> Tuple[int, Profile]:
+        """Índice e perfil da fase atual; sem repetição, a última fase continua valendo."""
+        elapsed = time.monotonic() - self.started
+        total = sum(duration for duration, _ in self.phases)
+        if self.repeat and math.isfinite(total) and total > 0:
+            elapsed %= total
+        for index, (duration, profile) in enumerate(self.phases):
+            if elapsed < duration:
+                return index, profile
+            elapsed -= duration
+        return len(self.phases) - 1, self.phases[-1][1]
+
+
+class RateWindow:
+    """Limites por minuto em janelas fixas, com os cabeçalhos x-ratelimit-* da OpenAI."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.tokens = 0
+
+    def acquire(self, rpm: int, tpm: int, tokens: int) -> Tuple[bool, Dict[str, str]]:
+        now = time.monotonic()
+        if now - self.started >= RATE_WINDOW:
+            self.started, self.requests, self.tokens = now, 0, 0
+        allowed = (not rpm or self.requests < rpm) and (not tpm or self.tokens + tokens <= tpm)
+        if allowed:
+            self.requests += 1
+            self.tokens += tokens
+        reset = f"{RATE_WINDOW - (now - self.started):.3f}s"
+        headers = {}
+        if rpm:
+            headers.update({
+                "x-ratelimit-limit-requests": str(rpm),
+                "x-ratelimit-remaining-requests": str(max(0, rpm - self.requests)),
+                "x-ratelimit-reset-requests": reset,
+            })
+        if tpm:
+            headers.update({
+                "x-ratelimit-limit-tokens": str(tpm),
+                "x-ratelimit-remaining-tokens": str(max(0, tpm - self.tokens)),
+                "x-ratelimit-reset-tokens": reset,
+            })
+        return allowed, headers
+
+
+class StandInState:
+    """Roteiro, limites, gerador aleatório e contadores do servidor."""
+
+    def __init__(
+        self, script: Script, cassette_path: Optional[str] = None, seed: Optional[int] = None,
+        base: Optional[Dict[str, Any]] = None,
+    ):
+        self.script = script
+        # Opções da linha de comando: completam também os roteiros trocados em PUT /_perfil
+        self.base = base or {}
+        self.limits = RateWindow()
+        self.random = random.Random(seed)
+        self.model = ReplayChatModel(cassette_path=cassette_path, seed=seed)
+        self.counts = {
+            "requisicoes": 0, "respostas": 0, "em_andamento": 0, "limitadas": 0,
+            "erros": 0, "quedas": 0, "travamentos": 0, "truncadas": 0,
+        }
+
+    def chance(self, rate: float) -> bool:
+        return rate > 0 and self.random.random() < rate
+
+    def answer(self, messages: List[BaseMessage], stage: Optional[str]) -> str:
+        # Saída estruturada usa o formato dos esquemas, a menos que o prompt esteja gravado na cassete
+        if stage is not None and self.model.cassette.get(prompt_hash(messages)) is None:
+            return json.dumps(structured_response(stage), ensure_ascii=False)
+        return self.model.respond(messages)
+
+
+STATE = web.AppKey("state", StandInState)
+
+
+def _error(http_status: int, message: str, error_type: str, code: Optional[str] = None, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    """Erro no formato da API da OpenAI."""
+    payload = {"error": {"message": message, "type": error_type, "param": None, "code": code}}
+    return web.json_response(payload, status=http_status, headers=headers)
+
+
+def structured_stage(body: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Etapa e nome da função pedidos por saída estruturada (JSON schema ou function calling), se houver."""
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return SCHEMA_STAGES.get(response_format.get("json_schema", {}).get("name")), None
+    for tool in body.get("tools") or []:
+        name = tool.get("function", {}).get("name")
+        if name in SCHEMA_STAGES:
+            return SCHEMA_STAGES[name], name
+    return None, None
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    return "".join(str(message.get("content") or "") for message in body.get("messages", []))
+
+
+async def chat_completions(request: web.Request) -> web.StreamResponse:
+    state = request.app[STATE]
+    if not request.headers.get("Authorization", "").startswith("Bearer "):
+        return _error(401, "You didn't provide an API key.", "invalid_request_error", "invalid_api_key")
+    try:
+        body = await request.json()
+        messages = convert_to_messages(body["messages"])
+    except (ValueError, KeyError, TypeError) as error:
+        return _error(400, f"Corpo inválido: {error}", "invalid_request_error")
+
+    state.counts["requisicoes"] += 1
+    _, profile = state.script.current()
+    allowed, headers = state.limits.acquire(profile["rpm"], profile["tpm"], estimate_request_tokens(body))
+    headers["x-request-id"] = f"req_{uuid.uuid4().hex}"
+    if not allowed or state.chance(profile["taxa_429"]):
+        state.counts["limitadas"] += 1
+        headers["retry-after"] = str(max(1, math.ceil(RATE_WINDOW - (time.monotonic() - state.limits.started))))
+        return _error(429, "Rate limit reached for requests", "requests", "rate_limit_exceeded", headers)
+    if state.chance(profile["taxa_erro"]):
+        state.counts["erros"] += 1
+        return _error(state.random.choice([500, 502, 503]), "The server had an error while processing your request.", "server_error", None, headers)
+
+    state.counts["em_andamento"] += 1
+    try:
+        if state.chance(profile["taxa_travamento"]):
+            # Para testar os timeouts do cliente: a resposta só começa muito depois
+            state.counts["travamentos"] += 1
+            await asyncio.sleep(profile["travamento"])
+        stage, function = structured_stage(body)
+        text = state.answer(messages, stage)
+        if state.chance(profile["taxa_json_truncado"]):
+            state.counts["truncadas"] += 1
+            text = state.model.truncate(text)
+        await asyncio.sleep(profile.latency.sample(state.random))
+
+        model = body.get("model", "gpt-4o-mini")
+        completion_tokens = estimate_tokens(model, text)
+        prompt_tokens = estimate_tokens(model, _prompt_text(body))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        completion = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "created": int(time.time()), "model": model}
+        pieces = split_tokens(text, int(profile["tokens_por_trecho"]))
+
+        if not body.get("stream"):
+            await asyncio.sleep(sum(profile.token_delay.sample(state.random) for _ in pieces[1:]))
+            state.counts["respostas"] += 1
+            return web.json_response({**completion, "object": "chat.completion", **_message(text, function), "usage": usage}, headers=headers)
+        return await _stream(request, state, profile, completion, pieces, function, usage, body, headers)
+    finally:
+        state.counts["em_andamento"] -= 1
+
+
+def _message(text: str, function: Optional[str]) -> Dict[str, Any]:
+    if function is None:
+        message = {"role": "assistant", "content": text, "refusal": None}
+        finish_reason = "stop"
+    else:
+        call = {"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function", "function": {"name": function, "arguments": text}}
+        message = {"role": "assistant", "content": None, "refusal": None, "tool_calls": [call]}
+        finish_reason = "tool_calls"
+    return {"choices": [{"index": 0, "message": message, "logprobs": None, "finish_reason": finish_reason}]}
+
+
+def _delta(piece: str, function: Optional[str], first: bool) -> Dict[str, Any]:
+    if function is None:
+        return {"role": "assistant", "content": piece} if first else {"content": piece}
+    call: Dict[str, Any] = {"index": 0, "function": {"arguments": piece}}
+    if first:
+        call.update(id=f"call_{uuid.uuid4().hex[:24]}", type="function")
+        call["function"]["name"] = function
+        return {"role": "assistant", "content": None, "tool_calls": [call]}
+    return {"tool_calls": [call]}
+
+
+async def _stream(
+    request: web.Request,
+    state: StandInState,
+    profile: Profile,
+    completion: Dict[str, Any],
+    pieces: List[str],
+    function: Optional[str],
+    usage: Dict[str, int],
+    body: Dict[str, Any],
+    headers: Dict[str, str],
+) -> web.StreamResponse:
+    response = web.StreamResponse(headers={**headers, "Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    try:
+        await response.prepare(request)
+        await _send_chunks(request, response, state, profile, completion, pieces, function, usage, body)
+    except ConnectionResetError:
+        # O cliente desistiu (timeout ou cancelamento) antes do fim da resposta
+        pass
+    return response
+
+
+async def _send_chunks(
+    request: web.Request,
+    response: web.StreamResponse,
+    state: StandInState,
+    profile: Profile,
+    completion: Dict[str, Any],
+    pieces: List[str],
+    function: Optional[str],
+    usage: Dict[str, int],
+    body: Dict[str, Any],
+) -> None:
+
+    async def send(choices: List[Dict[str, Any]], **extra: Any) -> None:
+        chunk = {**completion, "object": "chat.completion.chunk", "choices": choices, **extra}
+        await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    # Sorteia antes do primeiro trecho em que ponto a conexão vai cair
+    drop_at = state.random.randrange(1, len(pieces)) if len(pieces) > 1 and state.chance(profile["taxa_queda"]) else None
+    for index, piece in enumerate(pieces):
+        if index:
+            await asyncio.sleep(profile.token_delay.sample(state.random))
+        if index == drop_at:
+            state.counts["quedas"] += 1
+            # Fecha a conexão sem terminar a resposta, como uma queda de rede
+            request.transport.close()
+            return
+        await send([{"index": 0, "delta": _delta(piece, function, index == 0), "logprobs": None, "finish_reason": None}])
+
+    await send([{"index": 0, "delta": {}, "logprobs": None, "finish_reason": "stop" if function is None else "tool_calls"}])
+    if (body.get("stream_options") or {}).get("include_usage"):
+        await send([], usage=usage)
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    state.counts["respostas"] += 1
+
+
+async def list_models(request: web.Request) -> web.Response:
+    models = ["gpt-3.5-turbo", "gpt-4", "gpt-4o-mini", "gpt-4o"]
+    return web.json_response({"object": "list", "data": [{"id": name, "object": "model", "created": 0, "owned_by": "local"} for name in models]})
+
+
+async def get_profile(request: web.Request) -> web.Response:
+    state = request.app[STATE]
+    index, profile = state.script.current()
+    return web.json_response({"fase": index, "fases": len(state.script.phases), "perfil": profile.settings, "contadores": state.counts})
+
+
+async def put_profile(request: web.Request) -> web.Response:
+    state = request.app[STATE]
+    try:
+        state.script = Script.from_json(await request.json(), state.base)
+    except (ValueError, TypeError, AttributeError) as error:
+        return _error(400, str(error), "invalid_request_error")
+    return await get_profile(request)
+
+
+def create_app(
+    script: Optional[Script] = None, cassette_path: Optional[str] = None, seed: Optional[int] = None,
+    base: Optional[Dict[str, Any]] = None,
+) -> web.Application:
+    """
+    Cria a aplicação do servidor.
+
+    Args:
+        script (Script): Roteiro de perfis (padrão: respostas imediatas e sem falhas)
+        cassette_path (str): Cassete com as respostas gravadas, opcional
+        seed (int): Semente das latências e falhas sorteadas, para testes reproduzíveis
+        base (dict): Perfil padrão de cada fase, inclusive dos roteiros enviados em PUT /_perfil
+
+    Returns:
+        web.Application: Aplicação pronta para `web.run_app`
+    """
+    app = web.Application()
+    app[STATE] = StandInState(script or Script.from_json({}, base), cassette_path, seed, base)
+    app.add_routes([
+        web.post("/v1/chat/completions", chat_completions),
+        web.get("/v1/models", list_models),
+        web.get("/_perfil", get_profile),
+        web.put("/_perfil", put_profile),
+    ])
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor local compatível com a API da OpenAI, para testes de carga e de falhas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", default="0", help="Distribuição do tempo até o primeiro token (ex.: lognormal:0.8,0.5)")
+    parser.add_argument("--token-delay", default="0", help="Distribuição do intervalo entre trechos (ex.: uniform:0.005,0.03)")
+    parser.add_argument("--tokens-per-chunk", type=int, default=1)
+    parser.add_argument("--rpm", type=int, default=0, help="Limite de requisições por minuto (0 = sem limite)")
+    parser.add_argument("--tpm", type=int, default=0, help="Limite de tokens por minuto (0 = sem limite)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fração de respostas 429 espúrias")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 5xx")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fração de streams interrompidos")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fração de requisições que travam")
+    parser.add_argument("--hang-seconds", type=float, default=600.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fração de respostas com JSON truncado")
+    parser.add_argument("--script", help="Roteiro JSON de fases (as opções acima valem como padrão de cada fase)")
+    parser.add_argument("--cassette", default=os.environ.get("DOC_CASSETTE"), help="Cassete com respostas gravadas")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    base = {
+        "latencia": args.latency,
+        "atraso_token": args.token_delay,
+        "tokens_por_trecho": args.tokens_per_chunk,
+        "rpm": args.rpm,
+        "tpm": args.tpm,
+        "taxa_429": args.rate_limit_rate,
+        "taxa_erro": args.error_rate,
+        "taxa_queda": args.drop_rate,
+        "taxa_travamento": args.hang_rate,
+        "travamento": args.hang_seconds,
+        "taxa_json_truncado": args.malformed_rate,
+    }
+    data = {}
+    if args.script:
+        with open(args.script, encoding="utf-8") as file:
+            data = json.load(file)
+    try:
+        script = Script.from_json(data, base)
+    except ValueError as error:
+        parser.error(str(error))
+    web.run_app(create_app(script, args.cassette, args.seed, base), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -133,4 +133,12 @@ def gerar_pdf(requisitos: Dict[str, Any], fluxo: Dict[str, Any], apis: Dict[str,
         BytesIO: Buffer contendo o PDF gerado
     """
     gerador = DocumentacaoTecnicaPDF()
-    return gerador.create_pdf(requisitos, fluxo, apis)
\ No newline at end of file
+    return gerador.create_pdf(requisitos, fluxo, apis)
+
+def render_pdf(results: Dict[str, Any]) -> bytes:
+    """
+    Gera o PDF a partir dos resultados do pipeline, indexados pela etapa.
+
+    Função de módulo (serializável), para ser executada em um pool de processos.
+    """
+    return gerar_pdf(results.get("requisitos", {}), results.get("fluxo", {}), results.get("apis", {})).getvalue()
@@ -0,0 +1,993 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda, RunnablePassthrough
+from langchain_openai import ChatOpenAI
+
+from cache import CachedChain, response_cache_from_env
+from checkpoints import COMPLETED, FAILED, RUNNING, CheckpointStore
+from coalescing import CoalescedChain, SingleFlight
+from fake_llm import OFFLINE_MODES, offline_llm_from_env
+from hedging import HedgedChain, HedgeStats
+from http_client import OPENAI_BASE_URL, get_async_http_client, get_http_client
+from json_stream import IncrementalJSONParser
+from retry import (
+    REPAIR_PROMPT,
+    TRANSPORT_ERRORS,
+    JSONStage,
+    RetryPolicy,
+    RetryStats,
+    asleep_before_retry,
+    is_retryable,
+    sleep_before_retry,
+    with_usage_tracking,
+)
+from routing import MeasuredChain, ModelRouter, RoutedChain
+from schemas import STAGE_SCHEMAS, normalize_item, normalize_stage_json, structured_llm
+from semantic_cache import SemanticCache, SemanticCachedChain
+
+# Etapas do pipeline, na ordem de execução
+STAGES = ["requisitos", "fluxo", "apis"]
+
+# Chaves que o JSON de cada etapa precisa ter para ser repassado à etapa seguinte
+STAGE_REQUIRED_KEYS = {
+    "requisitos": ("requisitos_funcionais",),
+    "fluxo": ("componentes",),
+    "apis": ("apis",),
+    "rascunho": ("requisitos_funcionais", "componentes", "apis"),
+}
+
+# Chaves do rascunho (uma única chamada) que formam o resultado de cada etapa
+DRAFT_SECTIONS = {
+    "requisitos": ("requisitos_funcionais", "requisitos_nao_funcionais"),
+    "fluxo": ("componentes", "fluxos"),
+    "apis": ("apis",),
+}
+
+# Templates de prompts corrigidos
+PROMPT_TEMPLATES = {
+    "requisitos": """
+    Analise a seguinte descrição do sistema e gere requisitos funcionais e não funcionais.
+    Retorne APENAS um objeto JSON com requisitos funcionais e não funcionais.
+    
+    O JSON deve seguir este formato:
+    {{
+        "requisitos_funcionais": [
+            {{"id": "RF01", "descricao": "descrição do requisito", "prioridade": "Alta/Média/Baixa"}}
+        ],
+        "requisitos_nao_funcionais": [
+            {{"id": "RNF01", "descricao": "descrição do requisito", "tipo": "Desempenho/Segurança/Usabilidade"}}
+        ]
+    }}
+    
+    Descrição do sistema:
+    {descricao_sistema}
+    """,
+    
+    "fluxo": """
+    Com base nos requisitos fornecidos, descreva o fluxo de componentes e a arquitetura geral.
+    Retorne APENAS um objeto JSON com componentes e seus fluxos.
+    
+    O JSON deve seguir este formato:
+    {{
+        "componentes": [
+            {{
+                "nome": "nome do componente",
+                "descricao": "descrição detalhada",
+                "responsabilidades": ["responsabilidade 1", "responsabilidade 2"],
+                "dependencias": ["dependencia 1", "dependencia 2"]
+            }}
+        ],
+        "fluxos": [
+            {{
+                "nome": "nome do fluxo",
+                "passos": ["passo 1", "passo 2", "passo 3"]
+            }}
+        ]
+    }}
+    
+    Requisitos:
+    {requisitos}
+    """,
+    
+    "apis": """
+    Com base no fluxo de componentes, gere um mapa de APIs detalhado.
+    Retorne APENAS um objeto JSON com as definições das APIs.
+    
+    O JSON deve seguir este formato:
+    {{
+        "apis": [
+            {{
+                "rota": "/caminho/da/api",
+                "metodo": "GET/POST/PUT/DELETE",
+                "descricao": "descrição da funcionalidade",
+                "parametros": {{
+                    "param1": "descrição do parâmetro"
+                }},
+                "respostas": {{
+                    "200": "descrição da resposta de sucesso",
+                    "400": "descrição do erro"
+                }}
+            }}
+        ]
+    }}
+    
+    Fluxo de componentes:
+    {fluxo_componentes}
+    """,
+
+    "rascunho": """
+    Analise a seguinte descrição do sistema e gere, em uma única resposta, um rascunho da
+    documentação técnica: requisitos, componentes e fluxos, e o mapa de APIs.
+    Retorne APENAS um objeto JSON.
+    
+    O JSON deve seguir este formato:
+    {{
+        "requisitos_funcionais": [
+            {{"id": "RF01", "descricao": "descrição do requisito", "prioridade": "Alta/Média/Baixa"}}
+        ],
+        "requisitos_nao_funcionais": [
+            {{"id": "RNF01", "descricao": "descrição do requisito", "tipo": "Desempenho/Segurança/Usabilidade"}}
+        ],
+        "componentes": [
+            {{
+                "nome": "nome do componente",
+                "descricao": "descrição detalhada",
+                "responsabilidades": ["responsabilidade 1"],
+                "dependencias": ["dependencia 1"]
+            }}
+        ],
+        "fluxos": [
+            {{"nome": "nome do fluxo", "passos": ["passo 1", "passo 2"]}}
+        ],
+        "apis": [
+            {{
+                "rota": "/caminho/da/api",
+                "metodo": "GET/POST/PUT/DELETE",
+                "descricao": "descrição da funcionalidade",
+                "parametros": {{"param1": "descrição do parâmetro"}},
+                "respostas": {{"200": "descrição da resposta de sucesso", "400": "descrição do erro"}}
+            }}
+        ]
+    }}
+    
+    Descrição do sistema:
+    {descricao_sistema}
+    """
+}
+
+# Prompts curtos usados com saída estruturada: o formato vem do esquema enviado ao provedor
+STRUCTURED_PROMPT_TEMPLATES = {
+    "requisitos": """
+    Analise a seguinte descrição do sistema e gere requisitos funcionais e não funcionais.
+
+    Descrição do sistema:
+    {descricao_sistema}
+    """,
+
+    "fluxo": """
+    Com base nos requisitos fornecidos, descreva os componentes do sistema (responsabilidades e
+    dependências) e os fluxos entre eles.
+
+    Requisitos:
+    {requisitos}
+    """,
+
+    "apis": """
+    Com base no fluxo de componentes, gere um mapa de APIs detalhado, com os parâmetros e as
+    respostas de cada rota.
+
+    Fluxo de componentes:
+    {fluxo_componentes}
+    """,
+
+    "rascunho": """
+    Analise a seguinte descrição do sistema e gere, em uma única resposta, um rascunho da
+    documentação técnica: requisitos funcionais e não funcionais, componentes e fluxos, e o
+    mapa de APIs com os parâmetros e as respostas de cada rota.
+
+    Descrição do sistema:
+    {descricao_sistema}
+    """
+}
+
+def ensure_json_response(response: str) -> Dict[str, Any]:
+    """
+    Garante que a resposta seja um JSON válido.
+    Se não for, tenta extrair um JSON válido ou cria um objeto de erro.
+    """
+    parser = IncrementalJSONParser()
+    parser.feed(response)
+    return parser.close()
+
+
+def is_valid_response(response: str) -> bool:
+    """Indica se a resposta contém um objeto JSON legível (usado para não armazenar respostas quebradas em cache)."""
+    return "erro" not in ensure_json_response(response)
+
+
+# Prompts compilados uma única vez, na importação do módulo
+PROMPTS = {name: PromptTemplate.from_template(template) for name, template in PROMPT_TEMPLATES.items()}
+STRUCTURED_PROMPTS = {name: PromptTemplate.from_template(template) for name, template in STRUCTURED_PROMPT_TEMPLATES.items()}
+
+def key_fingerprint(api_key: str) -> str:
+    """Retorna uma impressão digital curta da API key, para usar em chaves de cache sem expor a chave."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def create_llm(
+    api_key: str, temperature: float, model: str, callbacks: Optional[list] = None, streaming: bool = True,
+    base_url: Optional[str] = None
+) -> ChatOpenAI:
+    """
+    Cria o modelo de chat usado pelas chains, usando os clientes HTTP compartilhados do processo.
+
+    `base_url` aponta para outra API compatível com a da OpenAI, como o servidor local de
+    `openai_server.py` (padrão: OPENAI_BASE_URL).
+    """
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        openai_api_key=api_key,
+        base_url=base_url or OPENAI_BASE_URL,
+        streaming=streaming,
+        callbacks=callbacks,
+        # As novas tentativas ficam só com a RetryPolicy da etapa (retry.py): repetir também no
+        # cliente multiplicaria as requisições sob 429. Depois de um 429 o controlador de taxa
+        # pausa o modelo pelo retry-after, e a próxima tentativa aguarda na fila dele
+        max_retries=0,
+        # Inclui o uso de tokens também nas respostas em streaming
+        stream_usage=True,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client()
+    )
+
+def create_chains(
+    llm: Runnable,
+    model: str,
+    temperature: float,
+    cache: Any = None,
+    semantic_cache: Optional[SemanticCache] = None,
+    similarity_threshold: Optional[float] = None,
+    hedge_stats: Optional[HedgeStats] = None,
+    hedge_llm: Optional[Runnable] = None,
+    hedge_percentile: float = 0.95,
+    hedge_budget: float = 0.1,
+    stage_llms: Optional[Dict[str, Tuple[str, Runnable]]] = None,
+    router: Optional[ModelRouter] = None,
+    router_llms: Optional[Dict[str, Runnable]] = None,
+    latency_targets: Optional[Dict[str, float]] = None,
+    structured_output: bool = False,
+    single_flight: Optional[SingleFlight] = None,
+) -> Dict[str, Runnable]:
+    """
+    Cria as chains `prompt | llm | StrOutputParser()` de cada etapa.
+
+    Args:
+        llm: Modelo de chat
+        model (str): Nome do modelo (usado nas chaves de cache)
+        temperature (float): Temperatura do modelo (usada nas chaves de cache)
+        cache: Cache de respostas exato (LRUCache, DiskCache ou TieredCache), opcional
+        semantic_cache (SemanticCache): Cache por similaridade da etapa de requisitos, opcional
+        similarity_threshold (float): Similaridade mínima do cache semântico
+        hedge_stats (HedgeStats): Ativa requisições duplicadas (hedging) com este histórico, opcional
+        hedge_llm: Modelo alternativo para as requisições duplicadas (padrão: o mesmo `llm`)
+        hedge_percentile (float): Percentil da latência até o primeiro token que dispara a duplicação
+        hedge_budget (float): Fração máxima de requisições que podem ser duplicadas
+        stage_llms (dict): Modelo de etapas específicas, {etapa: (nome do modelo, llm)}; as demais usam `llm`
+        router (ModelRouter): Ativa a escolha automática do modelo de cada etapa, opcional
+        router_llms (dict): Modelos candidatos do roteador, {nome do modelo: llm}
+        latency_targets (dict): Latência máxima desejada por etapa, em segundos
+        structured_output (bool): Usa saída estruturada do provedor (JSON schema ou function calling)
+            com os esquemas de `schemas.py`, em vez das instruções de formato no prompt
+        single_flight (SingleFlight): Compartilha as chamadas idênticas em andamento entre
+            execuções simultâneas, opcional
+
+    Returns:
+        dict: Chains indexadas pelo nome da etapa, mais a chain de reparo de JSON ("reparo")
+    """
+    stage_llms = stage_llms or {}
+    latency_targets = latency_targets or {}
+
+    def model_chain(name: str, stage_model: str, stage_llm: Runnable) -> Runnable:
+        if structured_output:
+            return STRUCTURED_PROMPTS[name] | structured_llm(stage_llm, STAGE_SCHEMAS[name], stage_model)
+        return PROMPTS[name] | stage_llm | StrOutputParser()
+
+    def stage_chain(name: str, stage_model: str, stage_llm: Runnable) -> Runnable:
+        chain = model_chain(name, stage_model, stage_llm)
+        if hedge_stats is not None:
+            alternate = alternate_name = None
+            if hedge_llm is not None:
+                alternate_model = getattr(hedge_llm, "model_name", stage_model)
+                alternate = model_chain(name, alternate_model, hedge_llm)
+                alternate_name = f"{name}/{alternate_model}"
+            chain = HedgedChain(
+                f"{name}/{stage_model}", chain, hedge_stats, alternate,
+                percentile=hedge_percentile, budget=hedge_budget, validate=is_valid_response,
+                alternate_name=alternate_name
+            )
+        if router is not None:
+            chain = MeasuredChain(chain, router, name, stage_model, validate=is_valid_response)
+        template = STRUCTURED_PROMPT_TEMPLATES[name] if structured_output else PROMPT_TEMPLATES[name]
+        if cache is not None:
+            chain = CachedChain(chain, cache, template, stage_model, temperature, validate=is_valid_response)
+        if single_flight is not None:
+            chain = CoalescedChain(chain, single_flight, template, stage_model, temperature)
+        return chain
+
+    chains = {}
+    for name in PROMPT_TEMPLATES:
+        if router is not None and router_llms:
+            chains[name] = RoutedChain(
+                name,
+                {candidate: stage_chain(name, candidate, candidate_llm) for candidate, candidate_llm in router_llms.items()},
+                router,
+                latency_targets.get(name)
+            )
+        else:
+            chains[name] = stage_chain(name, *stage_llms.get(name, (model, llm)))
+    chains["reparo"] = REPAIR_PROMPT | llm | StrOutputParser()
+
+    if semantic_cache is not None:
+        # Com o roteador, os requisitos reaproveitados podem ter vindo de qualquer candidato
+        namespace_model = "auto" if router is not None and router_llms else stage_llms.get("requisitos", (model,))[0]
+        chains["requisitos"] = SemanticCachedChain(
+            chains["requisitos"], semantic_cache, namespace=(namespace_model, temperature), threshold=similarity_threshold,
+            validate=is_valid_response
+        )
+    return chains
+
+def create_chains_from_env(single_flight: Optional[SingleFlight] = None) -> Dict[str, Runnable]:
+    """
+    Chains configuradas pelas variáveis de ambiente (serviço HTTP e processamento em lote).
+
+    DOC_LLM=fake, replay ou record usa os modelos locais de `fake_llm.py` (sem API key,
+    para testes e benchmarks; veja `offline_llm_from_env`); caso contrário usa a API em
+    OPENAI_BASE_URL com OPENAI_API_KEY, DOC_MODEL, DOC_TEMPERATURE e DOC_STRUCTURED_OUTPUT. Com `single_flight`,
+    gerações simultâneas da mesma descrição compartilham as chamadas ao modelo.
+    """
+    temperature = float(os.environ.get("DOC_TEMPERATURE", "0.7"))
+    model = os.environ.get("DOC_MODEL", "gpt-4o-mini")
+    mode = os.environ.get("DOC_LLM", "openai")
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if mode in OFFLINE_MODES:
+        if mode == "record" and not api_key:
+            raise RuntimeError("DOC_LLM=record requer OPENAI_API_KEY")
+        # A gravação envia à OpenAI apenas os prompts ausentes da cassete
+        recorder = create_llm(api_key, temperature, model, streaming=False) if mode == "record" else None
+        llm = offline_llm_from_env(model, recorder)
+        # Sem cache de respostas, para que cada chamada passe pelo modelo simulado
+        return create_chains(llm, model, temperature, single_flight=single_flight)
+
+    if not api_key:
+        raise RuntimeError("Defina OPENAI_API_KEY (ou DOC_LLM=fake/replay para usar um modelo local)")
+    return create_chains(
+        create_llm(api_key, temperature, model), model, temperature,
+        cache=response_cache_from_env(),
+        structured_output=os.environ.get("DOC_STRUCTURED_OUTPUT", "1") != "0",
+        single_flight=single_flight,
+    )
+
+def stage_inputs(stage: str, description: str, results: Dict[str, Any]) -> Dict[str, Any]:
+    """Monta as variáveis do prompt de uma etapa a partir dos resultados anteriores."""
+    if stage in ("requisitos", "rascunho"):
+        return {"descricao_sistema": description}
+    if stage == "fluxo":
+        return {"requisitos": json.dumps(results["requisitos"])}
+    if stage == "apis":
+        return {"fluxo_componentes": json.dumps(results["fluxo"])}
+    raise ValueError(f"Etapa desconhecida: {stage}")
+
+def component_fluxo(fluxo_json: Dict[str, Any], componente: Dict[str, Any]) -> Dict[str, Any]:
+    """Recorta do fluxo apenas um componente e os fluxos que o mencionam."""
+    nome = str(componente.get("nome", "")).lower()
+    fluxos = [
+        fluxo for fluxo in fluxo_json.get("fluxos", [])
+        if nome and any(nome in str(passo).lower() for passo in fluxo.get("passos", []))
+    ]
+    return {"componentes": [componente], "fluxos": fluxos}
+
+def _route_key(api: Dict[str, Any]) -> Tuple[str, str]:
+    rota = str(api.get("rota", "")).strip().lower().rstrip("/") or "/"
+    # /pedidos/{id}, /pedidos/:id e /pedidos/<id> representam a mesma rota
+    rota = re.sub(r"\{[^/]*\}|:[^/]+|<[^/]*>", "{}", rota)
+    return str(api.get("metodo", "")).strip().upper(), rota
+
+def merge_apis(partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Junta os mapas de APIs gerados por componente, removendo rotas duplicadas.
+
+    Rotas com o mesmo método e caminho (ignorando maiúsculas, barra final e o nome dos
+    parâmetros de caminho) são unificadas, combinando parâmetros e respostas.
+    """
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for partial in partials:
+        for api in partial.get("apis", []):
+            if not isinstance(api, dict):
+                continue
+            key = _route_key(api)
+            if key not in merged:
+                merged[key] = dict(api)
+                continue
+            existing = merged[key]
+            for field in ("parametros", "respostas"):
+                if isinstance(api.get(field), dict):
+                    existing[field] = {**api[field], **(existing.get(field) or {})}
+    return {"apis": list(merged.values())}
+
+def _fan_out_inputs(fluxo_json: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"fluxo_componentes": json.dumps(component_fluxo(fluxo_json, componente))}
+        for componente in fluxo_json.get("componentes", [])
+    ]
+
+def json_stage(chains: Dict[str, Runnable], stage: str, policy: Optional[RetryPolicy] = None, stats: Optional[RetryStats] = None) -> JSONStage:
+    """Envolve a chain da etapa com novas tentativas, reparo de JSON e validação das chaves obrigatórias."""
+    return JSONStage(
+        stage, chains[stage], chains.get("reparo"), policy, stats, STAGE_REQUIRED_KEYS.get(stage, ()),
+        normalize=normalize_stage_json
+    )
+
+def _merge_fan_out(outputs: List[Any]) -> Dict[str, Any]:
+    partials = [output for output in outputs if not isinstance(output, Exception)]
+    errors = [output for output in outputs if isinstance(output, Exception)]
+    if not partials and errors:
+        raise errors[0]
+    return merge_apis(partials)
+
+def run_apis_fan_out(
+    chains: Dict[str, Runnable],
+    fluxo_json: Dict[str, Any],
+    max_concurrency: int = 8,
+    config: Optional[RunnableConfig] = None,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Dict[str, Any]:
+    """
+    Gera o mapa de APIs com uma chamada por componente, em paralelo.
+
+    O tempo total passa a depender do componente mais demorado, e não da soma de todos.
+    Componentes que falharem são ignorados desde que ao menos um tenha gerado APIs.
+    """
+    inputs = _fan_out_inputs(fluxo_json)
+    if not inputs:
+        return run_stage(chains, "apis", "", {"fluxo": fluxo_json}, config, policy=policy, stats=stats)
+    batch_config = {**(config or {}), "max_concurrency": max_concurrency}
+    runner = json_stage(chains, "apis", policy, stats)
+    return _merge_fan_out(runner.batch(inputs, batch_config, return_exceptions=True))
+
+async def arun_apis_fan_out(
+    chains: Dict[str, Runnable],
+    fluxo_json: Dict[str, Any],
+    max_concurrency: int = 8,
+    config: Optional[RunnableConfig] = None,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Dict[str, Any]:
+    """Versão assíncrona de `run_apis_fan_out`."""
+    inputs = _fan_out_inputs(fluxo_json)
+    if not inputs:
+        return await arun_stage(chains, "apis", "", {"fluxo": fluxo_json}, config, policy=policy, stats=stats)
+    batch_config = {**(config or {}), "max_concurrency": max_concurrency}
+    runner = json_stage(chains, "apis", policy, stats)
+    return _merge_fan_out(await runner.abatch(inputs, batch_config, return_exceptions=True))
+
+def run_stage(
+    chains: Dict[str, Runnable],
+    stage: str,
+    description: str,
+    results: Dict[str, Any],
+    config: Optional[RunnableConfig] = None,
+    fan_out_apis: bool = False,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Dict[str, Any]:
+    """
+    Executa uma etapa e retorna o JSON produzido.
+
+    Levanta StageError se a etapa não produzir um JSON válido após as novas tentativas.
+    """
+    if stage == "apis" and fan_out_apis:
+        return run_apis_fan_out(chains, results["fluxo"], config=config, policy=policy, stats=stats)
+    return json_stage(chains, stage, policy, stats).invoke(stage_inputs(stage, description, results), config)
+
+async def arun_stage(
+    chains: Dict[str, Runnable],
+    stage: str,
+    description: str,
+    results: Dict[str, Any],
+    config: Optional[RunnableConfig] = None,
+    on_chunk: Optional[Callable[[str, str], Any]] = None,
+    fan_out_apis: bool = False,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+    on_restart: Optional[Callable[[str, Exception], Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Versão assíncrona de `run_stage`.
+
+    Se `on_chunk` for informado, a etapa é executada com `astream` e a função é chamada
+    com (etapa, trecho) a cada trecho recebido; caso contrário usa `ainvoke`. Quando uma
+    falha de conexão reinicia o streaming, `on_restart` é chamada com (etapa, erro) antes
+    de o texto recomeçar: os trechos já recebidos da etapa devem ser descartados.
+    """
+    if stage == "apis" and fan_out_apis:
+        return await arun_apis_fan_out(chains, results["fluxo"], config=config, policy=policy, stats=stats)
+    if on_chunk is None:
+        return await json_stage(chains, stage, policy, stats).ainvoke(stage_inputs(stage, description, results), config)
+
+    async for event, payload in astream_stage(chains, stage, description, results, config, policy, stats, raw=True):
+        if event == "resultado":
+            return payload
+        outcome = None
+        if event == "trecho":
+            outcome = on_chunk(stage, payload)
+        elif event == "reinicio" and on_restart is not None:
+            outcome = on_restart(stage, payload)
+        if asyncio.iscoroutine(outcome):
+            await outcome
+
+def stream_stage(
+    chains: Dict[str, Runnable],
+    stage: str,
+    description: str,
+    results: Dict[str, Any],
+    config: Optional[RunnableConfig] = None,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+    raw: bool = False,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Executa uma etapa em streaming, emitindo os elementos do JSON à medida que ficam prontos.
+
+    Falhas de transporte reiniciam o streaming (após o backoff da política) e um JSON
+    malformado ao final passa pelo prompt de reparo.
+
+    Yields:
+        tuple: ("item", (chave, elemento)) para cada requisito, componente, fluxo ou API
+        concluído; ("reinicio", erro) quando o streaming é reiniciado do começo, depois do
+        qual os itens e trechos da etapa são emitidos de novo e os anteriores devem ser
+        descartados; ("reparo", None)
+        antes do reparo do JSON; e, ao final, ("resultado", json_completo). Com `raw=True`
+        também emite ("trecho", texto) para cada trecho recebido.
+    """
+    runner = json_stage(chains, stage, policy, stats)
+    config = with_usage_tracking(config, stats)
+    inputs = stage_inputs(stage, description, results)
+    attempt = 0
+    while True:
+        attempt += 1
+        parser = IncrementalJSONParser()
+        try:
+            if stats is not None:
+                stats.record_call()
+            for chunk in chains[stage].stream(inputs, config):
+                if raw:
+                    yield "trecho", chunk
+                for key, value in parser.feed(chunk):
+                    yield "item", (key, normalize_item(key, value))
+            break
+        except TRANSPORT_ERRORS as error:
+            if not is_retryable(error) or attempt >= runner.policy.max_attempts:
+                raise
+            # Avisa antes do backoff: o que já foi emitido nesta tentativa deve ser descartado
+            yield "reinicio", error
+            sleep_before_retry(runner.policy, attempt, error, stats)
+
+    parsed = parser.close()
+    if "erro" in parsed:
+        yield "reparo", None
+    yield "resultado", runner.repair(parser.buffer, config)
+
+async def astream_stage(
+    chains: Dict[str, Runnable],
+    stage: str,
+    description: str,
+    results: Dict[str, Any],
+    config: Optional[RunnableConfig] = None,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+    raw: bool = False,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """Versão assíncrona de `stream_stage`, baseada em `astream`."""
+    runner = json_stage(chains, stage, policy, stats)
+    config = with_usage_tracking(config, stats)
+    inputs = stage_inputs(stage, description, results)
+    attempt = 0
+    while True:
+        attempt += 1
+        parser = IncrementalJSONParser()
+        try:
+            if stats is not None:
+                stats.record_call()
+            async for chunk in chains[stage].astream(inputs, config):
+                if raw:
+                    yield "trecho", chunk
+                for key, value in parser.feed(chunk):
+                    yield "item", (key, normalize_item(key, value))
+            break
+        except TRANSPORT_ERRORS as error:
+            if not is_retryable(error) or attempt >= runner.policy.max_attempts:
+                raise
+            # Avisa antes do backoff: o que já foi emitido nesta tentativa deve ser descartado
+            yield "reinicio", error
+            await asleep_before_retry(runner.policy, attempt, error, stats)
+
+    parsed = parser.close()
+    if "erro" in parsed:
+        yield "reparo", None
+    yield "resultado", await runner.arepair(parser.buffer, config)
+
+def run_pipeline(
+    chains: Dict[str, Runnable],
+    description: str,
+    config: Optional[RunnableConfig] = None,
+    fan_out_apis: bool = False,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Dict[str, Any]:
+    """Executa as três etapas em sequência e retorna os JSONs indexados pelo nome da etapa."""
+    results: Dict[str, Any] = {}
+    for stage in STAGES:
+        results[stage] = run_stage(chains, stage, description, results, config, fan_out_apis, policy, stats)
+    return results
+
+async def arun_pipeline(
+    chains: Dict[str, Runnable],
+    description: str,
+    config: Optional[RunnableConfig] = None,
+    on_chunk: Optional[Callable[[str, str], Any]] = None,
+    fan_out_apis: bool = False,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+    on_restart: Optional[Callable[[str, Exception], Any]] = None,
+) -> Dict[str, Any]:
+    """Versão assíncrona de `run_pipeline`, baseada em `ainvoke`/`astream`."""
+    results: Dict[str, Any] = {}
+    for stage in STAGES:
+        results[stage] = await arun_stage(
+            chains, stage, description, results, config, on_chunk, fan_out_apis, policy, stats, on_restart
+        )
+    return results
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(key).strip(): _canonical(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_canonical(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+def canonical_json(data: Any) -> str:
+    """
+    Serializa um JSON de forma canônica: chaves ordenadas e espaços das strings normalizados.
+
+    Duas saídas que diferem apenas na ordem das chaves, na indentação ou em espaços extras
+    produzem o mesmo texto.
+    """
+    return json.dumps(_canonical(data), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+# Entrada de que cada etapa depende
+STAGE_UPSTREAM = {"requisitos": None, "fluxo": "requisitos", "apis": "fluxo"}
+
+def stage_fingerprint(stage: str, description: str, results: Dict[str, Any], namespace: str = "") -> str:
+    """
+    Impressão digital das entradas de uma etapa.
+
+    Os requisitos dependem da descrição; o fluxo, dos requisitos; e as APIs, do fluxo.
+    `namespace` deve identificar a configuração (modelo, temperatura, modo) das chains.
+    """
+    upstream = STAGE_UPSTREAM[stage]
+    source = canonical_json(description) if upstream is None else canonical_json(results[upstream])
+    return hashlib.sha256(f"{namespace}\x00{stage}\x00{source}".encode("utf-8")).hexdigest()
+
+class StageMemo:
+    """
+    Última saída de cada etapa, associada à impressão digital das entradas que a produziram.
+
+    Guardado por sessão: ao editar a descrição, apenas as etapas cujas entradas mudaram
+    (após a normalização canônica) precisam ser executadas novamente. Os jobs da sessão
+    rodam em threads do pool e podem usá-lo ao mesmo tempo.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, stage: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(stage)
+        if entry is not None and entry[0] == fingerprint:
+            return entry[1]
+        return None
+
+    def set(self, stage: str, fingerprint: str, output: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[stage] = (fingerprint, output)
+
+def run_pipeline_incremental(
+    chains: Dict[str, Runnable],
+    description: str,
+    memo: StageMemo,
+    namespace: str = "",
+    config: Optional[RunnableConfig] = None,
+    fan_out_apis: bool = False,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Versão de `run_pipeline` que reaproveita as etapas cujas entradas não mudaram.
+
+    Returns:
+        tuple: (resultados por etapa, etapas executadas novamente)
+    """
+    results: Dict[str, Any] = {}
+    recomputed: List[str] = []
+    for stage in STAGES:
+        fingerprint = stage_fingerprint(stage, description, results, namespace)
+        output = memo.get(stage, fingerprint)
+        if output is None:
+            output = run_stage(chains, stage, description, results, config, fan_out_apis, policy, stats)
+            memo.set(stage, fingerprint, output)
+            recomputed.append(stage)
+        results[stage] = output
+    return results, recomputed
+
+async def arun_pipeline_incremental(
+    chains: Dict[str, Runnable],
+    description: str,
+    memo: StageMemo,
+    namespace: str = "",
+    config: Optional[RunnableConfig] = None,
+    fan_out_apis: bool = False,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Tuple[Dict[str, Any], List[str]]:
+    """Versão assíncrona de `run_pipeline_incremental`."""
+    results: Dict[str, Any] = {}
+    recomputed: List[str] = []
+    for stage in STAGES:
+        fingerprint = stage_fingerprint(stage, description, results, namespace)
+        output = memo.get(stage, fingerprint)
+        if output is None:
+            output = await arun_stage(
+                chains, stage, description, results, config, fan_out_apis=fan_out_apis, policy=policy, stats=stats
+            )
+            memo.set(stage, fingerprint, output)
+            recomputed.append(stage)
+        results[stage] = output
+    return results, recomputed
+
+def missing_stages(results: Dict[str, Any]) -> List[str]:
+    """Etapas ainda sem resultado, na ordem de execução (a primeira é de onde a execução é retomada)."""
+    return [stage for stage in STAGES if stage not in results]
+
+def run_pipeline_checkpointed(
+    chains: Dict[str, Runnable],
+    store: CheckpointStore,
+    run_id: str,
+    config: Optional[RunnableConfig] = None,
+    fan_out_apis: bool = False,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Dict[str, Any]:
+    """
+    Executa (ou retoma) a execução `run_id`, salvando cada etapa assim que termina.
+
+    As etapas já salvas são reaproveitadas e a execução continua da primeira ausente.
+    Se uma etapa falhar, a execução é marcada como falha e o erro é relançado; os
+    resultados anteriores continuam em `store` para exportação parcial ou nova retomada.
+    """
+    run = store.load(run_id)
+    if run is None:
+        raise KeyError(f"Execução não encontrada: {run_id}")
+    results = run["resultados"]
+    store.set_status(run_id, RUNNING)
+    try:
+        for stage in missing_stages(results):
+            results[stage] = run_stage(chains, stage, run["descricao"], results, config, fan_out_apis, policy, stats)
+            store.save_stage(run_id, stage, results[stage])
+    except Exception as error:
+        store.set_status(run_id, FAILED, str(error))
+        raise
+    store.set_status(run_id, COMPLETED)
+    return results
+
+async def arun_pipeline_checkpointed(
+    chains: Dict[str, Runnable],
+    store: CheckpointStore,
+    run_id: str,
+    config: Optional[RunnableConfig] = None,
+    fan_out_apis: bool = False,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Dict[str, Any]:
+    """Versão assíncrona de `run_pipeline_checkpointed`."""
+    run = store.load(run_id)
+    if run is None:
+        raise KeyError(f"Execução não encontrada: {run_id}")
+    results = run["resultados"]
+    store.set_status(run_id, RUNNING)
+    try:
+        for stage in missing_stages(results):
+            results[stage] = await arun_stage(
+                chains, stage, run["descricao"], results, config, fan_out_apis=fan_out_apis, policy=policy, stats=stats
+            )
+            store.save_stage(run_id, stage, results[stage])
+    except Exception as error:
+        store.set_status(run_id, FAILED, str(error))
+        raise
+    store.set_status(run_id, COMPLETED)
+    return results
+
+def split_draft(draft: Dict[str, Any]) -> Dict[str, Any]:
+    """Separa o JSON do rascunho nos resultados das três etapas, no mesmo formato de `run_pipeline`."""
+    return {stage: {key: draft.get(key, []) for key in keys} for stage, keys in DRAFT_SECTIONS.items()}
+
+def run_draft(
+    chains: Dict[str, Runnable],
+    description: str,
+    config: Optional[RunnableConfig] = None,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Dict[str, Any]:
+    """
+    Modo rascunho: gera requisitos, fluxo e APIs em uma única chamada.
+
+    Evita as três idas e voltas e o reenvio das saídas anteriores como entrada; útil para
+    prévias rápidas. O resultado tem o mesmo formato de `run_pipeline`.
+    """
+    return split_draft(run_stage(chains, "rascunho", description, {}, config, policy=policy, stats=stats))
+
+async def arun_draft(
+    chains: Dict[str, Runnable],
+    description: str,
+    config: Optional[RunnableConfig] = None,
+    policy: Optional[RetryPolicy] = None,
+    stats: Optional[RetryStats] = None,
+) -> Dict[str, Any]:
+    """Versão assíncrona de `run_draft`."""
+    return split_draft(await arun_stage(chains, "rascunho", description, {}, config, policy=policy, stats=stats))
+
+def create_pipeline_chain(chains: Dict[str, Runnable], fan_out_apis: bool = False) -> Runnable:
+    """
+    Compõe as três etapas em uma única chain LCEL.
+
+    A chain recebe {"descricao": ...} e devolve o mesmo dicionário acrescido de
+    "requisitos", "fluxo" e "apis", o que permite usar `batch`/`abatch` do LangChain
+    sobre o pipeline completo.
+    """
+    def stage_runnable(stage: str) -> Runnable:
+        def run(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+            return run_stage(chains, stage, state["descricao"], state, config, fan_out_apis)
+
+        async def arun(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+            return await arun_stage(chains, stage, state["descricao"], state, config, fan_out_apis=fan_out_apis)
+
+        return RunnableLambda(run, afunc=arun, name=stage)
+
+    pipeline_chain = RunnablePassthrough.assign(requisitos=stage_runnable("requisitos"))
+    for stage in STAGES[1:]:
+        pipeline_chain = pipeline_chain | RunnablePassthrough.assign(**{stage: stage_runnable(stage)})
+    return pipeline_chain
+
+def _batch_item(index: int, description: str, output: Any) -> Dict[str, Any]:
+    if isinstance(output, Exception):
+        return {"index": index, "descricao": description, "resultado": None, "erro": str(output) or type(output).__name__}
+    return {
+        "index": index,
+        "descricao": description,
+        "resultado": {stage: output[stage] for stage in STAGES},
+        "erro": None
+    }
+
+def generate_documentation_batch(
+    chains: Dict[str, Runnable],
+    descriptions: List[str],
+    max_concurrency: int = 8,
+    config: Optional[RunnableConfig] = None,
+    fan_out_apis: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Gera a documentação de várias descrições com concorrência limitada.
+
+    Os itens são devolvidos à medida que terminam (não na ordem de entrada); use a chave
+    "index" para relacioná-los às descrições. A falha de um item não interrompe os demais:
+    ela é informada em "erro" e "resultado" fica como None.
+
+    Args:
+        chains (dict): Chains criadas por `create_chains`
+        descriptions (list): Descrições de sistema
+        max_concurrency (int): Número máximo de itens em execução simultânea
+        config (RunnableConfig): Configuração adicional repassada às chains
+        fan_out_apis (bool): Gera o mapa de APIs com uma chamada por componente
+
+    Yields:
+        dict: {"index", "descricao", "resultado", "erro"}
+    """
+    pipeline_chain = create_pipeline_chain(chains, fan_out_apis)
+    batch_config = {**(config or {}), "max_concurrency": max_concurrency}
+    inputs = [{"descricao": description} for description in descriptions]
+    for index, output in pipeline_chain.batch_as_completed(inputs, batch_config, return_exceptions=True):
+        yield _batch_item(index, descriptions[index], output)
+
+async def agenerate_documentation_batch(
+    chains: Dict[str, Runnable],
+    descriptions: List[str],
+    max_concurrency: int = 8,
+    config: Optional[RunnableConfig] = None,
+    fan_out_apis: bool = False,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Versão assíncrona de `generate_documentation_batch`, baseada em `abatch_as_completed`."""
+    pipeline_chain = create_pipeline_chain(chains, fan_out_apis)
+    batch_config = {**(config or {}), "max_concurrency": max_concurrency}
+    inputs = [{"descricao": description} for description in descriptions]
+    async for index, output in pipeline_chain.abatch_as_completed(inputs, batch_config, return_exceptions=True):
+        yield _batch_item(index, descriptions[index], output)
+
+def export_json(results: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte os resultados para o formato do JSON de download."""
+    return {
+        "requisitos": results.get("requisitos", {}),
+        "fluxo_componentes": results.get("fluxo", {}),
+        "mapa_apis": results.get("apis", {})
+    }
+
+
+class AsyncDocumentationPipeline:
+    """
+    Executa várias gerações de documentação em paralelo no mesmo event loop.
+
+    O número de gerações simultâneas é limitado por `max_concurrency`; as demais
+    aguardam na fila do semáforo sem ocupar threads.
+    """
+
+    def __init__(self, chains: Dict[str, Runnable], max_concurrency: int = 32, fan_out_apis: bool = False):
+        self.chains = chains
+        self.max_concurrency = max_concurrency
+        self.fan_out_apis = fan_out_apis
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Criado sob demanda para ficar associado ao event loop em execução
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run(
+        self,
+        description: str,
+        config: Optional[RunnableConfig] = None,
+        on_chunk: Optional[Callable[[str, str], Any]] = None,
+        on_restart: Optional[Callable[[str, Exception], Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Gera a documentação de uma descrição, respeitando o limite de concorrência.
+
+        `on_chunk` e `on_restart` são repassadas a `arun_stage`.
+        """
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                return await arun_pipeline(
+                    self.chains, description, config, on_chunk, self.fan_out_apis, on_restart=on_restart
+                )
+            finally:
+                self.in_flight -= 1
+
+    async def run_many(self, descriptions: List[str], config: Optional[RunnableConfig] = None) -> List[Any]:
+        """Gera a documentação de várias descrições; exceções são retornadas no lugar do resultado."""
+        return await asyncio.gather(
+            *(self.run(description, config) for description in descriptions),
+            return_exceptions=True
+        )
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+import httpx
+
+# Fração dos limites da conta usada pelo controlador, para ficar logo abaixo deles
+SAFETY_FACTOR = float(os.environ.get("DOC_RATE_SAFETY", "0.9"))
+
+# Limites iniciais (por minuto), usados até a primeira resposta trazer os cabeçalhos reais
+DEFAULT_RPM = int(os.environ.get("DOC_RATE_DEFAULT_RPM", "500"))
+DEFAULT_TPM = int(os.environ.get("DOC_RATE_DEFAULT_TPM", "200000"))
+
+# Estimativa de tokens de saída quando a requisição não define max_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+
+_encodings: Dict[str, Any] = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding(model: str) -> Any:
+    # Carregado uma única vez por modelo: o primeiro uso pode baixar os arquivos BPE
+    if model not in _encodings:
+        with _encodings_lock:
+            if model not in _encodings:
+                try:
+                    import tiktoken
+                    try:
+                        _encodings[model] = tiktoken.encoding_for_model(model)
+                    except KeyError:
+                        _encodings[model] = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _encodings[model] = None
+    return _encodings[model]
+
+
+def estimate_tokens(model: str, text: str) -> int:
+    """
+    Estima o número de tokens de um texto com o tiktoken.
+
+    Se o encoding do modelo não estiver disponível (por exemplo, sem acesso à rede para
+    baixar os arquivos BPE), usa a aproximação de 4 caracteres por token. Pode bloquear
+    (download e tokenização): em código assíncrono, chame-a em uma thread.
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_request_tokens(body: Mapping[str, Any]) -> int:
+    """Estima os tokens (entrada + saída máxima) de uma requisição de chat completions."""
+    model = str(body.get("model", ""))
+    prompt = "".join(
+        message["content"] if isinstance(message.get("content"), str) else json.dumps(message.get("content"))
+        for message in body.get("messages", [])
+        if isinstance(message, dict)
+    )
+    completion = body.get("max_completion_tokens") or body.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    # Cada mensagem tem alguns tokens fixos de formatação
+    return estimate_tokens(model, prompt) + 4 * len(body.get("messages", [])) + int(completion)
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Converte valores como "1s", "6m0s", "250ms" ou "2" em segundos."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """
+    Balde de fichas com reserva antecipada.
+
+    `reserve` nunca recusa um pedido: desconta as fichas (podendo deixar o saldo negativo)
+    e devolve quanto tempo o chamador deve esperar. Assim as chamadas formam uma fila
+    em vez de falharem.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Reserva `amount` fichas e retorna o tempo de espera em segundos."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Pedidos maiores que o balde nunca seriam atendidos; limitamos ao tamanho do balde
+            self.tokens -= min(amount, self.capacity)
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def configure(self, rate: float, capacity: float, available: Optional[float] = None) -> None:
+        """Ajusta taxa e capacidade; `available` sincroniza o saldo com o informado pelo provedor."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(rate, 1e-6)
+            self.capacity = max(capacity, 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+            if available is not None:
+                self.tokens = min(self.tokens, available)
+
+    def pause(self, seconds: float) -> None:
+        """Suspende o balde por `seconds` e zera o saldo positivo."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 0.0)
+            self.paused_until = max(self.paused_until, now + seconds)
+
+
+class ModelRateLimiter:
+    """Limita requisições e tokens por minuto de um modelo, adaptando-se aos cabeçalhos de rate limit."""
+
+    def __init__(self, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM, safety: float = SAFETY_FACTOR):
+        self.safety = safety
+        self.rpm = rpm
+        self.tpm = tpm
+        # Após um 429 a taxa é reduzida e volta a crescer gradualmente (AIMD)
+        self.backoff = 1.0
+        self.requests = TokenBucket(*self._bucket(rpm))
+        self.tokens = TokenBucket(*self._bucket(tpm))
+        self.throttled = 0
+        # `observe` é chamado pelos hooks de várias threads ao mesmo tempo
+        self._lock = threading.Lock()
+
+    def _bucket(self, per_minute: float):
+        rate = per_minute * self.safety * self.backoff / 60.0
+        # Permite rajadas de até 10 s de consumo
+        return rate, max(rate * 10.0, 1.0)
+
+    def wait_time(self, tokens: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+    def observe(self, headers: Mapping[str, str], status_code: int) -> None:
+        """Atualiza os limites a partir de uma resposta do provedor."""
+        with self._lock:
+            self._observe(headers, status_code)
+
+    def _observe(self, headers: Mapping[str, str], status_code: int) -> None:
+        rpm = headers.get("x-ratelimit-limit-requests")
+        tpm = headers.get("x-ratelimit-limit-tokens")
+        if rpm:
+            self.rpm = float(rpm)
+        if tpm:
+            self.tpm = float(tpm)
+
+        if status_code == 429:
+            self.throttled += 1
+            self.backoff = max(self.backoff * 0.5, 0.1)
+            retry_after = (
+                parse_reset(headers.get("retry-after"))
+                or max(parse_reset(headers.get("x-ratelimit-reset-requests")) or 0.0,
+                       parse_reset(headers.get("x-ratelimit-reset-tokens")) or 0.0)
+                or 1.0
+            )
+            self.requests.pause(retry_after)
+            self.tokens.pause(retry_after)
+        else:
+            self.backoff = min(self.backoff + 0.05, 1.0)
+
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        reserve_requests = self.rpm * (1 - self.safety)
+        reserve_tokens = self.tpm * (1 - self.safety)
+        self.requests.configure(
+            *self._bucket(self.rpm),
+            available=float(remaining_requests) - reserve_requests if remaining_requests else None
+        )
+        self.tokens.configure(
+            *self._bucket(self.tpm),
+            available=float(remaining_tokens) - reserve_tokens if remaining_tokens else None
+        )
+
+
+class RateController:
+    """
+    Controlador de taxa de requisições à OpenAI, compartilhado por todas as sessões do processo.
+
+    Cada modelo tem seus próprios limites de requisições e tokens por minuto. As chamadas
+    aguardam na fila quando o limite é atingido, em vez de receberem 429.
+    """
+
+    def __init__(self, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM, safety: float = SAFETY_FACTOR):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.safety = safety
+        self._limiters: Dict[str, ModelRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model: str) -> ModelRateLimiter:
+        with self._lock:
+            if model not in self._limiters:
+                self._limiters[model] = ModelRateLimiter(self.rpm, self.tpm, self.safety)
+            return self._limiters[model]
+
+    def acquire(self, model: str, tokens: int) -> float:
+        """Bloqueia até haver capacidade para a requisição; retorna o tempo esperado."""
+        wait = self.limiter(model).wait_time(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, model: str, tokens: int) -> float:
+        """Versão assíncrona de `acquire`: aguarda sem bloquear o event loop."""
+        wait = self.limiter(model).wait_time(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def observe(self, model: str, headers: Mapping[str, str], status_code: int) -> None:
+        self.limiter(model).observe(headers, status_code)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {
+            model: {"rpm": limiter.rpm, "tpm": limiter.tpm, "backoff": limiter.backoff, "throttled": limiter.throttled}
+            for model, limiter in limiters.items()
+        }
+
+
+_controller: Optional[RateController] = None
+_controller_lock = threading.Lock()
+
+
+def get_rate_controller() -> RateController:
+    """Retorna o controlador de taxa do processo."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = RateController()
+        return _controller
+
+
+def _request_body(request: httpx.Request) -> Optional[Dict[str, Any]]:
+    if request.method != "POST" or not request.url.path.endswith("/chat/completions"):
+        return None
+    try:
+        body = json.loads(request.content)
+    except (ValueError, httpx.RequestNotRead):
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def event_hooks(controller: Optional[RateController] = None) -> Dict[str, list]:
+    """Hooks de httpx.Client que aplicam o controlador às chamadas de chat completions."""
+    controller = controller or get_rate_controller()
+
+    def on_request(request: httpx.Request) -> None:
+        body = _request_body(request)
+        if body is not None:
+            request.extensions["rate_limit_model"] = body.get("model", "")
+            controller.acquire(body.get("model", ""), estimate_request_tokens(body))
+
+    def on_response(response: httpx.Response) -> None:
+        model = response.request.extensions.get("rate_limit_model")
+        if model is not None:
+            controller.observe(model, response.headers, response.status_code)
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def async_event_hooks(controller: Optional[RateController] = None) -> Dict[str, list]:
+    """Hooks de httpx.AsyncClient que aplicam o controlador às chamadas de chat completions."""
+    controller = controller or get_rate_controller()
+
+    async def on_request(request: httpx.Request) -> None:
+        body = _request_body(request)
+        if body is not None:
+            request.extensions["rate_limit_model"] = body.get("model", "")
+            # A tokenização (e o download do encoding no primeiro uso) roda fora do event loop
+            tokens = await asyncio.to_thread(estimate_request_tokens, body)
+            await controller.aacquire(body.get("model", ""), tokens)
+
+    async def on_response(response: httpx.Response) -> None:
+        model = response.request.extensions.get("rate_limit_model")
+        if model is not None:
+            controller.observe(model, response.headers, response.status_code)
+
+    return {"request": [on_request], "response": [on_response]}
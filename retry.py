@@ -0,0 +1,320 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import httpx
+import openai
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import Runnable, RunnableConfig, ensure_config
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+from json_stream import IncrementalJSONParser
+
+# Erros de transporte que justificam repetir a chamada (os demais, como autenticação, não)
+TRANSPORT_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Indica se vale repetir a chamada; um 429 de cota esgotada (insufficient_quota) nunca se resolve sozinho."""
+    if isinstance(error, openai.RateLimitError) and "insufficient_quota" in (error.code, error.type):
+        return False
+    return isinstance(error, TRANSPORT_ERRORS)
+
+
+# Prompt curto de reparo: leva apenas o erro de parse e o trecho quebrado, não a etapa inteira
+REPAIR_TEMPLATE = """
+O JSON abaixo está inválido. Corrija-o e retorne APENAS o JSON corrigido, sem comentários.
+
+Erro: {erro}
+
+JSON:
+{fragmento}
+"""
+
+REPAIR_PROMPT = PromptTemplate.from_template(REPAIR_TEMPLATE)
+
+
+class JSONValidationError(ValueError):
+    """A resposta do modelo não é um JSON válido para a etapa."""
+
+    def __init__(self, erro: str, fragmento: str):
+        super().__init__(erro)
+        self.erro = erro
+        self.fragmento = fragmento
+
+
+class StageError(RuntimeError):
+    """Uma etapa falhou mesmo após as novas tentativas e reparos."""
+
+    def __init__(self, stage: str, message: str, resposta_original: str = ""):
+        super().__init__(f"Etapa '{stage}': {message}")
+        self.stage = stage
+        self.resposta_original = resposta_original
+
+
+def parse_json_strict(response: str, required_keys: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Lê o JSON de uma resposta, levantando JSONValidationError se ele estiver malformado.
+
+    Args:
+        response (str): Texto retornado pelo modelo
+        required_keys (list): Chaves de primeiro nível obrigatórias
+
+    Returns:
+        dict: Objeto JSON da resposta
+    """
+    parser = IncrementalJSONParser()
+    parser.feed(response)
+    parsed = parser.close()
+
+    # Só o objeto lido pelo parser: o texto antes do primeiro "{" e depois do fechamento fica de fora
+    fragment = parser.fragment()
+    if "erro" in parsed and "resposta_original" in parsed:
+        try:
+            json.loads(fragment)
+            message = "A resposta não contém um objeto JSON"
+        except json.JSONDecodeError as error:
+            message = f"{error.msg} (linha {error.lineno}, coluna {error.colno})"
+        raise JSONValidationError(message, fragment.strip())
+
+    missing = [key for key in required_keys if key not in parsed]
+    if missing:
+        raise JSONValidationError(f"Chaves obrigatórias ausentes: {', '.join(missing)}", fragment.strip())
+    return parsed
+
+
+class RetryPolicy:
+    """
+    Política de novas tentativas de uma etapa.
+
+    Erros de transporte são repetidos com backoff exponencial com jitter; respostas com
+    JSON malformado recebem até `max_repairs` prompts de reparo.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        initial_wait: float = 1.0,
+        max_wait: float = 30.0,
+        jitter: float = 1.0,
+        max_repairs: int = 2,
+    ):
+        self.max_attempts = max_attempts
+        self.initial_wait = initial_wait
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self.max_repairs = max_repairs
+
+    def backoff(self, attempt: int) -> float:
+        """Tempo de espera antes da tentativa `attempt + 1` (mesma fórmula de wait_exponential_jitter)."""
+        return min(self.initial_wait * 2 ** (attempt - 1) + random.uniform(0, self.jitter), self.max_wait)
+
+    def _tenacity_kwargs(self, stats: Optional["RetryStats"]) -> Dict[str, Any]:
+        def before_sleep(retry_state):
+            if stats is not None:
+                stats.record_transport_retry()
+
+        return {
+            "retry": retry_if_exception(is_retryable),
+            "wait": wait_exponential_jitter(initial=self.initial_wait, max=self.max_wait, jitter=self.jitter),
+            "stop": stop_after_attempt(self.max_attempts),
+            "before_sleep": before_sleep,
+            "reraise": True,
+        }
+
+    def retrying(self, stats: Optional["RetryStats"] = None) -> Retrying:
+        return Retrying(**self._tenacity_kwargs(stats))
+
+    def async_retrying(self, stats: Optional["RetryStats"] = None) -> AsyncRetrying:
+        return AsyncRetrying(**self._tenacity_kwargs(stats))
+
+
+class RetryStats:
+    """Contadores de chamadas, novas tentativas, reparos e tokens de uma execução."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.transport_retries = 0
+        self.repairs = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.usage_handler = TokenUsageHandler(self)
+
+    def record_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def record_transport_retry(self) -> None:
+        with self._lock:
+            self.transport_retries += 1
+
+    def record_repair(self) -> None:
+        with self._lock:
+            self.repairs += 1
+
+    def record_usage(self, input_tokens: int, output_tokens: int) -> None:
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def to_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "chamadas": self.calls,
+                "novas_tentativas": self.transport_retries,
+                "reparos": self.repairs,
+                "tokens_entrada": self.input_tokens,
+                "tokens_saida": self.output_tokens,
+            }
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Soma os tokens informados pelo provedor ao fim de cada chamada do LLM."""
+
+    def __init__(self, stats: RetryStats):
+        self.stats = stats
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(generation.message, "usage_metadata", None) if isinstance(generation, ChatGeneration) else None
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+        if not (input_tokens or output_tokens) and response.llm_output:
+            token_usage = response.llm_output.get("token_usage") or {}
+            input_tokens = token_usage.get("prompt_tokens", 0)
+            output_tokens = token_usage.get("completion_tokens", 0)
+        self.stats.record_usage(input_tokens, output_tokens)
+
+
+def with_usage_tracking(config: Optional[RunnableConfig], stats: Optional[RetryStats]) -> RunnableConfig:
+    """Retorna uma cópia do config com o contador de tokens de `stats` entre os callbacks."""
+    config = ensure_config(config)
+    if stats is None:
+        return config
+    callbacks = config.get("callbacks")
+    if callbacks is None:
+        callbacks = [stats.usage_handler]
+    elif isinstance(callbacks, BaseCallbackManager):
+        if stats.usage_handler in callbacks.handlers:
+            return config
+        callbacks = callbacks.copy()
+        callbacks.add_handler(stats.usage_handler)
+    elif stats.usage_handler in callbacks:
+        return config
+    else:
+        callbacks = [*callbacks, stats.usage_handler]
+    return {**config, "callbacks": callbacks}
+
+
+class JSONStage(Runnable[Dict[str, Any], Dict[str, Any]]):
+    """
+    Executa uma chain de etapa e devolve seu JSON, com novas tentativas e reparo.
+
+    Falhas de transporte repetem a chamada com backoff; um JSON malformado gera um prompt de
+    reparo com apenas o erro e o trecho quebrado. Se ainda assim não houver JSON válido,
+    levanta StageError em vez de repassar um objeto de erro para a próxima etapa.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        chain: Runnable,
+        repair_chain: Optional[Runnable] = None,
+        policy: Optional[RetryPolicy] = None,
+        stats: Optional[RetryStats] = None,
+        required_keys: Sequence[str] = (),
+        normalize: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ):
+        self.stage = stage
+        self.chain = chain
+        self.repair_chain = repair_chain
+        self.policy = policy or RetryPolicy()
+        self.stats = stats
+        self.required_keys = tuple(required_keys)
+        # Ajusta o JSON validado ao formato usado pelas etapas seguintes
+        self.normalize = normalize
+
+    def _parse(self, response: str) -> Dict[str, Any]:
+        parsed = parse_json_strict(response, self.required_keys)
+        return self.normalize(parsed) if self.normalize is not None else parsed
+
+    def _call(self, runnable: Runnable, inputs: Dict[str, Any], config: RunnableConfig) -> str:
+        for attempt in self.policy.retrying(self.stats):
+            with attempt:
+                if self.stats is not None:
+                    self.stats.record_call()
+                return runnable.invoke(inputs, config)
+
+    async def _acall(self, runnable: Runnable, inputs: Dict[str, Any], config: RunnableConfig) -> str:
+        async for attempt in self.policy.async_retrying(self.stats):
+            with attempt:
+                if self.stats is not None:
+                    self.stats.record_call()
+                return await runnable.ainvoke(inputs, config)
+
+    def repair(self, response: str, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """Valida `response`, enviando prompts de reparo enquanto o JSON estiver malformado."""
+        config = with_usage_tracking(config, self.stats)
+        for repair in range(self.policy.max_repairs + 1):
+            try:
+                return self._parse(response)
+            except JSONValidationError as error:
+                if self.repair_chain is None or repair == self.policy.max_repairs:
+                    raise StageError(self.stage, error.erro, response) from error
+                if self.stats is not None:
+                    self.stats.record_repair()
+                response = self._call(self.repair_chain, {"erro": error.erro, "fragmento": error.fragmento}, config)
+
+    async def arepair(self, response: str, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """Versão assíncrona de `repair`."""
+        config = with_usage_tracking(config, self.stats)
+        for repair in range(self.policy.max_repairs + 1):
+            try:
+                return self._parse(response)
+            except JSONValidationError as error:
+                if self.repair_chain is None or repair == self.policy.max_repairs:
+                    raise StageError(self.stage, error.erro, response) from error
+                if self.stats is not None:
+                    self.stats.record_repair()
+                response = await self._acall(self.repair_chain, {"erro": error.erro, "fragmento": error.fragmento}, config)
+
+    def invoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Dict[str, Any]:
+        config = with_usage_tracking(config, self.stats)
+        return self.repair(self._call(self.chain, input, config), config)
+
+    async def ainvoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Dict[str, Any]:
+        config = with_usage_tracking(config, self.stats)
+        return await self.arepair(await self._acall(self.chain, input, config), config)
+
+
+def sleep_before_retry(policy: RetryPolicy, attempt: int, error: Exception, stats: Optional[RetryStats] = None) -> None:
+    """Usado pelas etapas em streaming: relança `error` se esgotou as tentativas, senão aguarda o backoff."""
+    if not is_retryable(error) or attempt >= policy.max_attempts:
+        raise error
+    if stats is not None:
+        stats.record_transport_retry()
+    time.sleep(policy.backoff(attempt))
+
+
+async def asleep_before_retry(policy: RetryPolicy, attempt: int, error: Exception, stats: Optional[RetryStats] = None) -> None:
+    """Versão assíncrona de `sleep_before_retry`."""
+    if not is_retryable(error) or attempt >= policy.max_attempts:
+        raise error
+    if stats is not None:
+        stats.record_transport_retry()
+    await asyncio.sleep(policy.backoff(attempt))
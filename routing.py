@@ -0,0 +1,210 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+# Preço (USD por 1M de tokens de entrada, de saída) usado para ordenar os modelos candidatos
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4": (30.00, 60.00),
+}
+
+
+def model_price(model: str) -> float:
+    """Custo relativo de um modelo (entrada + saída); modelos fora da tabela ficam por último."""
+    prices = MODEL_PRICES.get(model)
+    return sum(prices) if prices else math.inf
+
+
+class ModelRouter:
+    """
+    Histórico de latência e validade das respostas por (etapa, modelo) e escolha do modelo.
+
+    Para cada etapa, escolhe o modelo mais barato cujo percentil de latência cabe no alvo
+    e cuja taxa de respostas válidas atinge `min_validity`. Modelos sem amostras suficientes
+    são experimentados do mais barato para o mais caro, pulando os que já falharam demais para
+    atingir `min_validity` (chamadas com erro contam como respostas inválidas); amostras mais
+    antigas que `max_age` são descartadas, de modo que um modelo reprovado volta a ser avaliado
+    depois de um tempo.
+    """
+
+    def __init__(
+        self,
+        min_validity: float = 0.9,
+        percentile: float = 0.9,
+        min_samples: int = 5,
+        window: int = 50,
+        max_age: float = 3600.0,
+    ):
+        self.min_validity = min_validity
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.max_age = max_age
+        self._history: Dict[Tuple[str, str], Deque[Tuple[float, float, bool]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, model: str, latency: float, valid: bool) -> None:
+        """Registra a duração de uma chamada e se a resposta foi válida."""
+        with self._lock:
+            history = self._history.setdefault((stage, model), deque(maxlen=self.window))
+            history.append((time.monotonic(), latency, valid))
+
+    def _samples(self, stage: str, model: str) -> List[Tuple[float, bool]]:
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            history = self._history.get((stage, model), ())
+            return [(latency, valid) for recorded, latency, valid in history if recorded >= cutoff]
+
+    def summary(self, stage: str, model: str) -> Dict[str, Any]:
+        """Retorna o número de amostras, o percentil de latência e a taxa de respostas válidas."""
+        samples = self._samples(stage, model)
+        if not samples:
+            return {"amostras": 0, "latencia": None, "validade": None}
+        latencies = sorted(latency for latency, _ in samples)
+        index = min(len(latencies) - 1, max(0, math.ceil(self.percentile * len(latencies)) - 1))
+        return {
+            "amostras": len(samples),
+            "latencia": latencies[index],
+            "validade": sum(valid for _, valid in samples) / len(samples),
+        }
+
+    def choose(self, stage: str, models: Sequence[str], latency_target: Optional[float] = None) -> str:
+        """
+        Escolhe o modelo de uma etapa.
+
+        Args:
+            stage (str): Nome da etapa
+            models (list): Modelos candidatos
+            latency_target (float): Latência máxima desejada em segundos (None = sem limite)
+
+        Returns:
+            str: Modelo escolhido
+        """
+        candidates = sorted(models, key=model_price)
+        summaries = {model: self.summary(stage, model) for model in candidates}
+        for model in candidates:
+            summary = summaries[model]
+            if summary["amostras"] < self.min_samples:
+                # Em aquecimento, a menos que as falhas já impeçam de atingir a validade mínima
+                valid = summary["validade"] * summary["amostras"] if summary["amostras"] else 0
+                if (valid + self.min_samples - summary["amostras"]) / self.min_samples >= self.min_validity:
+                    return model
+                continue
+            if summary["validade"] >= self.min_validity and (latency_target is None or summary["latencia"] <= latency_target):
+                return model
+        # Nenhum modelo cumpre o alvo: fica com o mais confiável e, no empate, o mais rápido
+        return max(candidates, key=lambda model: (summaries[model]["validade"], -summaries[model]["latencia"]))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            keys = list(self._history)
+        return {f"{stage}/{model}": self.summary(stage, model) for stage, model in keys}
+
+
+class MeasuredChain(Runnable[Dict[str, Any], str]):
+    """Mede a duração e a validade das respostas de uma chain e registra no roteador."""
+
+    def __init__(
+        self,
+        chain: Runnable,
+        router: ModelRouter,
+        stage: str,
+        model: str,
+        validate: Optional[Callable[[str], bool]] = None,
+    ):
+        self.chain = chain
+        self.router = router
+        self.stage = stage
+        self.model = model
+        self.validate = validate
+
+    def _record(self, started: float, result: Optional[str]) -> None:
+        """Registra a chamada; `result` None indica que ela falhou."""
+        valid = result is not None and (self.validate is None or self.validate(result))
+        self.router.record(self.stage, self.model, time.monotonic() - started, valid)
+
+    def invoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        started = time.monotonic()
+        try:
+            result = self.chain.invoke(input, config, **kwargs)
+        except Exception:
+            self._record(started, None)
+            raise
+        self._record(started, result)
+        return result
+
+    async def ainvoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        started = time.monotonic()
+        try:
+            result = await self.chain.ainvoke(input, config, **kwargs)
+        except Exception:
+            self._record(started, None)
+            raise
+        self._record(started, result)
+        return result
+
+    def stream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        started = time.monotonic()
+        parts = []
+        try:
+            for chunk in self.chain.stream(input, config, **kwargs):
+                parts.append(chunk)
+                yield chunk
+        except Exception:
+            self._record(started, None)
+            raise
+        self._record(started, "".join(parts))
+
+    async def astream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        started = time.monotonic()
+        parts = []
+        try:
+            async for chunk in self.chain.astream(input, config, **kwargs):
+                parts.append(chunk)
+                yield chunk
+        except Exception:
+            self._record(started, None)
+            raise
+        self._record(started, "".join(parts))
+
+
+class RoutedChain(Runnable[Dict[str, Any], str]):
+    """
+    Encaminha cada chamada de uma etapa para o modelo escolhido pelo roteador.
+
+    `chains` mapeia o nome de cada modelo candidato para a chain da etapa com esse modelo.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        chains: Dict[str, Runnable],
+        router: ModelRouter,
+        latency_target: Optional[float] = None,
+    ):
+        self.stage = stage
+        self.chains = chains
+        self.router = router
+        self.latency_target = latency_target
+
+    def select(self) -> Runnable:
+        return self.chains[self.router.choose(self.stage, list(self.chains), self.latency_target)]
+
+    def invoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        return self.select().invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        return await self.select().ainvoke(input, config, **kwargs)
+
+    def stream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        yield from self.select().stream(input, config, **kwargs)
+
+    async def astream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        async for chunk in self.select().astream(input, config, **kwargs):
+            yield chunk
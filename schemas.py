@@ -0,0 +1,175 @@
+import json
+from typing import Any, AsyncIterator, Dict, Iterator, List, Type
+
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.runnables import Runnable, RunnableGenerator
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import BaseModel, Field
+
+# Estruturas das respostas de cada etapa, no mesmo formato dos JSONs do pipeline.
+# Os esquemas estritos da OpenAI não aceitam objetos com chaves livres, por isso
+# parâmetros e respostas das APIs são listas, convertidas de volta em dicionários
+# por `normalize_stage_json`.
+
+class RequisitoFuncional(BaseModel):
+    id: str = Field(description="Identificador único do requisito, como RF01")
+    descricao: str = Field(description="Descrição detalhada do requisito")
+    prioridade: str = Field(description="Prioridade do requisito: Alta, Média ou Baixa")
+
+class RequisitoNaoFuncional(BaseModel):
+    id: str = Field(description="Identificador único do requisito, como RNF01")
+    descricao: str = Field(description="Descrição detalhada do requisito")
+    tipo: str = Field(description="Tipo do requisito: Desempenho, Segurança, Usabilidade, etc")
+
+class Requisitos(BaseModel):
+    requisitos_funcionais: List[RequisitoFuncional] = Field(description="Lista de requisitos funcionais")
+    requisitos_nao_funcionais: List[RequisitoNaoFuncional] = Field(description="Lista de requisitos não funcionais")
+
+class Componente(BaseModel):
+    nome: str = Field(description="Nome do componente")
+    descricao: str = Field(description="Descrição detalhada do componente")
+    responsabilidades: List[str] = Field(description="Responsabilidades do componente")
+    dependencias: List[str] = Field(description="Lista de dependências do componente")
+
+class Fluxo(BaseModel):
+    nome: str = Field(description="Nome do fluxo")
+    passos: List[str] = Field(description="Passos do fluxo, em ordem")
+
+class FluxoComponentes(BaseModel):
+    componentes: List[Componente] = Field(description="Componentes do sistema")
+    fluxos: List[Fluxo] = Field(description="Fluxos entre os componentes")
+
+class Parametro(BaseModel):
+    nome: str = Field(description="Nome do parâmetro")
+    descricao: str = Field(description="Descrição do parâmetro")
+
+class Resposta(BaseModel):
+    codigo: str = Field(description="Código de status HTTP, como 200 ou 400")
+    descricao: str = Field(description="Descrição da resposta")
+
+class API(BaseModel):
+    rota: str = Field(description="Rota da API, como /pedidos/{id}")
+    metodo: str = Field(description="Método HTTP: GET, POST, PUT ou DELETE")
+    descricao: str = Field(description="Descrição da funcionalidade")
+    parametros: List[Parametro] = Field(description="Parâmetros de entrada")
+    respostas: List[Resposta] = Field(description="Respostas possíveis")
+
+class MapaAPIs(BaseModel):
+    apis: List[API] = Field(description="Definições das APIs")
+
+class Rascunho(BaseModel):
+    requisitos_funcionais: List[RequisitoFuncional] = Field(description="Lista de requisitos funcionais")
+    requisitos_nao_funcionais: List[RequisitoNaoFuncional] = Field(description="Lista de requisitos não funcionais")
+    componentes: List[Componente] = Field(description="Componentes do sistema")
+    fluxos: List[Fluxo] = Field(description="Fluxos entre os componentes")
+    apis: List[API] = Field(description="Definições das APIs")
+
+# Esquema da resposta de cada etapa (e do rascunho, que reúne as três em uma chamada)
+STAGE_SCHEMAS: Dict[str, Type[BaseModel]] = {
+    "requisitos": Requisitos,
+    "fluxo": FluxoComponentes,
+    "apis": MapaAPIs,
+    "rascunho": Rascunho,
+}
+
+
+def normalize_api(api: Any) -> Any:
+    """Converte as listas de parâmetros e respostas de uma API nos dicionários usados pelo pipeline."""
+    if not isinstance(api, dict):
+        return api
+    api = dict(api)
+    if isinstance(api.get("parametros"), list):
+        api["parametros"] = {
+            str(item.get("nome", "")): item.get("descricao", "")
+            for item in api["parametros"] if isinstance(item, dict)
+        }
+    if isinstance(api.get("respostas"), list):
+        api["respostas"] = {
+            str(item.get("codigo", "")): item.get("descricao", "")
+            for item in api["respostas"] if isinstance(item, dict)
+        }
+    return api
+
+
+def normalize_item(key: str, value: Any) -> Any:
+    """Normaliza um elemento emitido pelo parser incremental."""
+    return normalize_api(value) if key == "apis" else value
+
+
+def normalize_stage_json(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Normaliza o JSON de uma etapa; respostas já no formato do pipeline não são alteradas."""
+    if isinstance(data.get("apis"), list):
+        data = {**data, "apis": [normalize_api(api) for api in data["apis"]]}
+    return data
+
+
+def structured_output_method(model: str) -> str:
+    """Modelos gpt-4o aceitam JSON schema estrito; os demais usam function calling."""
+    return "json_schema" if model.startswith("gpt-4o") else "function_calling"
+
+
+def _tool_arguments(message: BaseMessage) -> str:
+    if isinstance(message, AIMessageChunk):
+        return "".join(chunk.get("args") or "" for chunk in message.tool_call_chunks)
+    raw_calls = message.additional_kwargs.get("tool_calls") or []
+    if raw_calls:
+        return raw_calls[0]["function"]["arguments"]
+    tool_calls = getattr(message, "tool_calls", None) or []
+    return json.dumps(tool_calls[0]["args"], ensure_ascii=False) if tool_calls else message.content
+
+
+def _content_stream(messages: Iterator[BaseMessage]) -> Iterator[str]:
+    for message in messages:
+        if message.content:
+            yield message.content
+
+
+async def _acontent_stream(messages: AsyncIterator[BaseMessage]) -> AsyncIterator[str]:
+    async for message in messages:
+        if message.content:
+            yield message.content
+
+
+def _arguments_stream(messages: Iterator[BaseMessage]) -> Iterator[str]:
+    for message in messages:
+        arguments = _tool_arguments(message)
+        if arguments:
+            yield arguments
+
+
+async def _aarguments_stream(messages: AsyncIterator[BaseMessage]) -> AsyncIterator[str]:
+    async for message in messages:
+        arguments = _tool_arguments(message)
+        if arguments:
+            yield arguments
+
+
+def structured_llm(llm: Runnable, schema: Type[BaseModel], model: str) -> Runnable:
+    """
+    Liga o esquema ao modelo e retorna uma chain que produz o texto JSON da resposta.
+
+    O resultado continua sendo texto (e em streaming), como nas chains com prompt livre,
+    de modo que cache, reparo e o parser incremental funcionam sem alterações.
+
+    Args:
+        llm: Modelo de chat da OpenAI
+        schema: Modelo Pydantic da resposta
+        model (str): Nome do modelo, usado para escolher o método
+
+    Returns:
+        Runnable: Chain que recebe mensagens e emite trechos do JSON
+    """
+    strict = structured_output_method(model) == "json_schema"
+    function = convert_to_openai_tool(schema, strict=strict)["function"]
+    if strict:
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": function["name"],
+                "schema": function["parameters"],
+                "strict": True,
+            },
+        }
+        return llm.bind(response_format=response_format) | RunnableGenerator(_content_stream, _acontent_stream)
+    return llm.bind_tools([schema], tool_choice=function["name"]) | RunnableGenerator(_arguments_stream, _aarguments_stream)
+
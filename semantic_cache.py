@@ -0,0 +1,271 @@
+import hashlib
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, Hashable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.runnables import Runnable, RunnableConfig
+
+# Palavras funcionais (já normalizadas): pouco dizem sobre o sistema e recebem peso baixo
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de da do das dos em no na nos nas ao aos pelo pela pelos pelas
+por para com e ou que se como mais mas ja tambem onde quando qual quais cujo cuja isso isto
+esse essa este esta seu sua seus suas ele ela eles elas ser sao e foi ter tem pode podem deve
+devem cada todo toda todos todas sobre entre ate apos via etc
+""".split())
+
+# Palavras que invertem o sentido do trecho seguinte
+NEGATIONS = frozenset({"nao", "nunca", "jamais", "nenhum", "nenhuma", "nem", "sem"})
+
+# Peso das palavras funcionais em relação às demais
+STOPWORD_WEIGHT = 0.1
+
+
+def normalize_text(text: str) -> str:
+    """Remove acentos, pontuação e espaços extras, deixando o texto em minúsculas."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w]+", " ", text.lower())
+    return " ".join(text.split())
+
+
+def guard_terms(text: str) -> FrozenSet[str]:
+    """
+    Termos que precisam coincidir para duas descrições serem consideradas equivalentes.
+
+    Negações (com a palavra seguinte) e números mudam o sistema descrito mesmo quando quase
+    todo o texto é igual, algo que a similaridade de cosseno sozinha não distingue.
+    """
+    tokens = normalize_text(text).split()
+    terms = {token for token in tokens if token.isdigit()}
+    terms.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:] + [""]) if a in NEGATIONS)
+    return frozenset(terms)
+
+
+class HashingVectorizer:
+    """
+    Vetorizador determinístico baseado em hashing de unigramas e bigramas de palavras.
+
+    Não depende de rede nem de vocabulário treinado: o mesmo texto sempre gera o mesmo vetor,
+    em qualquer processo (o hash usado é o blake2b, e não o hash() aleatorizado do Python).
+    Palavras funcionais (`STOPWORDS`) pesam `STOPWORD_WEIGHT`, e os bigramas são formados
+    pelas palavras de conteúdo, de modo que a diferença entre duas descrições vem do que
+    elas dizem sobre o sistema, não dos artigos e preposições.
+    """
+
+    def __init__(self, dim: int = 2 ** 14):
+        self.dim = dim
+
+    def _features(self, text: str) -> Dict[str, float]:
+        tokens = normalize_text(text).split()
+        counts = Counter(tokens)
+        content = [token for token in tokens if token not in STOPWORDS]
+        counts.update(f"{a} {b}" for a, b in zip(content, content[1:]))
+        return {
+            feature: (1.0 + math.log(count)) * (STOPWORD_WEIGHT if feature in STOPWORDS else 1.0)
+            for feature, count in counts.items()
+        }
+
+    def transform(self, text: str) -> np.ndarray:
+        """
+        Converte um texto em um vetor L2-normalizado.
+
+        Args:
+            text (str): Texto a ser vetorizado
+
+        Returns:
+            np.ndarray: Vetor float32 de dimensão `dim`
+        """
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text).items():
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            index = digest % self.dim
+            # O bit mais alto define o sinal e reduz o viés das colisões
+            sign = 1.0 if digest >> 63 else -1.0
+            vector[index] += sign * weight
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+class VectorIndex:
+    """
+    Índice de busca por similaridade de cosseno em memória.
+
+    Os vetores ficam em uma matriz contígua pré-alocada (crescimento por dobra), de modo que
+    a busca é um único produto matriz-vetor. Ao atingir `max_entries` as entradas mais antigas
+    são sobrescritas.
+    """
+
+    def __init__(self, dim: int, max_entries: int = 100_000, initial_capacity: int = 64):
+        self.dim = dim
+        self.max_entries = max_entries
+        self._matrix = np.zeros((min(initial_capacity, max_entries), dim), dtype=np.float32)
+        self._values: List[Any] = []
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, vector: np.ndarray, value: Any) -> None:
+        size = len(self._values)
+        if size < self.max_entries:
+            if size == self._matrix.shape[0]:
+                capacity = min(self._matrix.shape[0] * 2, self.max_entries)
+                grown = np.zeros((capacity, self.dim), dtype=np.float32)
+                grown[:size] = self._matrix
+                self._matrix = grown
+            self._matrix[size] = vector
+            self._values.append(value)
+            return
+
+        # Índice cheio: sobrescreve a entrada mais antiga
+        self._matrix[self._next] = vector
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.max_entries
+
+    def search(self, vector: np.ndarray) -> Optional[Tuple[float, Any]]:
+        """Retorna (similaridade, valor) da entrada mais próxima, ou None se o índice estiver vazio."""
+        size = len(self._values)
+        if size == 0:
+            return None
+        scores = self._matrix[:size] @ vector
+        best = int(np.argmax(scores))
+        return float(scores[best]), self._values[best]
+
+
+class SemanticCache:
+    """
+    Cache por similaridade para descrições de sistema quase idênticas.
+
+    As entradas são separadas por namespace (por exemplo, modelo e temperatura), para que
+    um resultado gerado com outra configuração nunca seja reaproveitado. Além da similaridade
+    mínima, as negações e os números das duas descrições precisam coincidir (`guard_terms`).
+    Cada vetor ocupa `dim` * 4 bytes (64 KB no padrão): `max_entries` limita a memória por namespace.
+    """
+
+    def __init__(self, threshold: float = 0.95, dim: int = 2 ** 14, max_entries: int = 5_000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vectorizer = HashingVectorizer(dim)
+        self._indexes: Dict[Hashable, VectorIndex] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, text: str, namespace: Hashable = None, threshold: Optional[float] = None) -> Optional[Tuple[float, Any]]:
+        """
+        Procura a execução anterior mais parecida com o texto.
+
+        Args:
+            text (str): Descrição do sistema
+            namespace (Hashable): Namespace da busca
+            threshold (float): Similaridade mínima (usa o padrão do cache se omitido)
+
+        Returns:
+            tuple: (similaridade, valor) se houver entrada acima do limiar, senão None
+        """
+        threshold = self.threshold if threshold is None else threshold
+        vector = self.vectorizer.transform(text)
+        guard = guard_terms(text)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            found = index.search(vector) if index is not None else None
+            if found is None or found[0] < threshold or found[1][0] != guard:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return found[0], found[1][1]
+
+    def add(self, text: str, value: Any, namespace: Hashable = None) -> None:
+        vector = self.vectorizer.transform(text)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = VectorIndex(self.vectorizer.dim, self.max_entries)
+            index.add(vector, (guard_terms(text), value))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": sum(len(index) for index in self._indexes.values()),
+            }
+
+
+class SemanticCachedChain(Runnable[Dict[str, Any], str]):
+    """
+    Coloca um SemanticCache na frente de uma chain cujo texto de entrada está em `input_key`.
+
+    Se uma descrição suficientemente parecida já foi processada com o mesmo namespace, a
+    resposta anterior é devolvida sem chamar o modelo.
+    """
+
+    def __init__(
+        self,
+        chain: Runnable,
+        cache: SemanticCache,
+        namespace: Hashable = None,
+        input_key: str = "descricao_sistema",
+        threshold: Optional[float] = None,
+        validate: Optional[Callable[[str], bool]] = None,
+    ):
+        self.chain = chain
+        self.cache = cache
+        self.namespace = namespace
+        self.input_key = input_key
+        self.threshold = threshold
+        # Respostas rejeitadas por `validate` não são armazenadas
+        self.validate = validate
+
+    def _store(self, input: Dict[str, Any], result: str) -> None:
+        if self.validate is None or self.validate(result):
+            self.cache.add(input[self.input_key], result, self.namespace)
+
+    def _lookup(self, input: Dict[str, Any]) -> Optional[str]:
+        found = self.cache.lookup(input[self.input_key], self.namespace, self.threshold)
+        return found[1] if found is not None else None
+
+    def invoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        cached = self._lookup(input)
+        if cached is not None:
+            return cached
+        result = self.chain.invoke(input, config, **kwargs)
+        self._store(input, result)
+        return result
+
+    async def ainvoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        cached = self._lookup(input)
+        if cached is not None:
+            return cached
+        result = await self.chain.ainvoke(input, config, **kwargs)
+        self._store(input, result)
+        return result
+
+    def stream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        cached = self._lookup(input)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        for chunk in self.chain.stream(input, config, **kwargs):
+            parts.append(chunk)
+            yield chunk
+        self._store(input, "".join(parts))
+
+    async def astream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        cached = self._lookup(input)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        async for chunk in self.chain.astream(input, config, **kwargs):
+            parts.append(chunk)
+            yield chunk
+        self._store(input, "".join(parts))
@@ -0,0 +1,398 @@
+"""
+Serviço HTTP (sem interface) para o pipeline de documentação.
+
+Rotas:
+    POST /documentacao                  Enfileira uma geração ({"descricao": ..., "rascunho": false, "apis_paralelas": false});
+                                        com o cabeçalho Idempotency-Key, repetições retornam a mesma geração
+    GET  /documentacao/{id}             Situação e progresso da geração
+    GET  /documentacao/{id}/resultado   JSON da documentação (?parcial=1 aceita execuções incompletas)
+    GET  /documentacao/{id}/pdf         PDF da documentação (?parcial=1 aceita execuções incompletas)
+    GET  /documentacao/{id}/eventos     Eventos da geração (Server-Sent Events)
+    POST /documentacao/{id}/retomar     Retoma uma execução que falhou ou foi interrompida, a partir da primeira etapa ausente
+    GET  /saude                         Situação do worker
+
+Com `Accept: text/event-stream`, o POST /documentacao responde diretamente com os eventos da
+geração: o job roda no mesmo worker da conexão, e cada requisito, componente e API é enviado
+assim que aparece na resposta do modelo (ver `client.py`).
+
+Execute com `python server.py --workers 4`: cada worker é um processo com seu próprio event
+loop, todos escutando a mesma porta (SO_REUSEPORT). O id de cada geração é o id da execução
+no checkpoint (SQLite compartilhado), de modo que qualquer worker responde pela situação e
+pelo resultado; o progresso elemento a elemento só é conhecido pelo worker que executa o job.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Set
+
+from aiohttp import web
+from langchain_core.runnables import Runnable
+
+from checkpoints import COMPLETED, FAILED, RUN_LEASE, RUNNING, CheckpointStore, IdempotencyConflict
+from coalescing import SingleFlight
+from jobs import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_RUNNING,
+    STAGE_COMPLETED,
+    AsyncJobManager,
+    Job,
+    arun_documentation,
+)
+from pdf_generator import render_pdf
+from pipeline import create_chains_from_env, export_json
+
+# Situação do job correspondente a cada situação da execução salva
+RUN_STATUS = {RUNNING: JOB_RUNNING, COMPLETED: JOB_DONE, FAILED: JOB_FAILED}
+
+# Evento emitido quando o PDF da geração já está disponível
+PDF_READY = "pdf_pronto"
+
+# Intervalo (segundos) dos comentários de keep-alive do SSE e da consulta ao checkpoint
+SSE_HEARTBEAT = 15.0
+SSE_POLL_INTERVAL = 1.0
+
+# Tarefas de renovação em andamento (referência forte até terminarem)
+_heartbeats: Set["asyncio.Task[None]"] = set()
+
+CHAINS = web.AppKey("chains", dict)
+STORE = web.AppKey("store", CheckpointStore)
+JOBS = web.AppKey("jobs", AsyncJobManager)
+PDF_POOL = web.AppKey("pdf_pool", ProcessPoolExecutor)
+FLIGHTS = web.AppKey("flights", SingleFlight)
+
+
+def _error(http_status: int, message: str, **extra: Any) -> web.Response:
+    return web.json_response({"erro": message, **extra}, status=http_status)
+
+
+def _links(run_id: str) -> Dict[str, str]:
+    base = f"/documentacao/{run_id}"
+    return {"situacao": base, "resultado": f"{base}/resultado", "pdf": f"{base}/pdf"}
+
+
+def _job_status(job: Job) -> Dict[str, Any]:
+    snapshot = job.snapshot()
+    snapshot["etapas_concluidas"] = list(snapshot.pop("resultados"))
+    return snapshot
+
+
+def _run_status(run: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": run["run_id"],
+        "run_id": run["run_id"],
+        "status": RUN_STATUS.get(run["status"], run["status"]),
+        "etapas_concluidas": list(run["resultados"]),
+        "erro": run["erro"],
+    }
+
+
+def _submit(app: web.Application, run_id: str, description: str, settings: Dict[str, Any]) -> Job:
+    chains, store, pool = app[CHAINS], app[STORE], app[PDF_POOL]
+
+    async def target(job: Job) -> None:
+        results = await arun_documentation(
+            job, chains, store, settings.get("apis_paralelas", False), settings.get("rascunho", False)
+        )
+        # O PDF é gerado logo ao final, para estar pronto quando o cliente pedir
+        try:
+            job.pdf = await asyncio.get_running_loop().run_in_executor(pool, render_pdf, results)
+        except Exception as error:
+            job.add_message(f"Erro ao gerar PDF: {error}")
+        else:
+            job.add_event(PDF_READY, {"url": _links(job.id)["pdf"]})
+
+    job = app[JOBS].submit(description, target, run_id, job_id=run_id)
+    # Renova a concessão desde a fila, para que outro worker não retome a execução em paralelo
+    heartbeat = asyncio.ensure_future(_keep_alive(store, job))
+    _heartbeats.add(heartbeat)
+    heartbeat.add_done_callback(_heartbeats.discard)
+    return job
+
+
+async def _keep_alive(store: CheckpointStore, job: Job) -> None:
+    while True:
+        await asyncio.sleep(RUN_LEASE / 3)
+        if job.finished:
+            return
+        await asyncio.to_thread(store.touch, job.id)
+
+
+def _accepted(job: Job) -> web.Response:
+    return web.json_response(
+        {"id": job.id, "status": job.status, "links": _links(job.id)},
+        status=202,
+        headers={"Location": f"/documentacao/{job.id}"},
+    )
+
+
+def _wants_events(request: web.Request) -> bool:
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+
+async def _open_event_stream(request: web.Request) -> web.StreamResponse:
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        # Desativa o buffer de proxies (nginx), que atrasaria os eventos
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    return response
+
+
+async def _send_event(response: web.StreamResponse, event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> None:
+    message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n{message}"
+    await response.write(message.encode("utf-8"))
+
+
+async def _stream_job(request: web.Request, job: Job, start: int = 0) -> web.StreamResponse:
+    """Envia os eventos do job até ele terminar; o id de cada evento permite retomar com Last-Event-ID."""
+    response = await _open_event_stream(request)
+    async for entry in job.follow(start, heartbeat=SSE_HEARTBEAT):
+        if entry is None:
+            await response.write(b": keep-alive\n\n")
+            continue
+        index, event, data = entry
+        await _send_event(response, event, data, index)
+    await response.write_eof()
+    return response
+
+
+async def _stream_run(request: web.Request, run_id: str) -> web.StreamResponse:
+    """
+    Eventos de uma execução sem job neste worker: as etapas são lidas do checkpoint
+    à medida que são salvas, até a execução terminar.
+    """
+    response = await _open_event_stream(request)
+    sent = set()
+    while True:
+        run = await asyncio.to_thread(request.app[STORE].load, run_id)
+        for stage, output in run["resultados"].items():
+            if stage not in sent:
+                sent.add(stage)
+                await _send_event(response, STAGE_COMPLETED, {"etapa": stage, "origem": "checkpoint", "resultado": output})
+        if run["status"] != RUNNING:
+            status = RUN_STATUS.get(run["status"], run["status"])
+            await _send_event(response, status, {"erro": run["erro"]} if run["erro"] else {})
+            break
+        await asyncio.sleep(SSE_POLL_INTERVAL)
+    await response.write_eof()
+    return response
+
+
+async def submit(request: web.Request) -> web.Response:
+    try:
+        body = await request.json()
+    except ValueError:
+        return _error(400, "O corpo da requisição deve ser um JSON")
+    description = body.get("descricao") if isinstance(body, dict) else None
+    if not isinstance(description, str) or not description.strip():
+        return _error(400, "Informe a descrição do sistema em 'descricao'")
+
+    settings = {"rascunho": bool(body.get("rascunho", False)), "apis_paralelas": bool(body.get("apis_paralelas", False))}
+    store = request.app[STORE]
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if idempotency_key:
+        try:
+            run_id, created = await asyncio.to_thread(store.create_run_once, description, settings, idempotency_key)
+        except IdempotencyConflict as error:
+            return _error(422, str(error))
+        if not created:
+            return await _replay(request, run_id)
+    else:
+        run_id = await asyncio.to_thread(store.create_run, description, settings)
+
+    job = _submit(request.app, run_id, description, settings)
+    if _wants_events(request):
+        return await _stream_job(request, job)
+    return _accepted(job)
+
+
+async def _replay(request: web.Request, run_id: str) -> web.StreamResponse:
+    """Resposta a uma requisição repetida com a mesma chave de idempotência: a geração já existente."""
+    job = request.app[JOBS].get(run_id)
+    if _wants_events(request):
+        if job is not None:
+            return await _stream_job(request, job)
+        return await _stream_run(request, run_id)
+    if job is not None:
+        status = job.status
+    else:
+        run = await asyncio.to_thread(request.app[STORE].load, run_id)
+        status = RUN_STATUS.get(run["status"], run["status"])
+    return web.json_response(
+        {"id": run_id, "status": status, "links": _links(run_id)},
+        status=200,
+        headers={"Location": f"/documentacao/{run_id}", "Idempotent-Replayed": "true"},
+    )
+
+
+async def resume(request: web.Request) -> web.Response:
+    run_id = request.match_info["run_id"]
+    job = request.app[JOBS].get(run_id)
+    if job is not None and not job.finished:
+        return _error(409, "A execução ainda está em andamento", status=job.status)
+    run = await asyncio.to_thread(request.app[STORE].load, run_id)
+    if run is None:
+        return _error(404, "Execução não encontrada")
+    if run["status"] == COMPLETED:
+        return _error(409, "A execução já foi concluída", status=JOB_DONE)
+    # Em andamento em outro worker (com a concessão renovada) não pode ser retomada em paralelo
+    if not await asyncio.to_thread(request.app[STORE].claim_run, run_id, RUN_LEASE):
+        return _error(409, "A execução ainda está em andamento", status=JOB_RUNNING)
+    job = _submit(request.app, run_id, run["descricao"], run["configuracao"])
+    if _wants_events(request):
+        return await _stream_job(request, job)
+    return _accepted(job)
+
+
+async def status(request: web.Request) -> web.Response:
+    run_id = request.match_info["run_id"]
+    job = request.app[JOBS].get(run_id)
+    if job is not None:
+        return web.json_response(_job_status(job))
+    # Job executado por outro worker (ou antes de reiniciar o serviço): situação do checkpoint
+    run = await asyncio.to_thread(request.app[STORE].load, run_id)
+    if run is None:
+        return _error(404, "Execução não encontrada")
+    return web.json_response(_run_status(run))
+
+
+async def events(request: web.Request) -> web.StreamResponse:
+    run_id = request.match_info["run_id"]
+    job = request.app[JOBS].get(run_id)
+    if job is not None:
+        last_event_id = request.headers.get("Last-Event-ID", "")
+        return await _stream_job(request, job, int(last_event_id) + 1 if last_event_id.isdigit() else 0)
+    # Job em outro worker: acompanha o checkpoint, com eventos apenas por etapa concluída
+    if await asyncio.to_thread(request.app[STORE].load, run_id) is None:
+        return _error(404, "Execução não encontrada")
+    return await _stream_run(request, run_id)
+
+
+async def _finished_results(request: web.Request) -> Any:
+    """Resultados da execução, ou a resposta de erro se ela não existir ou não tiver terminado."""
+    run = await asyncio.to_thread(request.app[STORE].load, request.match_info["run_id"])
+    if run is None:
+        return _error(404, "Execução não encontrada")
+    if run["status"] != COMPLETED and request.query.get("parcial") != "1":
+        return _error(409, "A execução não foi concluída", **_run_status(run))
+    return run["resultados"]
+
+
+async def result(request: web.Request) -> web.Response:
+    results = await _finished_results(request)
+    if isinstance(results, web.Response):
+        return results
+    return web.json_response(export_json(results))
+
+
+async def pdf(request: web.Request) -> web.Response:
+    results = await _finished_results(request)
+    if isinstance(results, web.Response):
+        return results
+    job = request.app[JOBS].get(request.match_info["run_id"])
+    content = job.pdf if job is not None and job.status == JOB_DONE else None
+    if content is None:
+        # O reportlab é CPU-bound: roda em outro processo para não travar o event loop
+        loop = asyncio.get_running_loop()
+        content = await loop.run_in_executor(request.app[PDF_POOL], render_pdf, results)
+    return web.Response(
+        body=content,
+        content_type="application/pdf",
+        headers={"Content-Disposition": 'attachment; filename="documentacao_tecnica.pdf"'},
+    )
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({
+        "status": "ok",
+        "pid": os.getpid(),
+        "jobs": request.app[JOBS].stats(),
+        "chamadas_compartilhadas": request.app[FLIGHTS].stats(),
+    })
+
+
+def create_app(
+    chains: Optional[Dict[str, Runnable]] = None,
+    store: Optional[CheckpointStore] = None,
+    max_concurrency: Optional[int] = None,
+    pdf_workers: Optional[int] = None,
+) -> web.Application:
+    """
+    Cria a aplicação aiohttp de um worker.
+
+    Args:
+        chains (dict): Chains do pipeline (padrão: `create_chains_from_env()`)
+        store (CheckpointStore): Checkpoint das execuções (padrão: DOC_CHECKPOINT_PATH)
+        max_concurrency (int): Gerações simultâneas neste worker (padrão: DOC_MAX_CONCURRENCY ou 32)
+        pdf_workers (int): Processos que geram PDFs (padrão: DOC_PDF_WORKERS ou 2)
+
+    Returns:
+        web.Application: Aplicação pronta para `web.run_app`
+    """
+    app = web.Application()
+    app[FLIGHTS] = SingleFlight()
+    app[CHAINS] = chains if chains is not None else create_chains_from_env(app[FLIGHTS])
+    app[STORE] = store or CheckpointStore(os.environ.get("DOC_CHECKPOINT_PATH", ".cache/execucoes.sqlite"))
+    app[JOBS] = AsyncJobManager(max_concurrency=max_concurrency or int(os.environ.get("DOC_MAX_CONCURRENCY", "32")))
+    pdf_workers = pdf_workers or int(os.environ.get("DOC_PDF_WORKERS", "2"))
+
+    async def lifecycle(app: web.Application):
+        # "spawn" evita herdar as threads e conexões do worker nos processos de PDF
+        app[PDF_POOL] = ProcessPoolExecutor(max_workers=pdf_workers, mp_context=multiprocessing.get_context("spawn"))
+        yield
+        await app[JOBS].close()
+        app[PDF_POOL].shutdown(wait=False, cancel_futures=True)
+
+    app.cleanup_ctx.append(lifecycle)
+    app.router.add_post("/documentacao", submit)
+    app.router.add_get("/documentacao/{run_id}", status)
+    app.router.add_get("/documentacao/{run_id}/resultado", result)
+    app.router.add_get("/documentacao/{run_id}/pdf", pdf)
+    app.router.add_get("/documentacao/{run_id}/eventos", events)
+    app.router.add_post("/documentacao/{run_id}/retomar", resume)
+    app.router.add_get("/saude", health)
+    return app
+
+
+def serve(host: str, port: int) -> None:
+    """Executa um worker; com SO_REUSEPORT o kernel distribui as conexões entre os workers."""
+    web.run_app(create_app(), host=host, port=port, reuse_port=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serviço HTTP do gerador de documentação técnica")
+    parser.add_argument("--host", default=os.environ.get("DOC_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("DOC_PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("DOC_SERVER_WORKERS", os.cpu_count() or 1)))
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        serve(args.host, args.port)
+        return
+
+    workers = [
+        multiprocessing.Process(target=serve, args=(args.host, args.port), name=f"doc-server-{index}")
+        for index in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    main()
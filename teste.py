@@ -1,10 +1,12 @@
+import logging
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
-from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from typing import List, Dict
 from langchain_core.runnables import RunnablePassthrough
+from http_client import OPENAI_BASE_URL, get_async_http_client, get_http_client
+
+logger = logging.getLogger(__name__)
 
 # Definindo estruturas de dados para garantir respostas formatadas
 class RequisitosFuncionais(BaseModel):
@@ -33,17 +35,23 @@ class API(BaseModel):
     parametros: Dict = Field(description="Parâmetros de entrada")
     resposta: Dict = Field(description="Estrutura da resposta")
 
+MODEL = "gpt-4"
+
 # Configuração do modelo
 def get_llm():
     return ChatOpenAI(
-        model="gpt-4",
-        temperature=0.7
+        model=MODEL,
+        temperature=0.7,
+        # OPENAI_BASE_URL pode apontar para o servidor local de testes (openai_server.py)
+        base_url=OPENAI_BASE_URL,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client()
     )
 
-# Criando os parsers
-requisitos_parser = PydanticOutputParser(pydantic_object=Requisitos)
-componente_parser = PydanticOutputParser(pydantic_object=Componente)
-api_parser = PydanticOutputParser(pydantic_object=API)
+# Saída estruturada pelo provedor: o formato vem do esquema, não de instruções no prompt.
+# Os campos livres (Dict) de API não cabem no JSON schema estrito, então usa function calling
+def structured(llm, schema):
+    return llm.with_structured_output(schema, method="function_calling")
 
 # Templates dos prompts
 REQUISITOS_TEMPLATE = """
@@ -52,8 +60,6 @@ Com base na seguinte descrição de sistema, gere requisitos funcionais e não f
 DESCRIÇÃO:
 {descricao_sistema}
 
-{format_instructions}
-
 Seja específico e detalhado na descrição dos requisitos.
 """
 
@@ -63,8 +69,6 @@ Com base nos requisitos abaixo, descreva os componentes do sistema:
 REQUISITOS:
 {requisitos}
 
-{format_instructions}
-
 Forneça uma descrição detalhada de cada componente e suas interações.
 """
 
@@ -74,8 +78,6 @@ Com base nos componentes descritos, defina as APIs necessárias:
 COMPONENTES:
 {componentes}
 
-{format_instructions}
-
 Detalhe cada endpoint com seus métodos, parâmetros e respostas esperadas.
 """
 
@@ -86,40 +88,34 @@ def create_documentation_chain():
     # Chain de Requisitos
     requisitos_prompt = PromptTemplate(
         template=REQUISITOS_TEMPLATE,
-        input_variables=["descricao_sistema"],
-        partial_variables={"format_instructions": requisitos_parser.get_format_instructions()}
+        input_variables=["descricao_sistema"]
     )
     
     requisitos_chain = (
         requisitos_prompt 
-        | llm 
-        | requisitos_parser
+        | structured(llm, Requisitos)
     )
     
     # Chain de Componentes
     componentes_prompt = PromptTemplate(
         template=COMPONENTES_TEMPLATE,
-        input_variables=["requisitos"],
-        partial_variables={"format_instructions": componente_parser.get_format_instructions()}
+        input_variables=["requisitos"]
     )
     
     componentes_chain = (
         componentes_prompt 
-        | llm 
-        | componente_parser
+        | structured(llm, Componente)
     )
     
     # Chain de APIs
     api_prompt = PromptTemplate(
         template=API_TEMPLATE,
-        input_variables=["componentes"],
-        partial_variables={"format_instructions": api_parser.get_format_instructions()}
+        input_variables=["componentes"]
     )
     
     api_chain = (
         api_prompt 
-        | llm 
-        | api_parser
+        | structured(llm, API)
     )
     
     # Chain completa
@@ -160,6 +156,26 @@ def generate_documentation(descricao_sistema: str):
         print(f"Erro ao gerar documentação: {str(e)}")
         return None
 
+# Versão assíncrona, para executar várias gerações no mesmo event loop
+async def agenerate_documentation(descricao_sistema: str, chains=None):
+    chains = chains or create_documentation_chain()
+    
+    try:
+        requisitos = await chains["requisitos"].ainvoke({"descricao_sistema": descricao_sistema})
+        componentes = await chains["componentes"].ainvoke({"requisitos": requisitos.model_dump_json()})
+        apis = await chains["apis"].ainvoke({"componentes": componentes.model_dump_json()})
+        
+        return {
+            "requisitos": requisitos,
+            "componentes": componentes,
+            "apis": apis
+        }
+        
+    except Exception:
+        # Várias gerações rodam juntas: o erro vai para o log, com a descrição que falhou
+        logger.exception("Erro ao gerar documentação: %.80s", descricao_sistema)
+        return None
+
 # Exemplo de uso
 if __name__ == "__main__":
     descricao_sistema = """
@@ -0,0 +1,110 @@
+import pytest
+
+import cache as cache_module
+from cache import DiskCache, LRUCache, TieredCache, make_cache_key
+
+
+class Clock:
+    def __init__(self, now=1_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def disk(tmp_path, clock):
+    return DiskCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60, max_bytes=None, evict_every=1_000)
+
+
+def test_cache_key_ignores_input_order_and_changes_with_model():
+    key = make_cache_key("t", "gpt-4o", 0.2, {"a": 1, "b": 2})
+    assert key == make_cache_key("t", "gpt-4o", 0.2, {"b": 2, "a": 1})
+    assert key != make_cache_key("t", "gpt-4", 0.2, {"a": 1, "b": 2})
+
+
+def test_lru_evicts_least_recently_used_entry():
+    lru = LRUCache(max_entries=2, max_bytes=None)
+    lru.set("a", "1")
+    lru.set("b", "2")
+    assert lru.get("a") == "1"
+    lru.set("c", "3")
+    assert lru.get("b") is None
+    assert lru.get("a") == "1" and lru.get("c") == "3"
+    assert lru.stats()["evictions"] == 1
+
+
+def test_lru_respects_byte_limit():
+    lru = LRUCache(max_entries=100, max_bytes=10)
+    lru.set("a", "12345")
+    lru.set("b", "67890")
+    lru.set("c", "x")
+    assert lru.get("a") is None
+    assert lru.stats()["bytes"] == 6
+    # Um valor maior que o limite não é armazenado nem remove os demais
+    lru.set("grande", "y" * 11)
+    assert lru.get("grande") is None
+    assert len(lru) == 2
+
+
+def test_lru_replacing_a_key_updates_size():
+    lru = LRUCache(max_entries=10, max_bytes=None)
+    lru.set("a", "12345")
+    lru.set("a", "1")
+    assert lru.stats()["bytes"] == 1
+    assert len(lru) == 1
+
+
+def test_disk_cache_round_trip_and_ttl(disk, clock):
+    disk.set("chave", "conteúdo " * 100)
+    assert disk.get("chave") == "conteúdo " * 100
+    clock.now += 59
+    assert disk.get("chave") is not None
+    clock.now += 1
+    assert disk.get("chave") is None
+    assert disk.stats()["hits"] == 2 and disk.stats()["misses"] == 1
+
+
+def test_disk_cache_evicts_expired_entries(disk, clock):
+    disk.set("antiga", "a")
+    clock.now += 30
+    disk.set("nova", "b")
+    clock.now += 40
+    assert disk.evict() == 1
+    assert disk.stats()["entries"] == 1
+    assert disk.get("nova") == "b"
+
+
+def test_disk_cache_evicts_least_recently_accessed_over_byte_limit(tmp_path, clock):
+    disk = DiskCache(str(tmp_path / "cache.sqlite"), ttl_seconds=None, max_bytes=None, evict_every=1_000)
+    for index, key in enumerate(["a", "b", "c"]):
+        clock.now += 1
+        disk.set(key, str(index) * 1_000)
+    clock.now += 1
+    assert disk.get("a") is not None
+    size = disk.stats()["bytes"]
+    disk.max_bytes = size - 1
+    assert disk.evict() == 1
+    assert disk.get("b") is None
+    assert disk.get("a") is not None and disk.get("c") is not None
+
+
+def test_disk_cache_is_shared_between_instances(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    DiskCache(path).set("chave", "valor")
+    assert DiskCache(path).get("chave") == "valor"
+
+
+def test_tiered_cache_promotes_disk_hits_to_memory(disk):
+    memory = LRUCache(max_entries=10)
+    disk.set("chave", "valor")
+    tiered = TieredCache(memory, disk)
+    assert tiered.get("chave") == "valor"
+    assert memory.get("chave") == "valor"
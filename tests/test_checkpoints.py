@@ -0,0 +1,101 @@
+import pytest
+
+import checkpoints
+from checkpoints import COMPLETED, FAILED, RUNNING, CheckpointStore, IdempotencyConflict
+
+
+class Clock:
+    def __init__(self, now=1_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(checkpoints.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return CheckpointStore(str(tmp_path / "execucoes.sqlite"), idempotency_ttl=100)
+
+
+def test_run_keeps_description_settings_and_stage_results(store):
+    run_id = store.create_run("Sistema de biblioteca", {"modelo": "gpt-4o", "rascunho": False})
+    store.save_stage(run_id, "requisitos", {"requisitos_funcionais": []})
+    store.save_stage(run_id, "requisitos", {"requisitos_funcionais": [{"id": "RF01"}]})
+    store.save_stage(run_id, "fluxo", {"componentes": []})
+    run = store.load(run_id)
+    assert run["descricao"] == "Sistema de biblioteca"
+    assert run["configuracao"] == {"modelo": "gpt-4o", "rascunho": False}
+    assert run["status"] == RUNNING
+    assert run["resultados"] == {"requisitos": {"requisitos_funcionais": [{"id": "RF01"}]}, "fluxo": {"componentes": []}}
+    assert store.load("inexistente") is None
+
+
+def test_only_failed_runs_can_be_claimed_right_away(store):
+    run_id = store.create_run("Sistema")
+    assert not store.claim_run(run_id, lease=60)
+    store.set_status(run_id, FAILED, "tempo esgotado")
+    assert store.load(run_id)["erro"] == "tempo esgotado"
+    assert store.claim_run(run_id, lease=60)
+    run = store.load(run_id)
+    assert run["status"] == RUNNING and run["erro"] is None
+    # Quem retomou renova a concessão: um segundo clique não assume a mesma execução
+    assert not store.claim_run(run_id, lease=60)
+
+
+def test_interrupted_run_is_claimed_after_the_lease_expires(store, clock):
+    run_id = store.create_run("Sistema")
+    clock.now += 40
+    store.touch(run_id)
+    clock.now += 40
+    assert not store.claim_run(run_id, lease=60)
+    clock.now += 21
+    assert store.claim_run(run_id, lease=60)
+    assert not store.claim_run(run_id, lease=60)
+
+
+def test_completed_runs_are_never_claimed(store, clock):
+    run_id = store.create_run("Sistema")
+    store.set_status(run_id, COMPLETED)
+    clock.now += 3_600
+    assert not store.claim_run(run_id, lease=60)
+    # touch não reabre uma execução concluída
+    store.touch(run_id)
+    assert store.load(run_id)["status"] == COMPLETED
+
+
+def test_saving_a_stage_renews_the_lease(store, clock):
+    run_id = store.create_run("Sistema")
+    clock.now += 50
+    store.save_stage(run_id, "requisitos", {})
+    clock.now += 50
+    assert not store.claim_run(run_id, lease=60)
+
+
+def test_idempotency_key_returns_the_same_run(store):
+    first, created = store.create_run_once("Sistema", {"rascunho": True}, "chave-1")
+    assert created
+    again, created = store.create_run_once("Sistema", {"rascunho": True}, "chave-1")
+    assert (again, created) == (first, False)
+    with pytest.raises(IdempotencyConflict):
+        store.create_run_once("Outro sistema", {"rascunho": True}, "chave-1")
+
+
+def test_idempotency_key_expires(store, clock):
+    first, _ = store.create_run_once("Sistema", {}, "chave-1")
+    clock.now += 101
+    second, created = store.create_run_once("Outro sistema", {}, "chave-1")
+    assert created and second != first
+
+
+def test_store_is_shared_between_instances(tmp_path, clock):
+    path = str(tmp_path / "execucoes.sqlite")
+    run_id = CheckpointStore(path).create_run("Sistema")
+    CheckpointStore(path).set_status(run_id, FAILED, "erro")
+    assert CheckpointStore(path).claim_run(run_id, lease=60)
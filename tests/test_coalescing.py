@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+
+from coalescing import CoalescedChain, SingleFlight, normalize_inputs
+
+CALLERS = 6
+
+
+class Upstream:
+    """Chain de teste que conta as chamadas e só responde depois que todos os chamadores entraram."""
+
+    def __init__(self, flights, error=None):
+        self.flights = flights
+        self.error = error
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def wait_for_followers(self):
+        deadline = time.monotonic() + 5
+        while self.flights.stats()["compartilhadas"] < CALLERS - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def respond(self, inputs):
+        with self.lock:
+            self.calls += 1
+        self.wait_for_followers()
+        if self.error is not None:
+            raise self.error
+        return f"resposta para {inputs['descricao']}"
+
+    def stream(self, chunks):
+        for inputs in chunks:
+            text = self.respond(inputs)
+            for start in range(0, len(text), 4):
+                yield text[start:start + 4]
+
+
+def coalesced(upstream, runnable):
+    return CoalescedChain(runnable, upstream.flights, "template", "modelo", 0.0)
+
+
+def run_in_threads(target):
+    results, errors = [], []
+
+    def call(index):
+        try:
+            results.append(target(index))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results, errors
+
+
+def test_normalize_inputs_collapses_whitespace():
+    assert normalize_inputs({"a": "  um\n dois\t", "b": 3}) == {"a": "um dois", "b": 3}
+
+
+def test_concurrent_invokes_share_one_call():
+    flights = SingleFlight()
+    upstream = Upstream(flights)
+    chain = coalesced(upstream, RunnableLambda(upstream.respond))
+    # Espaços diferentes não impedem o compartilhamento
+    results, errors = run_in_threads(lambda index: chain.invoke({"descricao": "loja" + " " * index}))
+    assert not errors
+    assert results == ["resposta para loja"] * CALLERS
+    assert upstream.calls == 1
+    assert flights.stats() == {"chamadas": 1, "compartilhadas": CALLERS - 1, "em_andamento": 0}
+
+
+def test_concurrent_streams_share_one_call_and_receive_every_chunk():
+    flights = SingleFlight()
+    upstream = Upstream(flights)
+    chain = coalesced(upstream, RunnableGenerator(upstream.stream))
+    results, errors = run_in_threads(lambda index: list(chain.stream({"descricao": "loja"})))
+    assert not errors
+    assert len(results) == CALLERS
+    assert all("".join(chunks) == "resposta para loja" and len(chunks) > 1 for chunks in results)
+    assert upstream.calls == 1
+
+
+def test_each_caller_gets_its_own_copy_of_the_error():
+    flights = SingleFlight()
+    upstream = Upstream(flights, error=ValueError("falhou"))
+    chain = coalesced(upstream, RunnableLambda(upstream.respond))
+    results, errors = run_in_threads(lambda index: chain.invoke({"descricao": "loja"}))
+    assert not results
+    assert len(errors) == CALLERS
+    assert all(isinstance(error, ValueError) and str(error) == "falhou" for error in errors)
+    assert len({id(error) for error in errors}) == CALLERS
+    assert upstream.calls == 1
+    assert flights.stats()["em_andamento"] == 0
+
+
+def test_different_inputs_are_not_shared():
+    flights = SingleFlight()
+    chain = CoalescedChain(RunnableLambda(lambda inputs: inputs["descricao"]), flights, "template", "modelo", 0.0)
+    assert chain.invoke({"descricao": "a"}) == "a"
+    assert chain.invoke({"descricao": "b"}) == "b"
+    assert flights.stats()["chamadas"] == 2 and flights.stats()["compartilhadas"] == 0
+
+
+def test_concurrent_async_callers_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def respond(inputs):
+        calls.append(inputs)
+        await asyncio.sleep(0.05)
+        return "resposta"
+
+    async def astream(chunks):
+        async for inputs in chunks:
+            calls.append(inputs)
+            await asyncio.sleep(0.05)
+            for chunk in ("res", "pos", "ta"):
+                yield chunk
+
+    async def main():
+        invoked = CoalescedChain(RunnableLambda(lambda inputs: "", afunc=respond), flights, "a", "modelo", 0.0)
+        streamed = CoalescedChain(RunnableGenerator(astream), flights, "b", "modelo", 0.0)
+
+        async def collect():
+            return "".join([chunk async for chunk in streamed.astream({"descricao": "loja"})])
+
+        return await asyncio.gather(
+            *[invoked.ainvoke({"descricao": "loja"}) for _ in range(CALLERS)],
+            *[collect() for _ in range(CALLERS)],
+        )
+
+    assert asyncio.run(main()) == ["resposta"] * (2 * CALLERS)
+    assert len(calls) == 2
+    assert flights.stats() == {"chamadas": 2, "compartilhadas": 2 * (CALLERS - 1), "em_andamento": 0}
+
+
+def test_call_is_cancelled_only_when_every_async_reader_gives_up():
+    flights = SingleFlight()
+
+    async def main():
+        stopped = asyncio.Event()
+
+        async def astream(chunks):
+            async for _ in chunks:
+                try:
+                    yield "a"
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    stopped.set()
+                    raise
+
+        chain = CoalescedChain(RunnableGenerator(astream), flights, "t", "modelo", 0.0)
+
+        async def read_first():
+            async for chunk in chain.astream({"descricao": "loja"}):
+                return chunk
+
+        assert await asyncio.gather(read_first(), read_first()) == ["a", "a"]
+        await asyncio.wait_for(stopped.wait(), 1)
+
+    asyncio.run(main())
+    assert flights.stats()["em_andamento"] == 0
+
+
+@pytest.mark.parametrize("error", [KeyError("x"), RuntimeError("y")])
+def test_reader_errors_keep_type_and_cause(error):
+    flights = SingleFlight()
+    flight, leader = flights.join("chave")
+    assert leader
+    flights.complete("chave", flight, error)
+    with pytest.raises(type(error)) as raised:
+        list(flight.read())
+    assert raised.value is not error
+    assert raised.value.__cause__ is error
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from json_stream import IncrementalJSONParser
+
+RESPONSE = {
+    "apis": [
+        {"rota": "/pedidos/{id}", "metodo": "GET", "descricao": "Consulta um pedido, com \"aspas\" e {chaves}"},
+        {"rota": "/pedidos", "metodo": "POST", "descricao": "Cria um pedido"},
+    ],
+    "versoes": [1, 2.5, True, None, "v3"],
+}
+
+
+def feed_in_chunks(parser, text, size):
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(parser.feed(text[start:start + size]))
+    return items
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_items_are_emitted_in_order_for_any_chunk_size(size):
+    text = "```json\n" + json.dumps(RESPONSE, ensure_ascii=False, indent=2) + "\n```"
+    parser = IncrementalJSONParser()
+    items = feed_in_chunks(parser, text, size)
+    assert items == [("apis", api) for api in RESPONSE["apis"]] + [("versoes", value) for value in RESPONSE["versoes"]]
+    assert parser.done
+    assert parser.close() == RESPONSE
+
+
+def test_item_is_emitted_as_soon_as_it_closes():
+    parser = IncrementalJSONParser()
+    text = json.dumps(RESPONSE)
+    first_end = text.index("}, {") + 1
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == [("apis", RESPONSE["apis"][0])]
+    assert parser.partial() == {"apis": [RESPONSE["apis"][0]]}
+
+
+def test_text_after_the_main_object_is_ignored():
+    parser = IncrementalJSONParser()
+    parser.feed('Aqui está: {"apis": []} e mais {"outro": 1}')
+    assert parser.done
+    assert parser.close() == {"apis": []}
+    assert parser.fragment() == '{"apis": []}'
+
+
+def test_truncated_response_keeps_completed_items_and_reports_error():
+    text = json.dumps(RESPONSE)
+    truncated = text[:text.index("/pedidos\"") + 5]
+    parser = IncrementalJSONParser()
+    items = feed_in_chunks(parser, truncated, 4)
+    assert items == [("apis", RESPONSE["apis"][0])]
+    assert not parser.done
+    assert parser.fragment() == truncated
+    result = parser.close()
+    assert result["erro"] == "Não foi possível gerar um JSON válido"
+    assert result["resposta_original"] == truncated
@@ -0,0 +1,37 @@
+from pipeline import merge_apis
+
+
+def test_merge_apis_unifies_equivalent_routes():
+    partials = [
+        {"apis": [
+            {"rota": "/pedidos/{id}", "metodo": "get", "descricao": "Consulta", "parametros": {"id": "Pedido"},
+             "respostas": {"200": "Pedido"}},
+            {"rota": "/pedidos", "metodo": "POST", "descricao": "Cria"},
+        ]},
+        {"apis": [
+            {"rota": "/Pedidos/:pedidoId/", "metodo": "GET", "descricao": "Outra descrição",
+             "parametros": {"id": "Ignorado", "campos": "Campos retornados"}, "respostas": {"404": "Não encontrado"}},
+        ]},
+    ]
+    merged = merge_apis(partials)["apis"]
+    assert [(api["metodo"], api["rota"]) for api in merged] == [("get", "/pedidos/{id}"), ("POST", "/pedidos")]
+    first = merged[0]
+    # A primeira ocorrência prevalece; parâmetros e respostas novos são acrescentados
+    assert first["descricao"] == "Consulta"
+    assert first["parametros"] == {"id": "Pedido", "campos": "Campos retornados"}
+    assert first["respostas"] == {"200": "Pedido", "404": "Não encontrado"}
+
+
+def test_merge_apis_keeps_distinct_methods_and_skips_invalid_items():
+    partials = [
+        {"apis": [{"rota": "/itens", "metodo": "GET"}, "texto solto"]},
+        {"apis": [{"rota": "/itens", "metodo": "DELETE"}]},
+        {},
+    ]
+    assert merge_apis(partials) == {"apis": [{"rota": "/itens", "metodo": "GET"}, {"rota": "/itens", "metodo": "DELETE"}]}
+
+
+def test_merge_apis_does_not_mutate_partials():
+    api = {"rota": "/a", "metodo": "GET", "parametros": {"x": "1"}}
+    merge_apis([{"apis": [api]}, {"apis": [{"rota": "/a", "metodo": "GET", "parametros": {"y": "2"}}]}])
+    assert api["parametros"] == {"x": "1"}
@@ -0,0 +1,67 @@
+import pytest
+
+import routing
+from routing import ModelRouter
+
+MODELS = ["gpt-4", "gpt-4o", "gpt-4o-mini"]
+
+
+def record(router, model, latency, valid=True, times=5, stage="apis"):
+    for _ in range(times):
+        router.record(stage, model, latency, valid)
+
+
+def test_untried_models_are_warmed_up_cheapest_first():
+    router = ModelRouter(min_samples=5)
+    assert router.choose("apis", MODELS) == "gpt-4o-mini"
+    record(router, "gpt-4o-mini", 1.0, times=4)
+    assert router.choose("apis", MODELS) == "gpt-4o-mini"
+
+
+def test_cheapest_model_within_latency_target_is_chosen():
+    router = ModelRouter(min_samples=5)
+    record(router, "gpt-4o-mini", 30.0)
+    record(router, "gpt-4o", 10.0)
+    assert router.choose("apis", MODELS, latency_target=15.0) == "gpt-4o"
+    assert router.choose("apis", MODELS, latency_target=None) == "gpt-4o-mini"
+
+
+def test_model_with_low_validity_is_skipped_during_warm_up():
+    router = ModelRouter(min_samples=5, min_validity=0.9)
+    router.record("apis", "gpt-4o-mini", 1.0, False)
+    assert router.choose("apis", MODELS) == "gpt-4o"
+
+
+def test_history_is_per_stage():
+    router = ModelRouter(min_samples=5)
+    record(router, "gpt-4o-mini", 1.0, valid=False, stage="apis")
+    assert router.choose("requisitos", MODELS) == "gpt-4o-mini"
+
+
+def test_falls_back_to_most_reliable_then_fastest_when_no_model_fits():
+    router = ModelRouter(min_samples=5)
+    record(router, "gpt-4o-mini", 20.0, valid=False)
+    record(router, "gpt-4o", 25.0)
+    record(router, "gpt-4", 22.0)
+    assert router.choose("apis", MODELS, latency_target=5.0) == "gpt-4"
+
+
+def test_old_samples_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(routing.time, "monotonic", lambda: now[0])
+    router = ModelRouter(min_samples=5, max_age=60.0)
+    record(router, "gpt-4o-mini", 1.0, valid=False)
+    assert router.choose("apis", MODELS) == "gpt-4o"
+    now[0] += 61
+    assert router.choose("apis", MODELS) == "gpt-4o-mini"
+    assert router.summary("apis", "gpt-4o-mini") == {"amostras": 0, "latencia": None, "validade": None}
+
+
+def test_summary_uses_the_configured_percentile():
+    router = ModelRouter(percentile=0.9)
+    for latency in range(1, 11):
+        router.record("apis", "gpt-4o", float(latency), latency != 10)
+    summary = router.summary("apis", "gpt-4o")
+    assert summary["amostras"] == 10
+    assert summary["latencia"] == 9.0
+    assert summary["validade"] == pytest.approx(0.9)
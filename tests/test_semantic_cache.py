@@ -0,0 +1,71 @@
+import pytest
+
+from semantic_cache import HashingVectorizer, SemanticCache, guard_terms, normalize_text
+
+BASE = (
+    "Um sistema de e-commerce onde usuários podem visualizar produtos, adicionar itens ao carrinho "
+    "e pagar com cartão de crédito. Os administradores gerenciam o estoque e os pedidos."
+)
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache()
+    cache.add(BASE, "requisitos do e-commerce")
+    return cache
+
+
+def test_normalize_text_ignores_case_accents_and_punctuation():
+    assert normalize_text("Cartão de CRÉDITO, já!") == "cartao de credito ja"
+
+
+def test_vectors_are_deterministic_and_normalized():
+    vectorizer = HashingVectorizer()
+    first, second = vectorizer.transform(BASE), vectorizer.transform(BASE)
+    assert (first == second).all()
+    assert float(first @ first) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("text", [BASE.upper(), BASE.replace("usuários", "usuarios"), BASE.replace(",", "") + "  "])
+def test_formatting_variants_hit(cache, text):
+    score, value = cache.lookup(text)
+    assert value == "requisitos do e-commerce"
+    assert score == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        BASE.replace("podem visualizar", "NÃO podem visualizar"),
+        BASE + " O sistema também envia notificações por e-mail.",
+        BASE.replace("cartão de crédito", "boleto bancário"),
+        BASE + " Suporta 100 usuários simultâneos.",
+        BASE.replace("Os administradores gerenciam", "Os administradores não gerenciam"),
+    ],
+    ids=["negacao", "frase_extra", "pagamento_diferente", "numero", "negacao_no_fim"],
+)
+def test_near_miss_descriptions_are_not_served(cache, text):
+    assert cache.lookup(text) is None
+
+
+def test_negation_is_a_miss_even_with_a_permissive_threshold(cache):
+    text = BASE.replace("podem visualizar", "não podem visualizar")
+    assert cache.lookup(text, threshold=0.5) is None
+
+
+def test_guard_terms_capture_negations_and_numbers():
+    assert guard_terms("Não permite mais de 10 pedidos") == frozenset({"nao permite", "10"})
+    assert guard_terms(BASE) == frozenset()
+
+
+def test_namespaces_are_isolated(cache):
+    assert cache.lookup(BASE, namespace=("gpt-4o", 0.7)) is None
+    cache.add(BASE, "outro modelo", namespace=("gpt-4o", 0.7))
+    assert cache.lookup(BASE, namespace=("gpt-4o", 0.7))[1] == "outro modelo"
+    assert cache.lookup(BASE)[1] == "requisitos do e-commerce"
+
+
+def test_stats_count_hits_and_misses(cache):
+    cache.lookup(BASE)
+    cache.lookup("Um sistema de gestão escolar com matrículas e notas.")
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
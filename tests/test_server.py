@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from checkpoints import FAILED, CheckpointStore
+from fake_llm import FAKE_RESPONSES, FakeDocumentationLLM
+from jobs import JOB_DONE
+from pipeline import create_chains
+from server import create_app
+
+DESCRIPTION = "Um sistema de biblioteca com cadastro de livros e empréstimos."
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CheckpointStore(str(tmp_path / "execucoes.sqlite"))
+
+
+@pytest.fixture
+def serve(store):
+    """Executa `scenario(client)` com o serviço usando o modelo local de respostas fixas."""
+
+    def run(scenario):
+        async def main():
+            chains = create_chains(FakeDocumentationLLM(chunk_size=16), "fake", 0.0)
+            app = create_app(chains, store, max_concurrency=4, pdf_workers=1)
+            async with TestClient(TestServer(app)) as client:
+                return await scenario(client)
+
+        return asyncio.run(main())
+
+    return run
+
+
+async def wait_done(client, run_id):
+    for _ in range(200):
+        response = await client.get(f"/documentacao/{run_id}")
+        body = await response.json()
+        if body["status"] == JOB_DONE:
+            return body
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"A execução {run_id} não terminou: {body}")
+
+
+def test_generation_runs_in_background_and_returns_every_stage(serve):
+    async def scenario(client):
+        response = await client.post("/documentacao", json={"descricao": DESCRIPTION})
+        assert response.status == 202
+        body = await response.json()
+        assert response.headers["Location"] == f"/documentacao/{body['id']}"
+        status = await wait_done(client, body["id"])
+        result = await client.get(body["links"]["resultado"])
+        return status, await result.json()
+
+    status, result = serve(scenario)
+    assert status["etapas_concluidas"] == ["requisitos", "fluxo", "apis"]
+    assert result["requisitos"] == FAKE_RESPONSES["requisitos"]
+    assert result["fluxo_componentes"]["componentes"] == FAKE_RESPONSES["fluxo"]["componentes"]
+    assert [api["rota"] for api in result["mapa_apis"]["apis"]] == [api["rota"] for api in FAKE_RESPONSES["apis"]["apis"]]
+
+
+def test_events_stream_items_and_completion(serve):
+    async def scenario(client):
+        response = await client.post(
+            "/documentacao", json={"descricao": DESCRIPTION}, headers={"Accept": "text/event-stream"}
+        )
+        assert response.headers["Content-Type"].startswith("text/event-stream")
+        return await response.text()
+
+    text = serve(scenario)
+    events = [line.split(": ", 1)[1] for line in text.splitlines() if line.startswith("event: ")]
+    assert events.count("etapa_concluida") == 3
+    assert "item" in events
+    assert events[-1] == JOB_DONE
+
+
+@pytest.mark.parametrize("body", [{}, {"descricao": "   "}, ["descricao"]])
+def test_invalid_requests_are_rejected(serve, body):
+    async def scenario(client):
+        response = await client.post("/documentacao", json=body)
+        return response.status, await response.json()
+
+    status, body = serve(scenario)
+    assert status == 400
+    assert "descricao" in body["erro"]
+
+
+def test_idempotency_key_replays_the_same_run(serve):
+    async def scenario(client):
+        headers = {"Idempotency-Key": "pedido-1"}
+        first = await client.post("/documentacao", json={"descricao": DESCRIPTION}, headers=headers)
+        second = await client.post("/documentacao", json={"descricao": DESCRIPTION}, headers=headers)
+        conflict = await client.post("/documentacao", json={"descricao": "Outro sistema"}, headers=headers)
+        first_body, second_body = await first.json(), await second.json()
+        await wait_done(client, first_body["id"])
+        return first.status, second, second_body["id"] == first_body["id"], conflict.status
+
+    first_status, second, same_run, conflict_status = serve(scenario)
+    assert first_status == 202
+    assert second.status == 200 and second.headers["Idempotent-Replayed"] == "true"
+    assert same_run
+    assert conflict_status == 422
+
+
+def test_failed_run_resumes_from_its_checkpoint(serve, store):
+    run_id = store.create_run(DESCRIPTION, {"rascunho": False})
+    saved = {"requisitos_funcionais": [{"id": "RF99", "descricao": "Salvo antes da falha", "prioridade": "Alta"}],
+             "requisitos_nao_funcionais": []}
+    store.save_stage(run_id, "requisitos", saved)
+    store.set_status(run_id, FAILED, "queda da API")
+
+    async def scenario(client):
+        incomplete = await client.get(f"/documentacao/{run_id}/resultado")
+        resumed = await client.post(f"/documentacao/{run_id}/retomar")
+        await wait_done(client, run_id)
+        again = await client.post(f"/documentacao/{run_id}/retomar")
+        result = await client.get(f"/documentacao/{run_id}/resultado")
+        return incomplete.status, resumed.status, again.status, await result.json()
+
+    incomplete_status, resumed_status, again_status, result = serve(scenario)
+    assert incomplete_status == 409
+    assert resumed_status == 202
+    assert again_status == 409
+    # A etapa salva não é gerada de novo
+    assert result["requisitos"] == saved
+    assert set(store.load(run_id)["resultados"]) == {"requisitos", "fluxo", "apis"}
+
+
+def test_run_in_progress_elsewhere_is_not_resumed(serve, store):
+    run_id = store.create_run(DESCRIPTION)
+
+    async def scenario(client):
+        running = await client.post(f"/documentacao/{run_id}/retomar")
+        missing = await client.post("/documentacao/inexistente/retomar")
+        status = await client.get(f"/documentacao/{run_id}")
+        return running.status, missing.status, await status.json()
+
+    running_status, missing_status, status = serve(scenario)
+    assert running_status == 409
+    assert missing_status == 404
+    assert status["run_id"] == run_id and status["etapas_concluidas"] == []
+
+
+def test_health_reports_jobs(serve):
+    async def scenario(client):
+        response = await client.post("/documentacao", json={"descricao": DESCRIPTION})
+        await wait_done(client, (await response.json())["id"])
+        response = await client.get("/saude")
+        return await response.json()
+
+    body = serve(scenario)
+    assert body["status"] == "ok"
+    assert body["jobs"] == {"na_fila": 0, "executando": 0, "concluidos": 1}
+    assert body["chamadas_compartilhadas"]["em_andamento"] == 0